@@ -0,0 +1,292 @@
+"""
+Compara os caminhos de consulta do dashboard (pandas com o cubo e os MOTORES_CONSULTA) com DuckDB e Polars
+
+Mede, para algumas combinações típicas de filtros da sidebar, o tempo de
+responder às agregações dos painéis (consultar) e a memória que cada
+alternativa mantém, e confere se todas devolvem os mesmos agregados.
+
+Os backends de BACKEND_CONSULTAS (ex.: arrow) rodam pelo próprio dashboard,
+sobre os snapshots processados.
+
+Os motores consultam a base processada gravada como Parquet particionado
+por ano e mês (ano=AAAA/mes=M, o mesmo layout de LEITURA_POR_PERIODO):
+
+- DuckDB: read_parquet(..., hive_partitioning=true); os filtros da sidebar
+  viram o WHERE, o período também poda as partições, e as dimensões viram
+  o GROUP BY
+- Polars: um plano lazy por consulta (scan, filtro, group_by e somas),
+  executados juntos por collect_all; só o resultado vira pandas
+
+Uso:
+    python comparar_backends.py [--arquivo dados.parquet] [--repeticoes 5]
+
+O tempo do pandas inclui o recorte do cubo e do índice de filtros a cada
+combinação (o trabalho de um rerun); a montagem única do cubo e do índice
+é informada à parte. Motores cujo pacote não está instalado são ignorados.
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import dashboard_sus_v2 as dash
+
+# Agrupamentos pedidos pelos painéis a consultar() (dimensões, dropna)
+CONSULTAS = [
+    ([], True),
+    (['MES'], True),
+    (['NOME_MUNIC_RES'], True),
+    (['NOME_CID_PRINC'], True),
+    (['NOME_PROC_REA'], True),
+    (['SEXO', 'FAIXA_ETARIA'], True),
+    (['RACA_COR'], True),
+    (list(dash.DIMENSOES_FLUXO), False),
+]
+
+def mais_comum(df, coluna):
+    """Valor mais comum da coluna (o filtro de um valor mais provável na sidebar)"""
+    return df[coluna].value_counts().index[0]
+
+def cenarios(df):
+    """Combinações de filtros medidas: sem filtro, um município, um estabelecimento, um CID e um período"""
+    inicio = df['DATA_CMPT'].min()
+    return {
+        'sem filtros': {},
+        'um município': {'municipio_residencia': [mais_comum(df, 'NOME_MUNIC_RES')]},
+        'um estabelecimento': {'cnes': [mais_comum(df, 'CNES')]},
+        'um CID': {'cid': [mais_comum(df, 'NOME_CID_PRINC')]},
+        'dois meses': {'data_inicio': inicio.date(),
+                       'data_fim': (inicio + pd.DateOffset(months=2) - pd.Timedelta(days=1)).date()},
+    }
+
+def megabytes(df):
+    """Memória ocupada por um DataFrame, em MB"""
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+def gravar_particionado(df, destino):
+    """Grava a base processada em Parquet particionado por ano e mês de DATA_CMPT; retorna o tamanho em MB"""
+    datas = df['DATA_CMPT']
+    tabela = pa.Table.from_pandas(
+        df.assign(ano=datas.dt.year.fillna(0).astype('int32'), mes=datas.dt.month.fillna(0).astype('int32')),
+        preserve_index=False)
+    ds.write_dataset(tabela, destino, format='parquet', partitioning=['ano', 'mes'], partitioning_flavor='hive')
+    return sum(os.path.getsize(os.path.join(pasta, nome))
+               for pasta, _, nomes in os.walk(destino) for nome in nomes) / 2 ** 20
+
+def consultas_pandas(df, cubo, indices, filtros):
+    """Agregações pelo caminho do dashboard: cubo filtrado (ou microdados) sobre a visão filtrada"""
+    visao = dash.VisaoFiltrada(df, dash.posicoes_filtradas(indices['base'], filtros))
+    cubo_filtrado = dash.filtrar_cubo(cubo, filtros, indices['cubo'])
+    return [dash.consultar(visao, cubo_filtrado, dims, dropna) for dims, dropna in CONSULTAS]
+
+def consultas_motor(df, indices, motor, filtros):
+    """Agregações por um backend opcional do dashboard (MOTORES_CONSULTA)"""
+    visao = dash.VisaoFiltrada(df, dash.posicoes_filtradas(indices['base'], filtros), motor=motor)
+    return [dash.consultar(visao, None, dims, dropna) for dims, dropna in CONSULTAS]
+
+def clausula_where(colunas, filtros):
+    """Filtros da sidebar como WHERE parametrizado (o período poda também as partições ano/mes)"""
+    condicoes, parametros = [], []
+    if 'data_inicio' in filtros and 'data_fim' in filtros:
+        inicio, fim = pd.Timestamp(filtros['data_inicio']), pd.Timestamp(filtros['data_fim'])
+        condicoes.append("ano * 100 + mes BETWEEN ? AND ?")
+        parametros += [inicio.year * 100 + inicio.month, fim.year * 100 + fim.month]
+        condicoes.append("CAST(DATA_CMPT AS DATE) BETWEEN ? AND ?")
+        parametros += [inicio.date(), fim.date()]
+    for chave, col in dash.colunas_dos_filtros(colunas):
+        if filtros.get(chave):
+            condicoes.append(f'"{col}" IN ({", ".join("?" * len(filtros[chave]))})')
+            # Escalares numpy (ex.: CNES) viram tipos Python para o DuckDB
+            parametros += [valor.item() if hasattr(valor, 'item') else valor for valor in filtros[chave]]
+    return (" WHERE " + " AND ".join(condicoes)) if condicoes else "", parametros
+
+def consulta_sql(fonte, colunas, dimensoes, dropna, where):
+    """SELECT equivalente a agregar_microdados(df, dimensoes, dropna)"""
+    expressoes = ["date_trunc('month', DATA_CMPT) AS MES" if dim == 'MES' else f'"{dim}"' for dim in dimensoes]
+    medidas = [col for col in dash.MEDIDAS_CUBO if col in colunas]
+    agregados = (["COUNT(*) AS Total"] + [f'SUM("{col}") AS "{col}"' for col in medidas]
+                 + [f'COUNT("{col}") AS "{col}_N"' for col in medidas])
+    if dropna and dimensoes:
+        ausentes = ' AND '.join('DATA_CMPT IS NOT NULL' if dim == 'MES' else f'"{dim}" IS NOT NULL'
+                                for dim in dimensoes)
+        where = f"{where} AND {ausentes}" if where else f" WHERE {ausentes}"
+    sql = f"SELECT {', '.join(expressoes + agregados)} FROM {fonte}{where}"
+    if dimensoes:
+        sql += f" GROUP BY {', '.join(str(i + 1) for i in range(len(dimensoes)))}"
+    return sql
+
+def consultas_duckdb(conexao, fonte, colunas, filtros):
+    """Agregações em SQL sobre o Parquet particionado, uma consulta por agrupamento"""
+    where, parametros = clausula_where(colunas, filtros)
+    return [conexao.execute(consulta_sql(fonte, colunas, dims, dropna, where), parametros).df()
+            for dims, dropna in CONSULTAS]
+
+def predicado_polars(pl, colunas, filtros):
+    """Filtros da sidebar como expressão Polars (o período poda também as partições ano/mes)"""
+    predicado = pl.lit(True)
+    if 'data_inicio' in filtros and 'data_fim' in filtros:
+        inicio, fim = pd.Timestamp(filtros['data_inicio']), pd.Timestamp(filtros['data_fim'])
+        predicado &= (pl.col('ano') * 100 + pl.col('mes')).is_between(inicio.year * 100 + inicio.month,
+                                                                      fim.year * 100 + fim.month)
+        predicado &= pl.col('DATA_CMPT').dt.date().is_between(inicio.date(), fim.date())
+    for chave, col in dash.colunas_dos_filtros(colunas):
+        if filtros.get(chave):
+            valores = [valor.item() if hasattr(valor, 'item') else valor for valor in filtros[chave]]
+            # Categorias comparadas como texto; códigos numéricos (ex.: CNES) como float
+            if isinstance(valores[0], str):
+                predicado &= pl.col(col).cast(pl.String).is_in(valores)
+            else:
+                predicado &= pl.col(col).cast(pl.Float64).is_in([float(valor) for valor in valores])
+    return predicado
+
+def plano_polars(pl, fonte, colunas, dimensoes, dropna, predicado):
+    """LazyFrame equivalente a agregar_microdados(df, dimensoes, dropna)"""
+    medidas = [col for col in dash.MEDIDAS_CUBO if col in colunas]
+    agregados = ([pl.len().alias('Total')] + [pl.col(col).sum() for col in medidas]
+                 + [pl.col(col).count().alias(f"{col}_N") for col in medidas])
+    plano = fonte.filter(predicado)
+    if not dimensoes:
+        return plano.select(agregados)
+    chaves = [pl.col('DATA_CMPT').dt.truncate('1mo').alias('MES') if dim == 'MES' else pl.col(dim)
+              for dim in dimensoes]
+    plano = plano.with_columns(chaves)
+    if dropna:
+        plano = plano.drop_nulls(dimensoes)
+    return plano.group_by(dimensoes).agg(agregados)
+
+def consultas_polars(pl, fonte, colunas, filtros):
+    """Agregações como planos lazy executados juntos; a conversão para pandas só no fim"""
+    predicado = predicado_polars(pl, colunas, filtros)
+    planos = [plano_polars(pl, fonte, colunas, dims, dropna, predicado) for dims, dropna in CONSULTAS]
+    return [resultado.to_pandas() for resultado in pl.collect_all(planos)]
+
+def medir(funcao, repeticoes):
+    """Menor tempo (s) entre as repetições e o resultado da última"""
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor, resultado
+
+def normalizado(resultado, dimensoes):
+    """Agregado com dimensões em texto e linhas ordenadas, para comparar saídas de motores diferentes"""
+    resultado = resultado[sorted(resultado.columns)].astype({dim: object for dim in dimensoes})
+    if 'MES' in dimensoes:
+        resultado['MES'] = pd.to_datetime(resultado['MES']).astype('datetime64[ns]')
+    if dimensoes:
+        resultado = resultado.sort_values(dimensoes, na_position='last', ignore_index=True)
+    return resultado.astype({col: float for col in resultado.columns if col not in dimensoes})
+
+def iguais(referencia, resultados):
+    """Se as listas de agregados coincidem (floats com tolerância de soma em outra ordem)"""
+    try:
+        for (dimensoes, _), esperado, obtido in zip(CONSULTAS, referencia, resultados):
+            pd.testing.assert_frame_equal(normalizado(esperado, dimensoes), normalizado(obtido, dimensoes),
+                                          check_exact=False, rtol=1e-9)
+    except AssertionError:
+        return False
+    return True
+
+def importar(nome):
+    """Módulo opcional, ou None se o pacote não estiver instalado"""
+    try:
+        return importlib.import_module(nome)
+    except ImportError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara pandas (cubo), DuckDB e Polars (Parquet particionado)")
+    parser.add_argument("--arquivo", default=None, help="Base a usar (padrão: CAMINHO_ARQUIVO do dashboard)")
+    parser.add_argument("--repeticoes", type=int, default=5, help="Repetições por medida (vale a menor)")
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore')
+    logging.getLogger("dashboard_sih").setLevel(logging.WARNING)
+    if args.arquivo:
+        dash.CAMINHO_ARQUIVO = args.arquivo
+
+    print(f"[*] Carregando a base {dash.CAMINHO_ARQUIVO}...")
+    df = dash.carregar_dados()
+    if df is None:
+        print(f"[ERRO] Nao foi possivel carregar '{dash.CAMINHO_ARQUIVO}'")
+        sys.exit(1)
+    print(f"     {len(df):,} linhas")
+
+    inicio = time.perf_counter()
+    cubo = dash.construir_cubo(df)
+    indices = {'base': dash.construir_indice_filtros(df),
+               'cubo': {nome: dash.construir_indice_filtros(rollup) for nome, rollup in cubo.items()}}
+    print(f"[*] Cubo e indices do pandas (uma vez por carga): {time.perf_counter() - inicio:.2f} s")
+
+    duckdb, pl = importar('duckdb'), importar('polars')
+    with tempfile.TemporaryDirectory() as pasta:
+        tamanho = gravar_particionado(df, pasta)
+        backends = {'pandas': lambda filtros: consultas_pandas(df, cubo, indices, filtros)}
+        bases_motores = {}
+        for nome, classe in dash.MOTORES_CONSULTA.items():
+            base = dash.carregar_base_consultas(nome)
+            if base is None:
+                print(f"[!] Backend {nome} ignorado (sem snapshot)")
+                continue
+            bases_motores[nome] = base
+            backends[nome] = lambda filtros, classe=classe, base=base: consultas_motor(
+                df, indices, classe(base, df, filtros), filtros)
+        if duckdb is not None:
+            conexao = duckdb.connect()
+            fonte_sql = f"read_parquet('{pasta}/**/*.parquet', hive_partitioning=true)"
+            backends['duckdb'] = lambda filtros: consultas_duckdb(conexao, fonte_sql, df.columns, filtros)
+        if pl is not None:
+            fonte_lazy = pl.scan_parquet(f"{pasta}/**/*.parquet", hive_partitioning=True)
+            backends['polars'] = lambda filtros: consultas_polars(pl, fonte_lazy, df.columns, filtros)
+        for nome, modulo in (('duckdb', duckdb), ('polars', pl)):
+            if modulo is None:
+                print(f"[!] {nome} ignorado (pip install {nome})")
+        print()
+
+        totais = dict.fromkeys(backends, 0.0)
+        divergencias = []
+        print(f"     {'cenario':<20}" + ''.join(f"{nome:>12}" for nome in backends))
+        for rotulo, filtros in cenarios(df).items():
+            tempos, referencia = [], None
+            for nome, executar in backends.items():
+                tempo, resultados = medir(lambda: executar(filtros), args.repeticoes)
+                tempos.append(tempo)
+                totais[nome] += tempo
+                if referencia is None:
+                    referencia = resultados
+                elif not iguais(referencia, resultados):
+                    divergencias.append(f"{nome} em '{rotulo}'")
+            print(f"     {rotulo:<20}" + ''.join(f"{tempo * 1000:>10.1f}ms" for tempo in tempos))
+        print(f"     {'total':<20}" + ''.join(f"{total * 1000:>10.1f}ms" for total in totais.values()))
+        print()
+
+        print("[*] Memoria mantida entre consultas:")
+        print(f"     pandas: base {megabytes(df):.1f} MB + cubo "
+              f"{sum(megabytes(rollup) for rollup in cubo.values()):.1f} MB")
+        for nome, base in bases_motores.items():
+            print(f"     {nome}: {base.nbytes / 2 ** 20:.1f} MB")
+        if duckdb is not None:
+            memoria = conexao.execute("SELECT SUM(memory_usage_bytes) FROM duckdb_memory()").fetchone()[0]
+            print(f"     duckdb: {(memoria or 0) / 2 ** 20:.1f} MB")
+        if pl is not None:
+            print("     polars: nenhuma (cada plano relê o Parquet)")
+        print(f"     Parquet particionado em disco: {tamanho:.1f} MB")
+        print()
+
+    if divergencias:
+        print("[ERRO] Resultados diferentes do pandas:")
+        for divergencia in divergencias:
+            print(f"     - {divergencia}")
+        sys.exit(1)
+    print("[OK] Todos os caminhos devolveram os mesmos agregados")
+    print(f"[!] Mais rapido nesta base: {min(totais, key=totais.get)}")
@@ -3,25 +3,108 @@ Script para converter dados.xlsx para formato Parquet
 O formato Parquet é até 10x mais rápido para carregar que Excel
 
 Uso:
-    python converter_para_parquet.py
+    python converter_para_parquet.py [arquivo.xlsx] [--saida arquivo.parquet]
+    python converter_para_parquet.py dados.xlsx --streaming [--linhas-por-bloco 100000]
+    python converter_para_parquet.py dados.xlsx --particionar [--saida dados]
+    python converter_para_parquet.py rd_2025_08.xlsx --anexar dados [--streaming]
+
+O modo --streaming lê a planilha em blocos de linhas e grava cada bloco como um
+row group do Parquet, mantendo a memória constante independentemente do tamanho
+do arquivo de entrada.
+
+O modo --particionar grava um dataset Parquet particionado no estilo Hive por
+ano/mês de Data_Internacao (dados/ano=2025/mes=1/...), permitindo que o dashboard
+leia do disco apenas os meses do período analisado.
+
+O modo --anexar converte apenas o novo arquivo e o incorpora a um dataset
+particionado existente, validando o esquema. Cada arquivo gravado leva o nome do
+arquivo de origem; anexar de novo um arquivo com o mesmo nome (ex.: um mês
+republicado pelo DATASUS) substitui somente os dados gravados por ele.
 """
 
-import pandas as pd
+import argparse
+import os
+import re
+import shutil
 import sys
 from pathlib import Path
 
-def converter_excel_para_parquet(arquivo_entrada, arquivo_saida=None):
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+from esquema_sih import aplicar_esquema, resumo_esquema, tabela_de_pandas
+
+LINHAS_POR_BLOCO = 100_000
+
+# Coluna de data que define a partição ano/mês do dataset particionado
+COLUNA_PARTICAO = 'Data_Internacao'
+PARTICIONAMENTO = ds.partitioning(pa.schema([('ano', pa.int16()), ('mes', pa.int8())]), flavor='hive')
+
+def tamanho_em_mb(caminho):
+    """Tamanho de um arquivo, ou da soma dos arquivos de um diretório, em MB"""
+    caminho = Path(caminho)
+    if caminho.is_dir():
+        total = sum(arquivo.stat().st_size for arquivo in caminho.rglob('*') if arquivo.is_file())
+    else:
+        total = caminho.stat().st_size
+    return total / (1024 * 1024)
+
+def gravar_particionado(tabela, destino, prefixo='parte'):
+    """
+    Grava a tabela no dataset Hive particionado por ano/mês de COLUNA_PARTICAO
+
+    Args:
+        tabela: Tabela Arrow com a coluna COLUNA_PARTICAO
+        destino: Diretório raiz do dataset
+        prefixo: Prefixo dos arquivos gravados (deve ser único por chamada)
+    """
+    if COLUNA_PARTICAO not in tabela.column_names:
+        raise ValueError(f"Coluna '{COLUNA_PARTICAO}' necessaria para particionar nao encontrada")
+
+    datas = tabela[COLUNA_PARTICAO]
+    tabela = tabela.append_column('ano', pc.year(datas).cast(pa.int16()))
+    tabela = tabela.append_column('mes', pc.month(datas).cast(pa.int8()))
+
+    ds.write_dataset(
+        tabela,
+        destino,
+        format='parquet',
+        partitioning=PARTICIONAMENTO,
+        basename_template=f"{prefixo}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+        file_options=ds.ParquetFileFormat().make_write_options(compression='snappy')
+    )
+
+def padrao_arquivos_origem(origem):
+    """Nomes dos arquivos de partição gravados a partir do arquivo de origem (ver gravar_particionado)"""
+    return re.compile(rf"{re.escape(origem)}-(bloco\d{{5}}-)?\d+\.parquet")
+
+def substituir_saida(temporario, destino):
+    """Move o resultado temporário para o destino final, substituindo a versão anterior"""
+    if Path(destino).is_dir():
+        shutil.rmtree(destino)
+    os.replace(temporario, destino)
+
+def converter_excel_para_parquet(arquivo_entrada, arquivo_saida=None, particionar=False):
     """
     Converte arquivo Excel para Parquet
 
     Args:
         arquivo_entrada: Caminho do arquivo .xlsx
         arquivo_saida: Caminho do arquivo .parquet (opcional, usa mesmo nome se não especificado)
+        particionar: Se True, grava um dataset particionado por ano/mês no diretório arquivo_saida
+
+    Returns:
+        Caminho da saída gravada
     """
 
     # Definir arquivo de saída
     if arquivo_saida is None:
-        arquivo_saida = Path(arquivo_entrada).stem + '.parquet'
+        arquivo_saida = Path(arquivo_entrada).stem + ('' if particionar else '.parquet')
 
     print(f"[*] Convertendo {arquivo_entrada} para Parquet...")
     print(f"[*] Arquivo de saída: {arquivo_saida}")
@@ -41,55 +124,25 @@ def converter_excel_para_parquet(arquivo_entrada, arquivo_saida=None):
         print(f"     Tamanho original: {tamanho_mb:.1f} MB")
         print()
 
-        # Otimizar tipos de dados para reduzir tamanho
-        print("[*] Otimizando tipos de dados...")
-
-        # Converter colunas categóricas
-        colunas_categoricas = []
-        colunas_data = []
-
-        # Identificar colunas de data
-        for col in df.columns:
-            if 'data' in col.lower() or 'dt_' in col.lower():
-                colunas_data.append(col)
-
-        for col in df.columns:
-            # Pular colunas de data
-            if col in colunas_data:
-                continue
-
-            # Se a coluna tem menos de 50% de valores únicos, pode ser categórica
-            if df[col].dtype == 'object':
-                razao_unica = df[col].nunique() / len(df)
-                if razao_unica < 0.5:
-                    try:
-                        df[col] = df[col].astype('category')
-                        colunas_categoricas.append(col)
-                    except:
-                        # Se falhar, manter como object
-                        pass
-
-        print(f"     {len(colunas_categoricas)} colunas convertidas para categoricas")
-
-        # Converter colunas de data para datetime
-        print("[*] Convertendo colunas de data...")
-        for col in colunas_data:
-            if col in df.columns:
-                try:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-                except:
-                    pass
+        # Aplicar o registro de tipos do SIH/RD (esquema_sih.py) em um único cast
+        print("[*] Aplicando esquema SIH/RD...")
+        tabela = aplicar_esquema(tabela_de_pandas(df))
+        del df
+        registradas, outras = resumo_esquema(tabela.schema)
+        print(f"     {registradas} colunas tipadas pelo registro, {outras} com tipo padrao")
 
         # Salvar como Parquet
-        print("[*] Salvando arquivo Parquet...")
-        df.to_parquet(
-            arquivo_saida,
-            engine='pyarrow',
-            compression='snappy',
-            index=False
-        )
-
-        tamanho_parquet_mb = Path(arquivo_saida).stat().st_size / (1024 * 1024)
+        if particionar:
+            print("[*] Salvando dataset Parquet particionado por ano/mes...")
+            temporario = str(arquivo_saida) + '.tmp'
+            shutil.rmtree(temporario, ignore_errors=True)
+            gravar_particionado(tabela, temporario, prefixo=Path(arquivo_entrada).stem)
+            substituir_saida(temporario, arquivo_saida)
+        else:
+            print("[*] Salvando arquivo Parquet...")
+            pq.write_table(tabela, arquivo_saida, compression='snappy')
+
+        tamanho_parquet_mb = tamanho_em_mb(arquivo_saida)
         reducao = (1 - tamanho_parquet_mb / tamanho_mb) * 100
 
         print()
@@ -97,8 +150,110 @@ def converter_excel_para_parquet(arquivo_entrada, arquivo_saida=None):
         print(f"     Tamanho Parquet: {tamanho_parquet_mb:.1f} MB")
         print(f"     Reducao de tamanho: {reducao:.1f}%")
         print(f"     Velocidade de carregamento esperada: 5-10x mais rapida")
+        return arquivo_saida
+
+    except FileNotFoundError:
+        print(f"[ERRO] Arquivo '{arquivo_entrada}' nao encontrado")
+        sys.exit(1)
+    except Exception as e:
+        print(f"[ERRO] Erro durante conversao: {str(e)}")
+        sys.exit(1)
+
+def ler_blocos_excel(arquivo_entrada, linhas_por_bloco):
+    """
+    Lê a primeira planilha do Excel em modo somente leitura, bloco a bloco
+
+    Yields:
+        DataFrame com até linhas_por_bloco linhas, com as colunas do cabeçalho
+    """
+    workbook = load_workbook(arquivo_entrada, read_only=True, data_only=True)
+    try:
+        linhas = workbook.worksheets[0].iter_rows(values_only=True)
+        cabecalho = [str(nome) for nome in next(linhas)]
+
+        bloco = []
+        for linha in linhas:
+            bloco.append(linha)
+            if len(bloco) >= linhas_por_bloco:
+                yield pd.DataFrame.from_records(bloco, columns=cabecalho)
+                bloco = []
+        if bloco:
+            yield pd.DataFrame.from_records(bloco, columns=cabecalho)
+    finally:
+        workbook.close()
+
+def converter_excel_para_parquet_streaming(arquivo_entrada, arquivo_saida=None, linhas_por_bloco=LINHAS_POR_BLOCO,
+                                           particionar=False):
+    """
+    Converte arquivo Excel para Parquet em blocos, com memória constante
+
+    Cada bloco de linhas é gravado como um row group (ou, se particionado, como
+    um arquivo por mês presente no bloco). Os tipos vêm do registro SIH/RD
+    (esquema_sih.py); colunas fora do registro têm o tipo fixado pelo primeiro
+    bloco e aplicado a todos os seguintes.
+
+    Args:
+        arquivo_entrada: Caminho do arquivo .xlsx
+        arquivo_saida: Caminho do arquivo .parquet (opcional, usa mesmo nome se não especificado)
+        linhas_por_bloco: Número de linhas lidas e gravadas por vez
+        particionar: Se True, grava um dataset particionado por ano/mês no diretório arquivo_saida
+
+    Returns:
+        Caminho da saída gravada
+    """
+
+    if arquivo_saida is None:
+        arquivo_saida = Path(arquivo_entrada).stem + ('' if particionar else '.parquet')
+
+    print(f"[*] Convertendo {arquivo_entrada} para Parquet (streaming, {linhas_por_bloco:,} linhas por bloco)...")
+    print(f"[*] Arquivo de saída: {arquivo_saida}")
+    print()
+
+    # Grava em arquivo temporário para não deixar um Parquet incompleto em caso de erro
+    arquivo_temporario = str(arquivo_saida) + '.tmp'
+    shutil.rmtree(arquivo_temporario, ignore_errors=True)
+    writer = None
+    esquema = None
+    try:
+        tamanho_mb = Path(arquivo_entrada).stat().st_size / (1024 * 1024)
+        total_linhas = 0
+
+        for numero, bloco in enumerate(ler_blocos_excel(arquivo_entrada, linhas_por_bloco), start=1):
+            tabela = aplicar_esquema(tabela_de_pandas(bloco), esquema)
+
+            if esquema is None:
+                esquema = tabela.schema
+                if not particionar:
+                    writer = pq.ParquetWriter(arquivo_temporario, esquema, compression='snappy')
+                registradas, outras = resumo_esquema(esquema)
+                print(f"[*] Esquema SIH/RD: {registradas} colunas do registro, {outras} com tipo padrao")
+            if particionar:
+                gravar_particionado(tabela, arquivo_temporario,
+                                    prefixo=f"{Path(arquivo_entrada).stem}-bloco{numero:05d}")
+            else:
+                writer.write_table(tabela)
+            total_linhas += len(bloco)
+            print(f"     Bloco {numero}: {len(bloco):,} linhas gravadas (total: {total_linhas:,})")
+
+        if esquema is None:
+            print("[ERRO] A planilha nao contem linhas de dados")
+            sys.exit(1)
+
+        if writer is not None:
+            writer.close()
+            writer = None
+        substituir_saida(arquivo_temporario, arquivo_saida)
+
+        tamanho_parquet_mb = tamanho_em_mb(arquivo_saida)
+        reducao = (1 - tamanho_parquet_mb / tamanho_mb) * 100
+
         print()
-        print(f"[!] Para usar no dashboard, altere CAMINHO_ARQUIVO para: '{arquivo_saida}'")
+        print("[OK] Conversao concluida com sucesso!")
+        print(f"     {total_linhas:,} linhas x {len(esquema)} colunas")
+        print(f"     Tamanho original: {tamanho_mb:.1f} MB")
+        print(f"     Tamanho Parquet: {tamanho_parquet_mb:.1f} MB")
+        print(f"     Reducao de tamanho: {reducao:.1f}%")
+        return arquivo_saida
 
     except FileNotFoundError:
         print(f"[ERRO] Arquivo '{arquivo_entrada}' nao encontrado")
@@ -106,25 +261,139 @@ def converter_excel_para_parquet(arquivo_entrada, arquivo_saida=None):
     except Exception as e:
         print(f"[ERRO] Erro durante conversao: {str(e)}")
         sys.exit(1)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.isdir(arquivo_temporario):
+            shutil.rmtree(arquivo_temporario)
+        elif os.path.exists(arquivo_temporario):
+            os.remove(arquivo_temporario)
+
+def diferencas_esquema(atual, novo):
+    """Descreve as colunas que divergem entre o esquema do dataset e o do arquivo novo"""
+    diferencas = [f"coluna '{nome}' ausente no arquivo novo" for nome in atual.names if nome not in novo.names]
+    diferencas += [f"coluna '{nome}' nao existe no dataset" for nome in novo.names if nome not in atual.names]
+    diferencas += [
+        f"coluna '{campo.name}': {campo.type} no dataset, {novo.field(campo.name).type} no arquivo novo"
+        for campo in atual
+        if campo.name in novo.names and novo.field(campo.name).type != campo.type
+    ]
+    return diferencas
+
+def anexar_ao_dataset(arquivo_entrada, destino, streaming=False, linhas_por_bloco=LINHAS_POR_BLOCO):
+    """
+    Incorpora um novo arquivo (ex.: um mês do SIH) a um dataset particionado existente
+
+    Apenas o arquivo novo é convertido. Os arquivos gravados por ele em cada partição
+    ano/mês levam o nome do arquivo de origem, então anexar novamente um arquivo com
+    o mesmo nome (mês republicado pelo DATASUS) substitui somente os dados que ele
+    havia gravado; os dados das demais origens não são lidos nem regravados.
+
+    Args:
+        arquivo_entrada: Caminho do arquivo .xlsx com os dados novos
+        destino: Diretório do dataset particionado (criado se não existir)
+        streaming: Se True, converte o arquivo novo em blocos de linhas
+        linhas_por_bloco: Número de linhas por bloco no modo streaming
+    """
+    destino = Path(destino)
+    if destino.exists() and not destino.is_dir():
+        print(f"[ERRO] '{destino}' e um arquivo Parquet unico; o modo --anexar exige um dataset particionado")
+        print("[!] Reconverta a base completa com --particionar")
+        sys.exit(1)
+
+    origem = Path(arquivo_entrada).stem
+    novo = Path(f"{destino}.novo")
+    shutil.rmtree(novo, ignore_errors=True)
+
+    try:
+        if streaming:
+            converter_excel_para_parquet_streaming(arquivo_entrada, novo, linhas_por_bloco, particionar=True)
+        else:
+            converter_excel_para_parquet(arquivo_entrada, novo, particionar=True)
+        print()
+
+        arquivos_atuais = sorted(p.relative_to(destino) for p in destino.rglob('*.parquet')) if destino.is_dir() else []
+        arquivos_novos = sorted(p.relative_to(novo) for p in novo.rglob('*.parquet'))
+
+        # Validar o arquivo novo contra o esquema do dataset antes de tocar no destino
+        if arquivos_atuais:
+            print("[*] Validando esquema contra o dataset existente...")
+            esquema_atual = ds.dataset(destino, format='parquet', partitioning=PARTICIONAMENTO).schema
+            esquema_novo = ds.dataset(novo, format='parquet', partitioning=PARTICIONAMENTO).schema
+            diferencas = diferencas_esquema(esquema_atual.remove_metadata(), esquema_novo.remove_metadata())
+            if diferencas:
+                print("[ERRO] O arquivo novo nao segue o esquema do dataset:")
+                for diferenca in diferencas:
+                    print(f"     - {diferenca}")
+                sys.exit(1)
+
+        # Arquivos gravados anteriormente pela mesma origem (versão a substituir)
+        padrao = padrao_arquivos_origem(origem)
+        anteriores = {arquivo for arquivo in arquivos_atuais if padrao.fullmatch(arquivo.name)}
+
+        for arquivo in arquivos_novos:
+            (destino / arquivo).parent.mkdir(parents=True, exist_ok=True)
+            os.replace(novo / arquivo, destino / arquivo)
+        for arquivo in anteriores - set(arquivos_novos):
+            (destino / arquivo).unlink()
+            # Remove os diretórios de partição que ficaram vazios
+            for pasta in ((destino / arquivo).parent, (destino / arquivo).parent.parent):
+                if pasta != destino and not any(pasta.iterdir()):
+                    pasta.rmdir()
+
+        meses_novos = {arquivo.parent for arquivo in arquivos_novos}
+        meses_substituidos = {arquivo.parent for arquivo in anteriores}
+        print(f"[OK] '{origem}' incorporado a {destino}")
+        for mes in sorted(meses_novos | meses_substituidos):
+            if mes not in meses_novos:
+                situacao = 'removido'
+            elif mes in meses_substituidos:
+                situacao = 'substituido'
+            else:
+                situacao = 'novo'
+            print(f"     {mes.as_posix()}: {situacao}")
+    finally:
+        shutil.rmtree(novo, ignore_errors=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converte dados.xlsx (SIH/DATASUS) para Parquet")
     # Arquivo padrão
-    ARQUIVO_ENTRADA = "dados.xlsx"
+    parser.add_argument("arquivo", nargs="?", default="dados.xlsx", help="Arquivo .xlsx de entrada")
+    parser.add_argument("--saida", default=None, help="Arquivo .parquet (ou diretório, se particionado) de saída")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Lê e grava em blocos de linhas, com memória constante")
+    parser.add_argument("--linhas-por-bloco", type=int, default=LINHAS_POR_BLOCO,
+                        help=f"Linhas por bloco no modo streaming (padrão: {LINHAS_POR_BLOCO:,})")
+    parser.add_argument("--particionar", action="store_true",
+                        help=f"Grava dataset particionado por ano/mês de {COLUNA_PARTICAO}")
+    parser.add_argument("--anexar", metavar="DATASET", default=None,
+                        help="Incorpora o arquivo a um dataset particionado existente "
+                             "(substitui os dados de uma origem com o mesmo nome)")
+    args = parser.parse_args()
 
-    # Permitir argumento via linha de comando
-    if len(sys.argv) > 1:
-        ARQUIVO_ENTRADA = sys.argv[1]
+    ARQUIVO_ENTRADA = args.arquivo
 
     # Verificar se o arquivo existe
     if not Path(ARQUIVO_ENTRADA).exists():
         print(f"[ERRO] Arquivo '{ARQUIVO_ENTRADA}' nao encontrado no diretorio atual")
         print()
         print("[!] Uso:")
-        print(f"    python converter_para_parquet.py [arquivo.xlsx]")
+        print(f"    python converter_para_parquet.py [arquivo.xlsx] [--streaming]")
         print()
         print("[!] Exemplo:")
         print(f"    python converter_para_parquet.py dados.xlsx")
         sys.exit(1)
 
     # Converter
-    converter_excel_para_parquet(ARQUIVO_ENTRADA)
+    if args.anexar:
+        anexar_ao_dataset(ARQUIVO_ENTRADA, args.anexar, args.streaming, args.linhas_por_bloco)
+        sys.exit(0)
+
+    if args.streaming:
+        saida = converter_excel_para_parquet_streaming(ARQUIVO_ENTRADA, args.saida, args.linhas_por_bloco,
+                                                       particionar=args.particionar)
+    else:
+        saida = converter_excel_para_parquet(ARQUIVO_ENTRADA, args.saida, particionar=args.particionar)
+
+    print()
+    print(f"[!] Para usar no dashboard, altere CAMINHO_ARQUIVO para: '{saida}'")
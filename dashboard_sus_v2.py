@@ -5,27 +5,39 @@ Desenvolvido em Streamlit + Plotly
 
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
+from pathlib import Path
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+import atexit
+import hashlib
+import importlib
+import logging
+import json
+import multiprocessing
+import os
+import re
+import threading
 import warnings
 warnings.filterwarnings('ignore')
 
+from esquema_sih import aplicar_esquema, tabela_de_pandas
+
 # ============================================================================
 # CONFIGURAÇÃO DA PÁGINA
 # ============================================================================
 
-st.set_page_config(
-    page_title="Dashboard SIH/DATASUS",
-    page_icon="🏥",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
 # CSS customizado - Design moderno e profissional
-st.markdown("""
+CSS_PAGINA = """
 <style>
     /* Importar fonte moderna */
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
@@ -212,153 +224,316 @@ st.markdown("""
         box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+def configurar_pagina():
+    """
+    Título, layout e CSS da página
+
+    Chamada no início de main(): importar o módulo (testes, processos do
+    pré-cálculo) não usa o Streamlit nem emite os avisos de fora do `streamlit run`.
+    """
+    st.set_page_config(
+        page_title="Dashboard SIH/DATASUS",
+        page_icon="🏥",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    st.markdown(CSS_PAGINA, unsafe_allow_html=True)
+
+# ============================================================================
+# CONFIGURAÇÃO DOS DADOS
+# ============================================================================
+
+# ====================================================================
+# 🔴 ALTERE O CAMINHO DO SEU ARQUIVO AQUI 🔴
+# ====================================================================
+CAMINHO_ARQUIVO = "dados.parquet"  # ← ALTERE AQUI
+# Exemplos:
+# CAMINHO_ARQUIVO = "amostra.xlsx"  # Para testar com amostra
+# CAMINHO_ARQUIVO = "dados.xlsx"  # Base completa em Excel (mais lento)
+# CAMINHO_ARQUIVO = "dados.parquet"  # Base completa em Parquet (RECOMENDADO - 10x mais rápido!)
+# CAMINHO_ARQUIVO = "C:/Users/SeuUsuario/Documents/dados.parquet"  # Windows com caminho absoluto
+# CAMINHO_ARQUIVO = "dados"  # Dataset particionado por ano/mês (converter_para_parquet.py --particionar)
+# ====================================================================
+
+# Janela de internações analisada pelo dashboard (Data_Internacao)
+DATA_INICIO_JANELA = "2025-01-01"
+DATA_FIM_JANELA = "2025-07-31"
+
+# Se True, o período escolhido na sidebar também é enviado ao leitor Parquet,
+# que deixa de ler do disco os meses (partições/row groups) fora do período
+LEITURA_POR_PERIODO = False
+
+# Snapshot: cópia já processada da base, reaproveitada entre reinicializações
+DIRETORIO_SNAPSHOT = ".snapshots"
+# Incremente sempre que o processamento em processar_dados() ou o formato do
+# snapshot mudar, para invalidar os snapshots gravados pela versão anterior
+VERSAO_PIPELINE = "4"
+
+# Se True, a navegação entre painéis executa apenas o painel aberto a cada interação;
+# se False, usa st.tabs, que executa todos os painéis em todo rerun
+NAVEGACAO_SOB_DEMANDA = True
+
+# Teto de memória do cache de agregados (resultados dos painéis por combinação de filtros)
+LIMITE_CACHE_AGREGADOS_MB = 256
+
+# Motor das agregações dos painéis (consultar): "pandas" (cubo e microdados em memória) ou
+# "arrow" (pyarrow.compute sobre uma tabela Arrow em memória, a partir dos snapshots processados)
+# (comparar_backends.py mede os dois na base atual)
+BACKEND_CONSULTAS = "pandas"
+
+# Linhas enviadas ao navegador por página nas tabelas de resumo (ordenação e paginação no servidor)
+LINHAS_POR_PAGINA = 25
+
+# Pré-cálculo em segundo plano, após a carga, dos filtros mais escolhidos: os FATIAS_PRECALCULO
+# valores com mais internações de cada filtro em FILTROS_PRECALCULO têm os agregados dos painéis
+# calculados em PROCESSOS_PRECALCULO processos de baixa prioridade (0 desliga)
+FATIAS_PRECALCULO = 20
+FILTROS_PRECALCULO = ('municipio_residencia', 'cnes', 'cid')
+PROCESSOS_PRECALCULO = 2
+# Acréscimo de nice dos processos do pré-cálculo (sem efeito no Windows)
+PRIORIDADE_PRECALCULO = 10
+
+# Mapeamento das colunas reais para a estrutura esperada
+COLUNAS_RENOMEAR = {
+    'UF_Residencia': 'UF_ZI',
+    'Municipio_Residencia': 'MUNIC_RES',
+    'Nome_Municipio_Residencia': 'NOME_MUNIC_RES',
+    'Municipio_Atendimento': 'MUNIC_MOV',
+    'Nome_Municipio_Atendimento': 'NOME_MUNIC_MOV',
+    'Codigo_CNES': 'CNES',
+    'Nome_Estabelecimento': 'NOME_FANTASIA',
+    'Dias_Permanencia': 'DIAS_PERM',
+    'Dias_UTI_Mes': 'DIAS_UTI',
+    'Diagnostico_Principal': 'DIAG_PRINC',
+    'Nome_Doenca': 'NOME_CID_PRINC',
+    'Procedimento_Solicitado': 'PROC_SOLI',
+    'Nome_Procedimento_Solicitado': 'NOME_PROC_SOLI',
+    'Procedimento_Realizado': 'PROC_REA',
+    'Nome_Procedimento_Realizado': 'NOME_PROC_REA',
+    'Valor_Total': 'VAL_TOT',
+    'Data_Internacao': 'DT_INTER',
+    'Data_Saida': 'DT_SAIDA',
+    'Data_Nascimento': 'DT_NASC',
+    'Sexo': 'SEXO',
+    'Idade': 'IDADE',
+    'Raca_Cor': 'RACA_COR_COD',
+    'Nome_Raca_Cor': 'RACA_COR',
+    'Morte': 'MORTE_TXT',
+    'CID_Notificacao': 'CID_MORTE'
+}
+
+# Categorias fixas das colunas demográficas (também usadas como opções dos filtros)
+CATEGORIAS_SEXO = ['Masculino', 'Feminino', 'Ignorado']
+CATEGORIAS_RACA_COR = ['Branca', 'Preta', 'Parda', 'Amarela', 'Indígena', 'Ignorada']
+FAIXAS_ETARIAS = ['<1', '1-4', '5-9', '10-14', '15-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
+
+# Colunas de texto guardadas como category (nomes e códigos de alta repetição)
+COLUNAS_CATEGORICAS = ('UF_ZI', 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV', 'NOME_FANTASIA', 'DIAG_PRINC', 'CID_PRINC',
+                       'NOME_CID_PRINC', 'PROC_SOLI', 'NOME_PROC_SOLI', 'NOME_PROC_REA', 'MORTE_TXT', 'CID_MORTE')
+
+# Colunas sempre carregadas: usadas no recorte de período e na limpeza de processar_dados()
+COLUNAS_ESSENCIAIS = ('DATA_CMPT', 'MUNIC_RES', 'MUNIC_MOV')
+
+# Colunas criadas em processar_dados() e as colunas de origem (já renomeadas)
+# a partir das quais são derivadas quando não existem no arquivo
+DEPENDENCIAS_DERIVADAS = {
+    'DATA_CMPT': ('DT_INTER', 'ANO_CMPT', 'MES_CMPT'),
+    'ANO_CMPT': ('DT_INTER',),
+    'MES_CMPT': ('DT_INTER',),
+    'MORTE': ('MORTE_TXT',),
+    'RACA_COR': ('RACA_COR_COD',),
+    'CID_PRINC': ('DIAG_PRINC',),
+    'FAIXA_ETARIA': ('IDADE',),
+}
+
+# Colunas declaradas por cada painel/filtro via @usa_colunas
+MANIFESTO_COLUNAS = {}
+
+# Logger próprio: o Streamlit reexecuta o script a cada interação, então o
+# handler só é anexado na primeira execução do processo
+logger = logging.getLogger("dashboard_sih")
+if not logger.handlers:
+    _handler_log = logging.StreamHandler()
+    _handler_log.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(_handler_log)
+    logger.setLevel(logging.INFO)
+
+def usa_colunas(*colunas):
+    """Registra no manifesto as colunas (nomes já renomeados) consumidas pela função decorada"""
+    def registrar(funcao):
+        MANIFESTO_COLUNAS[funcao.__name__] = colunas
+        funcao.colunas = colunas
+        return funcao
+    return registrar
 
 # ============================================================================
 # FUNÇÃO PARA CARREGAR DADOS
 # ============================================================================
 
-@st.cache_data
-def carregar_dados():
+def colunas_necessarias():
+    """União das colunas declaradas pelos painéis e filtros, mais as essenciais"""
+    colunas = set(COLUNAS_ESSENCIAIS)
+    for declaradas in MANIFESTO_COLUNAS.values():
+        colunas.update(declaradas)
+    return colunas
+
+def resolver_colunas_fonte(disponiveis, necessarias):
+    """Traduz as colunas necessárias para os nomes do arquivo de origem, incluindo dependências"""
+    # Nome no dashboard → nome no arquivo
+    fonte_por_nome = {COLUNAS_RENOMEAR.get(col, col): col for col in disponiveis}
+
+    selecionadas = set()
+    for col in necessarias:
+        if col in fonte_por_nome:
+            selecionadas.add(fonte_por_nome[col])
+        else:
+            for dependencia in DEPENDENCIAS_DERIVADAS.get(col, ()):
+                if dependencia in fonte_por_nome:
+                    selecionadas.add(fonte_por_nome[dependencia])
+
+    # Mantém a ordem original do arquivo
+    return [col for col in disponiveis if col in selecionadas]
+
+def filtro_periodo_parquet(esquema, inicio, fim):
     """
-    Carrega os dados do SIH/DATASUS
+    Monta a expressão de filtro do período para o leitor Parquet
 
-    ⚠️ ALTERE O CAMINHO DO ARQUIVO AQUI ⚠️
+    Combina o filtro nas partições ano/mês (diretórios fora do período não são
+    lidos) com o filtro na data de internação (row groups cujas estatísticas
+    ficam fora do período são descartados). Retorna None se não houver colunas
+    aplicáveis no esquema.
     """
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+    condicoes = []
+
+    if 'ano' in esquema.names and 'mes' in esquema.names:
+        ano, mes = pc.field('ano'), pc.field('mes')
+        condicoes.append((ano > inicio.year) | ((ano == inicio.year) & (mes >= inicio.month)))
+        condicoes.append((ano < fim.year) | ((ano == fim.year) & (mes <= fim.month)))
+
+    coluna_data = next((k for k, v in COLUNAS_RENOMEAR.items() if v == 'DT_INTER'), None)
+    if coluna_data in esquema.names and pa.types.is_timestamp(esquema.field(coluna_data).type):
+        tipo = esquema.field(coluna_data).type
+        data = pc.field(coluna_data)
+        condicoes.append(data >= pa.scalar(inicio.to_pydatetime(), type=tipo))
+        condicoes.append(data <= pa.scalar(fim.to_pydatetime(), type=tipo))
+
+    if not condicoes:
+        return None
+    filtro = condicoes[0]
+    for condicao in condicoes[1:]:
+        filtro = filtro & condicao
+    return filtro
+
+def ler_arquivo_fonte(caminho, colunas=None, periodo=None):
+    """
+    Lê o arquivo bruto detectando o formato pela extensão
+
+    Args:
+        caminho: Caminho do arquivo CSV, Parquet ou Excel, ou diretório de um
+            dataset Parquet particionado (ano=AAAA/mes=M)
+        colunas: Colunas do dashboard a carregar (None carrega todas). Apenas as
+            colunas de origem correspondentes são decodificadas.
+        periodo: Tupla (início, fim) enviada ao leitor Parquet como filtro de
+            partições e row groups. Outros formatos leem tudo e o recorte é
+            feito em processar_dados().
+    """
+    def projetar(disponiveis):
+        return None if colunas is None else resolver_colunas_fonte(list(disponiveis), colunas)
+
+    # Em todos os formatos os tipos finais vêm do registro SIH/RD (esquema_sih.py)
+    if caminho.endswith('.csv'):
+        cabecalho = pd.read_csv(caminho, encoding='utf-8', nrows=0).columns
+        df = pd.read_csv(caminho, encoding='utf-8', low_memory=False, usecols=projetar(cabecalho))
+        tabela = tabela_de_pandas(df)
+    elif caminho.endswith('.parquet') or os.path.isdir(caminho):
+        dataset = ds.dataset(caminho, format='parquet', partitioning='hive')
+        filtro = filtro_periodo_parquet(dataset.schema, *periodo) if periodo else None
+        tabela = dataset.to_table(columns=projetar(dataset.schema.names), filter=filtro)
+    elif caminho.endswith(('.xls', '.xlsx')):
+        cabecalho = pd.read_excel(caminho, nrows=0).columns
+        df = pd.read_excel(caminho, usecols=projetar(cabecalho))
+        tabela = tabela_de_pandas(df)
+    else:
+        raise ValueError("Formato de arquivo não suportado. Use CSV, Parquet ou Excel.")
+
+    return aplicar_esquema(tabela).to_pandas()
+
+def processar_dados(df, data_inicio=DATA_INICIO_JANELA, data_fim=DATA_FIM_JANELA):
+    """Renomeia, tipa, deriva e recorta para o período [data_inicio, data_fim] a base bruta"""
 
     # ====================================================================
-    # 🔴 ALTERE O CAMINHO DO SEU ARQUIVO AQUI 🔴
-    # ====================================================================
-    CAMINHO_ARQUIVO = "dados.parquet"  # ← ALTERE AQUI
-    # Exemplos:
-    # CAMINHO_ARQUIVO = "amostra.xlsx"  # Para testar com amostra
-    # CAMINHO_ARQUIVO = "dados.xlsx"  # Base completa em Excel (mais lento)
-    # CAMINHO_ARQUIVO = "dados.parquet"  # Base completa em Parquet (RECOMENDADO - 10x mais rápido!)
-    # CAMINHO_ARQUIVO = "C:/Users/SeuUsuario/Documents/dados.parquet"  # Windows com caminho absoluto
+    # RENOMEAR COLUNAS PARA ESTRUTURA ESPERADA
     # ====================================================================
 
-    try:
-        # Detecta o tipo de arquivo pela extensão
-        if CAMINHO_ARQUIVO.endswith('.csv'):
-            df = pd.read_csv(CAMINHO_ARQUIVO, encoding='utf-8', low_memory=False)
-        elif CAMINHO_ARQUIVO.endswith('.parquet'):
-            df = pd.read_parquet(CAMINHO_ARQUIVO)
-        elif CAMINHO_ARQUIVO.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(CAMINHO_ARQUIVO)
-        else:
-            st.error("Formato de arquivo não suportado. Use CSV, Parquet ou Excel.")
-            return None
+    # Renomear apenas as colunas que existem
+    colunas_existentes = {k: v for k, v in COLUNAS_RENOMEAR.items() if k in df.columns}
+    df = df.rename(columns=colunas_existentes)
 
-        # ====================================================================
-        # RENOMEAR COLUNAS PARA ESTRUTURA ESPERADA
-        # ====================================================================
+    # ====================================================================
+    # PROCESSAMENTO E LIMPEZA DOS DADOS
+    # ====================================================================
 
-        # Mapeamento das colunas reais para a estrutura esperada
-        colunas_renomear = {
-            'UF_Residencia': 'UF_ZI',
-            'Municipio_Residencia': 'MUNIC_RES',
-            'Nome_Municipio_Residencia': 'NOME_MUNIC_RES',
-            'Municipio_Atendimento': 'MUNIC_MOV',
-            'Nome_Municipio_Atendimento': 'NOME_MUNIC_MOV',
-            'Codigo_CNES': 'CNES',
-            'Nome_Estabelecimento': 'NOME_FANTASIA',
-            'Dias_Permanencia': 'DIAS_PERM',
-            'Dias_UTI_Mes': 'DIAS_UTI',
-            'Diagnostico_Principal': 'DIAG_PRINC',
-            'Nome_Doenca': 'NOME_CID_PRINC',
-            'Procedimento_Solicitado': 'PROC_SOLI',
-            'Nome_Procedimento_Solicitado': 'NOME_PROC_SOLI',
-            'Procedimento_Realizado': 'PROC_REA',
-            'Nome_Procedimento_Realizado': 'NOME_PROC_REA',
-            'Valor_Total': 'VAL_TOT',
-            'Data_Internacao': 'DT_INTER',
-            'Data_Saida': 'DT_SAIDA',
-            'Data_Nascimento': 'DT_NASC',
-            'Sexo': 'SEXO',
-            'Idade': 'IDADE',
-            'Raca_Cor': 'RACA_COR_COD',
-            'Nome_Raca_Cor': 'RACA_COR',
-            'Morte': 'MORTE_TXT',
-            'CID_Notificacao': 'CID_MORTE'
-        }
-
-        # Renomear apenas as colunas que existem
-        colunas_existentes = {k: v for k, v in colunas_renomear.items() if k in df.columns}
-        df = df.rename(columns=colunas_existentes)
+    # Converte colunas de data
+    if 'DT_INTER' in df.columns:
+        df['DT_INTER'] = pd.to_datetime(df['DT_INTER'], errors='coerce')
+
+        # Criar colunas de competência a partir da data de internação
+        df['ANO_CMPT'] = df['DT_INTER'].dt.year
+        df['MES_CMPT'] = df['DT_INTER'].dt.month
+        df['DATA_CMPT'] = df['DT_INTER']
+    elif 'ANO_CMPT' in df.columns and 'MES_CMPT' in df.columns:
+        # Se já existir ANO_CMPT e MES_CMPT (estrutura alternativa)
+        df['DATA_CMPT'] = pd.to_datetime(
+            df['ANO_CMPT'].astype(str) + '-' + df['MES_CMPT'].astype(str).str.zfill(2) + '-01',
+            errors='coerce'
+        )
 
-        # ====================================================================
-        # PROCESSAMENTO E LIMPEZA DOS DADOS
-        # ====================================================================
+    # Converter outras datas
+    if 'DT_SAIDA' in df.columns:
+        df['DT_SAIDA'] = pd.to_datetime(df['DT_SAIDA'], errors='coerce')
+    if 'DT_NASC' in df.columns:
+        df['DT_NASC'] = pd.to_datetime(df['DT_NASC'], errors='coerce')
+
+    # Converte valores numéricos
+    colunas_numericas = ['DIAS_PERM', 'DIAS_UTI', 'VAL_TOT', 'IDADE']
+    for col in colunas_numericas:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Trata coluna MORTE (converter de texto "Sim"/"Não" para 0/1)
+    if 'MORTE_TXT' in df.columns:
+        df['MORTE'] = df['MORTE_TXT'].map({'Não': 0, 'Sim': 1}).fillna(0).astype('int8')
+    elif 'MORTE' in df.columns:
+        # Se já existir MORTE como numérico
+        df['MORTE'] = pd.to_numeric(df['MORTE'], errors='coerce').fillna(0).astype('int8')
+
+    # Trata sexo (já vem como texto "Masculino"/"Feminino")
+    if 'SEXO' in df.columns:
+        # Converter para texto primeiro para evitar problemas com categorical
+        if df['SEXO'].dtype.name == 'category':
+            df['SEXO'] = df['SEXO'].astype(object)
 
-        # Converte colunas de data
-        if 'DT_INTER' in df.columns:
-            df['DT_INTER'] = pd.to_datetime(df['DT_INTER'], errors='coerce')
-
-            # Criar colunas de competência a partir da data de internação
-            df['ANO_CMPT'] = df['DT_INTER'].dt.year
-            df['MES_CMPT'] = df['DT_INTER'].dt.month
-            df['DATA_CMPT'] = df['DT_INTER']
-        elif 'ANO_CMPT' in df.columns and 'MES_CMPT' in df.columns:
-            # Se já existir ANO_CMPT e MES_CMPT (estrutura alternativa)
-            df['DATA_CMPT'] = pd.to_datetime(
-                df['ANO_CMPT'].astype(str) + '-' + df['MES_CMPT'].astype(str).str.zfill(2) + '-01',
-                errors='coerce'
-            )
+        # Se vier como código numérico
+        if df['SEXO'].dtype in ['int64', 'float64']:
+            df['SEXO'] = df['SEXO'].map({1: 'Masculino', 3: 'Feminino', 0: 'Ignorado'}).fillna('Ignorado')
+        else:
+            # Se já vier como texto, apenas garantir valores
+            df['SEXO'] = df['SEXO'].fillna('Ignorado')
 
-        # Converter outras datas
-        if 'DT_SAIDA' in df.columns:
-            df['DT_SAIDA'] = pd.to_datetime(df['DT_SAIDA'], errors='coerce')
-        if 'DT_NASC' in df.columns:
-            df['DT_NASC'] = pd.to_datetime(df['DT_NASC'], errors='coerce')
-
-        # Converte valores numéricos
-        colunas_numericas = ['DIAS_PERM', 'DIAS_UTI', 'VAL_TOT', 'IDADE']
-        for col in colunas_numericas:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        # Trata coluna MORTE (converter de texto "Sim"/"Não" para 0/1)
-        if 'MORTE_TXT' in df.columns:
-            df['MORTE'] = df['MORTE_TXT'].map({'Não': 0, 'Sim': 1}).fillna(0).astype(int)
-        elif 'MORTE' in df.columns:
-            # Se já existir MORTE como numérico
-            df['MORTE'] = pd.to_numeric(df['MORTE'], errors='coerce').fillna(0).astype(int)
-
-        # Trata sexo (já vem como texto "Masculino"/"Feminino")
-        if 'SEXO' in df.columns:
-            # Converter para string primeiro para evitar problemas com categorical
-            if df['SEXO'].dtype.name == 'category':
-                df['SEXO'] = df['SEXO'].astype(str)
+        df['SEXO'] = categoria_fixa(df['SEXO'], CATEGORIAS_SEXO)
 
-            # Se vier como código numérico
-            if df['SEXO'].dtype in ['int64', 'float64']:
-                df['SEXO'] = df['SEXO'].map({1: 'Masculino', 3: 'Feminino', 0: 'Ignorado'}).fillna('Ignorado')
-            else:
-                # Se já vier como texto, apenas garantir valores
-                df['SEXO'] = df['SEXO'].fillna('Ignorado')
-
-        # Trata raça/cor
-        if 'RACA_COR' in df.columns:
-            # Converter para string primeiro para evitar problemas com categorical
-            if df['RACA_COR'].dtype.name == 'category':
-                df['RACA_COR'] = df['RACA_COR'].astype(str)
-
-            # Se vier como código numérico, mapear
-            if df['RACA_COR'].dtype in ['int64', 'float64']:
-                df['RACA_COR'] = df['RACA_COR'].map({
-                    1: 'Branca',
-                    2: 'Preta',
-                    3: 'Parda',
-                    4: 'Amarela',
-                    5: 'Indígena',
-                    9: 'Ignorada'
-                }).fillna('Ignorada')
-            else:
-                # Se já vier como texto, apenas garantir que não há nulos
-                df['RACA_COR'] = df['RACA_COR'].fillna('Ignorada')
-        elif 'RACA_COR_COD' in df.columns and 'RACA_COR' not in df.columns:
-            # Se só tiver o código, criar a coluna de texto
-            df['RACA_COR'] = df['RACA_COR_COD'].map({
+    # Trata raça/cor
+    if 'RACA_COR' in df.columns:
+        # Converter para texto primeiro para evitar problemas com categorical
+        if df['RACA_COR'].dtype.name == 'category':
+            df['RACA_COR'] = df['RACA_COR'].astype(object)
+
+        # Se vier como código numérico, mapear
+        if df['RACA_COR'].dtype in ['int64', 'float64']:
+            df['RACA_COR'] = df['RACA_COR'].map({
                 1: 'Branca',
                 2: 'Preta',
                 3: 'Parda',
@@ -366,70 +541,1028 @@ def carregar_dados():
                 5: 'Indígena',
                 9: 'Ignorada'
             }).fillna('Ignorada')
+        else:
+            # Se já vier como texto, apenas garantir que não há nulos
+            df['RACA_COR'] = df['RACA_COR'].fillna('Ignorada')
+
+        df['RACA_COR'] = categoria_fixa(df['RACA_COR'], CATEGORIAS_RACA_COR)
+    elif 'RACA_COR_COD' in df.columns and 'RACA_COR' not in df.columns:
+        # Se só tiver o código, criar a coluna de texto
+        df['RACA_COR'] = df['RACA_COR_COD'].map({
+            1: 'Branca',
+            2: 'Preta',
+            3: 'Parda',
+            4: 'Amarela',
+            5: 'Indígena',
+            9: 'Ignorada'
+        }).fillna('Ignorada')
+        df['RACA_COR'] = categoria_fixa(df['RACA_COR'], CATEGORIAS_RACA_COR)
+
+    # Criar coluna CID_PRINC (alias para DIAG_PRINC)
+    if 'DIAG_PRINC' in df.columns:
+        df['DIAG_PRINC'] = df['DIAG_PRINC'].astype(str)
+        df['CID_PRINC'] = df['DIAG_PRINC']
+
+    # Criar coluna CID_SECUN vazia (não existe na base real): category sem categorias ocupa 1 byte/linha
+    df['CID_SECUN'] = pd.Categorical.from_codes(np.full(len(df), -1, dtype='int8'), categories=pd.Index([], dtype=object))
+
+    # Cria faixas etárias
+    if 'IDADE' in df.columns:
+        df['FAIXA_ETARIA'] = pd.cut(
+            df['IDADE'],
+            bins=[0, 1, 5, 10, 15, 20, 30, 40, 50, 60, 70, 80, 120],
+            labels=FAIXAS_ETARIAS
+        )
 
-        # Criar coluna CID_PRINC (alias para DIAG_PRINC)
-        if 'DIAG_PRINC' in df.columns:
-            df['DIAG_PRINC'] = df['DIAG_PRINC'].astype(str)
-            df['CID_PRINC'] = df['DIAG_PRINC']
+    # Remove valores inválidos
+    if 'DATA_CMPT' in df.columns:
+        df = df.dropna(subset=['DATA_CMPT'])
 
-        # Criar coluna CID_SECUN vazia (não existe na base real)
-        df['CID_SECUN'] = None
+        # ====================================================================
+        # FILTRAR APENAS INTERNAÇÕES DA JANELA (PADRÃO: JANEIRO A JULHO DE 2025)
+        # ====================================================================
+        data_inicio = pd.to_datetime(data_inicio)
+        data_fim = pd.to_datetime(data_fim)
 
-        # Cria faixas etárias
-        if 'IDADE' in df.columns:
-            df['FAIXA_ETARIA'] = pd.cut(
-                df['IDADE'],
-                bins=[0, 1, 5, 10, 15, 20, 30, 40, 50, 60, 70, 80, 120],
-                labels=['<1', '1-4', '5-9', '10-14', '15-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+']
-            )
+        total_antes = len(df)
+        df = df[(df['DATA_CMPT'] >= data_inicio) & (df['DATA_CMPT'] <= data_fim)]
+        total_depois = len(df)
 
-        # Remove valores inválidos
-        if 'DATA_CMPT' in df.columns:
-            df = df.dropna(subset=['DATA_CMPT'])
+    # Remove linhas com valores críticos ausentes
+    colunas_criticas = ['MUNIC_RES', 'MUNIC_MOV']
+    for col in colunas_criticas:
+        if col in df.columns:
+            df = df.dropna(subset=[col])
 
-            # ====================================================================
-            # FILTRAR APENAS INTERNAÇÕES DE JANEIRO A JULHO DE 2025
-            # ====================================================================
-            data_inicio = pd.to_datetime('2025-01-01')
-            data_fim = pd.to_datetime('2025-07-31')
+    # Índice contíguo (exigido pelo formato Arrow IPC do snapshot)
+    return compactar_tipos(df.reset_index(drop=True))
 
-            total_antes = len(df)
-            df = df[(df['DATA_CMPT'] >= data_inicio) & (df['DATA_CMPT'] <= data_fim)]
-            total_depois = len(df)
+def categoria_fixa(serie, categorias):
+    """Converte para category com as categorias fixas na ordem dada (valores inesperados vão ao final)"""
+    extras = sorted(set(serie.dropna().unique()) - set(categorias))
+    return pd.Categorical(serie, categories=list(categorias) + extras)
 
-        # Remove linhas com valores críticos ausentes
-        colunas_criticas = ['MUNIC_RES', 'MUNIC_MOV']
-        for col in colunas_criticas:
-            if col in df.columns:
-                df = df.dropna(subset=[col])
+def reduzir_numerico(serie):
+    """
+    Converte a coluna numérica para a menor largura que a representa sem perda
+
+    Inteiros sem ausentes viram int8/16/32; inteiros com ausentes viram float32
+    (exato até 2^24). Valores fracionários (ex.: VAL_TOT) permanecem em float64,
+    pois somas em float32 perderiam centavos.
+    """
+    valores = serie.dropna()
+    inteiro = pd.api.types.is_integer_dtype(serie) or bool((valores % 1 == 0).all())
+    if not inteiro:
+        return serie
+    if len(valores) < len(serie):
+        return serie.astype('float32') if valores.abs().max() < 2 ** 24 else serie
+    return pd.to_numeric(serie, downcast='integer')
+
+def compactar_tipos(df):
+    """Aplica a representação compacta: category nas colunas de texto repetitivas e números reduzidos"""
+    for col in COLUNAS_CATEGORICAS:
+        if col in df.columns:
+            if df[col].dtype.name == 'category':
+                df[col] = df[col].cat.remove_unused_categories()
+            else:
+                df[col] = df[col].astype('category')
+
+    for col in df.columns:
+        if col != 'MORTE' and pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col]):
+            df[col] = reduzir_numerico(df[col])
+
+    return df
+
+def registrar_uso_memoria(df):
+    """Registra no log a memória ocupada por coluna e o total da base"""
+    uso = df.memory_usage(deep=True, index=False).sort_values(ascending=False)
+    for col, total in uso.items():
+        logger.info("  %-16s %-16s %8.2f MB", col, df[col].dtype, total / 2 ** 20)
+    logger.info("Memória da base: %.1f MB em %d linhas", uso.sum() / 2 ** 20, len(df))
+
+def versao_fonte(caminho):
+    """
+    Impressão digital barata da fonte: caminho, tamanho e data de modificação de cada arquivo
+
+    Não lê o conteúdo. Identifica o snapshot processado (caminho_snapshot) e
+    entra na chave do cache de carregar_dados(), para que um mês anexado ou
+    substituído (converter_para_parquet.py --anexar) seja carregado sem reiniciar.
+    """
+    raiz = Path(caminho)
+    if not raiz.exists():
+        return None
+    arquivos = sorted(p for p in raiz.rglob('*') if p.is_file()) if raiz.is_dir() else [raiz]
+    sha = hashlib.sha256()
+    for arquivo_atual in arquivos:
+        # O caminho relativo entra na impressão: mover um arquivo de partição muda a base
+        estado = arquivo_atual.stat()
+        relativo = arquivo_atual.relative_to(raiz) if raiz.is_dir() else ''
+        sha.update(f"{relativo}|{estado.st_size}|{estado.st_mtime_ns}".encode())
+    return sha.hexdigest()
+
+def particoes_na_janela(caminho, inicio=DATA_INICIO_JANELA, fim=DATA_FIM_JANELA):
+    """Diretórios ano=AAAA/mes=M do dataset particionado cujo mês intersecta [inicio, fim], em ordem cronológica"""
+    inicio, fim = pd.Timestamp(inicio), pd.Timestamp(fim)
+    particoes = []
+    for pasta in Path(caminho).glob('ano=*/mes=*'):
+        try:
+            ano, mes = int(pasta.parent.name.split('=', 1)[1]), int(pasta.name.split('=', 1)[1])
+        except ValueError:
+            continue
+        if pasta.is_dir() and (inicio.year, inicio.month) <= (ano, mes) <= (fim.year, fim.month):
+            particoes.append((ano, mes, pasta))
+    return sorted(particoes)
+
+def caminho_snapshot(caminho, colunas, nome=None):
+    """
+    Caminho do snapshot processado, chaveado pela impressão digital da fonte, colunas, janela e versão do pipeline
+
+    Args:
+        nome: Prefixo do arquivo de snapshot (padrão: nome da fonte). Partições
+            de um mesmo dataset usam prefixos distintos para terem snapshots próprios.
+    """
+    sha = hashlib.sha256(versao_fonte(caminho).encode())
+    sha.update(','.join(sorted(colunas)).encode())
+    sha.update(f"{DATA_INICIO_JANELA}|{DATA_FIM_JANELA}".encode())
+    chave = sha.hexdigest()[:16]
+    nome = f"{nome or Path(caminho).stem}_{chave}_v{VERSAO_PIPELINE}.arrow"
+    return Path(DIRETORIO_SNAPSHOT) / nome
+
+def salvar_snapshot(df, destino):
+    """
+    Grava o snapshot em Arrow IPC de forma atômica e remove snapshots antigos da mesma fonte
+
+    Sem compressão e em um único lote, para que ler_snapshot() possa mapear as
+    colunas direto do arquivo em vez de copiá-las.
+    """
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    temporario = destino.with_suffix('.tmp')
+    df.to_feather(temporario, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(temporario, destino)
+
+    # Nome no formato <fonte>_<hash>_v<versão>.arrow (ver caminho_snapshot)
+    fonte = destino.name.rsplit('_', 2)[0]
+    padrao = re.compile(rf"{re.escape(fonte)}_[0-9a-f]{{16}}_v[^_]+\.arrow")
+    for antigo in destino.parent.glob("*.arrow"):
+        if antigo != destino and padrao.fullmatch(antigo.name):
+            antigo.unlink(missing_ok=True)
+
+def ler_snapshot(caminho):
+    """
+    Abre o snapshot mapeado em memória (somente leitura)
+
+    As colunas numéricas e de data do DataFrame apontam para as páginas do
+    arquivo, que o sistema operacional mantém uma única vez no cache de
+    páginas para todas as sessões e processos; só os códigos das colunas
+    category e as colunas com ausentes são copiados.
+    """
+    tabela = pa.ipc.open_file(pa.memory_map(str(caminho), 'r')).read_all()
+    return tabela.to_pandas(split_blocks=True)
+
+def gravar_e_mapear(df, snapshot):
+    """Grava o snapshot e devolve a base mapeada a partir dele (ou df, se a gravação falhar)"""
+    try:
+        salvar_snapshot(df, snapshot)
+        logger.info("Snapshot gravado: %s", snapshot)
+        return ler_snapshot(snapshot)
+    except OSError as e:
+        # Diretório sem permissão de escrita: segue sem snapshot
+        logger.warning("Não foi possível gravar o snapshot %s: %s", snapshot, e)
+        return df
 
+def carregar_com_snapshot(caminho, colunas, nome=None):
+    """Lê e processa a fonte (arquivo ou partição mensal), reaproveitando o snapshot quando existir"""
+    snapshot = caminho_snapshot(caminho, colunas, nome)
+
+    if snapshot.exists():
+        try:
+            df = ler_snapshot(snapshot)
+            logger.info("Snapshot carregado: %s (%d linhas)", snapshot, len(df))
+            return df
+        except Exception as e:
+            # Snapshot corrompido ou de versão incompatível do pyarrow: reprocessa
+            logger.warning("Snapshot inválido (%s), reprocessando: %s", snapshot, e)
+
+    df = ler_arquivo_fonte(str(caminho), colunas, periodo=(DATA_INICIO_JANELA, DATA_FIM_JANELA))
+    return gravar_e_mapear(processar_dados(df), snapshot)
+
+def fontes_da_base():
+    """Pares (fonte, prefixo do snapshot) da base: um por mês do dataset particionado, ou o próprio arquivo"""
+    particoes = particoes_na_janela(CAMINHO_ARQUIVO) if os.path.isdir(CAMINHO_ARQUIVO) else []
+    if particoes:
+        fonte = Path(CAMINHO_ARQUIVO).name
+        return [(pasta, f"{fonte}-{ano}-{mes:02d}") for ano, mes, pasta in particoes]
+    return [(CAMINHO_ARQUIVO, None)]
+
+def concatenar_partes(partes):
+    """Concatena bases já processadas preservando as colunas category (categorias unidas na ordem de aparição)"""
+    if len(partes) == 1:
+        return partes[0]
+    for col in partes[0].columns:
+        if partes[0][col].dtype.name == 'category':
+            # Um mês com a coluna inteiramente vazia tem categorias vazias de outro tipo (object): fica fora da união
+            preenchidas = [parte[col] for parte in partes if len(parte[col].cat.categories)]
+            categorias = union_categoricals(preenchidas).categories if preenchidas else partes[0][col].cat.categories
+            for parte in partes:
+                parte[col] = parte[col].cat.set_categories(categorias)
+    return pd.concat(partes, ignore_index=True)
+
+def snapshot_da_base(colunas):
+    """
+    Snapshot de onde carregar_base_mapeada() mapeia a base completa
+
+    No dataset particionado, a concatenação dos meses seria uma cópia em
+    memória; por isso ela é gravada em um snapshot próprio
+    (<fonte>-base_<hash dos snapshots mensais>_v<versão>.arrow), refeito só
+    quando algum mês muda.
+    """
+    fontes = fontes_da_base()
+    if len(fontes) == 1:
+        caminho, nome = fontes[0]
+        return caminho_snapshot(caminho, colunas, nome)
+
+    meses = [caminho_snapshot(caminho, colunas, nome).name for caminho, nome in fontes]
+    chave = hashlib.sha256('|'.join(meses).encode()).hexdigest()[:16]
+    return Path(DIRETORIO_SNAPSHOT) / f"{Path(CAMINHO_ARQUIVO).name}-base_{chave}_v{VERSAO_PIPELINE}.arrow"
+
+def carregar_base_mapeada(colunas):
+    """Base completa mapeada de um único snapshot (snapshot_da_base)"""
+    fontes = fontes_da_base()
+    if len(fontes) == 1:
+        caminho, nome = fontes[0]
+        return carregar_com_snapshot(caminho, colunas, nome=nome)
+
+    snapshot = snapshot_da_base(colunas)
+    if snapshot.exists():
+        try:
+            df = ler_snapshot(snapshot)
+            logger.info("Snapshot carregado: %s (%d linhas)", snapshot, len(df))
+            return df
+        except Exception as e:
+            logger.warning("Snapshot inválido (%s), refazendo: %s", snapshot, e)
+
+    df = concatenar_partes([carregar_com_snapshot(caminho, colunas, nome=nome) for caminho, nome in fontes])
+    return gravar_e_mapear(df, snapshot)
+
+@st.cache_resource(max_entries=4)
+def carregar_dados(periodo=None, versao=None):
+    """
+    Carrega os dados do SIH/DATASUS
+
+    Lê apenas as colunas declaradas pelos painéis e filtros (ver usa_colunas)
+    e apenas os meses da janela DATA_INICIO_JANELA..DATA_FIM_JANELA.
+    Usa o snapshot processado quando ele existe para o conteúdo atual da fonte;
+    caso contrário processa o arquivo bruto e grava um novo snapshot. Em um
+    dataset particionado cada mês tem o próprio snapshot: anexar ou substituir
+    um mês reprocessa só aquele mês.
+
+    A base é uma só para todas as sessões (cache_resource, sem cópia por
+    chamada) e vem mapeada do snapshot (ler_snapshot): trate-a como somente
+    leitura; os painéis trabalham sobre visões e cópias filtradas.
+
+    Args:
+        periodo: Tupla (início, fim) opcional que restringe ainda mais a leitura
+            (período da sidebar, com LEITURA_POR_PERIODO). Nesse caso o snapshot
+            não é usado: o próprio leitor Parquet descarta os meses fora do período.
+        versao: Impressão digital da fonte (versao_fonte); só participa da chave
+            do cache, para que dados novos sejam percebidos automaticamente.
+
+    ⚠️ ALTERE O CAMINHO DO ARQUIVO EM CAMINHO_ARQUIVO (início do script) ⚠️
+    """
+
+    try:
+        colunas = colunas_necessarias()
+
+        if periodo is not None:
+            inicio = max(pd.Timestamp(periodo[0]), pd.Timestamp(DATA_INICIO_JANELA))
+            fim = min(pd.Timestamp(periodo[1]), pd.Timestamp(DATA_FIM_JANELA))
+            df = ler_arquivo_fonte(CAMINHO_ARQUIVO, colunas, periodo=(inicio, fim))
+            df = processar_dados(df, inicio, fim)
+            registrar_uso_memoria(df)
+            return df
+
+        df = carregar_base_mapeada(colunas)
+
+        registrar_uso_memoria(df)
         return df
 
     except FileNotFoundError:
         st.error(f"❌ Arquivo não encontrado: {CAMINHO_ARQUIVO}")
-        st.info("Por favor, verifique o caminho do arquivo no código (função carregar_dados)")
+        st.info("Por favor, verifique o caminho do arquivo no código (CAMINHO_ARQUIVO)")
+        return None
+    except ValueError as e:
+        st.error(str(e))
         return None
     except Exception as e:
         st.error(f"❌ Erro ao carregar dados: {str(e)}")
         st.info(f"💡 Detalhes do erro para debug: {type(e).__name__}")
         return None
 
+# ============================================================================
+# CUBO DE AGREGADOS
+# ============================================================================
+
+# Rollups do cubo: um conjunto de agrupamento por família de consultas dos painéis, sempre com o mês
+# (filtro de período). Códigos e nomes (ex.: MUNIC_RES e NOME_MUNIC_RES) andam juntos e não multiplicam
+# as células; as dimensões de alta cardinalidade (estabelecimento, CID, procedimento) nunca se cruzam,
+# para que cada rollup fique muito menor que a base.
+ROLLUPS_CUBO = {
+    'demografia': ('MES', 'SEXO', 'FAIXA_ETARIA', 'RACA_COR'),
+    'fluxos': ('MES', 'MUNIC_RES', 'NOME_MUNIC_RES', 'MUNIC_MOV', 'NOME_MUNIC_MOV', 'CNES', 'NOME_FANTASIA'),
+    'cid': ('MES', 'NOME_CID_PRINC', 'CID_PRINC'),
+    'procedimento': ('MES', 'NOME_PROC_REA'),
+}
+
+# Medidas somáveis; cada uma tem também a contagem de não-nulos (<medida>_N), usada nas médias
+MEDIDAS_CUBO = ('MORTE', 'VAL_TOT', 'DIAS_PERM', 'DIAS_UTI')
+
+def colunas_medidas(df):
+    """Colunas de medida (Total, somas e contagens) presentes em um resultado agregado"""
+    medidas = [col for col in MEDIDAS_CUBO if col in df.columns]
+    return ['Total'] + medidas + [f"{col}_N" for col in medidas]
+
+def somar_por_codigo(chave, pesos):
+    """
+    Soma por valor de uma coluna category via np.bincount sobre os códigos
+
+    Equivale a groupby(chave, observed=True).sum().reset_index() sem comparar
+    textos: cada item de `pesos` (nome → array; None = contagem de linhas) vira
+    uma coluna, e só as categorias presentes em `chave` entram no resultado.
+    """
+    codigos = chave.cat.codes.to_numpy()
+    validos = codigos >= 0
+    codigos = codigos[validos]
+    contagem = np.bincount(codigos, minlength=len(chave.cat.categories))
+    presentes = np.flatnonzero(contagem)
+
+    resultado = {chave.name: pd.Categorical.from_codes(presentes, dtype=chave.dtype)}
+    for nome, peso in pesos.items():
+        if peso is None:
+            soma = contagem
+        else:
+            peso = np.asarray(peso)[validos]
+            soma = np.bincount(codigos, weights=peso, minlength=len(contagem))
+            if peso.dtype.kind in 'biu':
+                soma = soma.astype(np.int64)
+        resultado[nome] = soma[presentes]
+    return pd.DataFrame(resultado)
+
+def por_codigo(tabela, dimensoes, dropna):
+    """Se o agrupamento pode ser feito por somar_por_codigo (uma única dimensão category, sem ausentes)"""
+    return dropna and len(dimensoes) == 1 and tabela[dimensoes[0]].dtype.name == 'category'
+
+def agregar_microdados(df, dimensoes, dropna=True, limites_data=False):
+    """
+    Agrega os microdados por `dimensoes` (MES = mês de DATA_CMPT)
+
+    Args:
+        dropna: Se True, descarta os grupos com dimensão ausente (como o groupby padrão)
+        limites_data: Se True, inclui a menor e a maior DATA_CMPT de cada grupo (DATA_MIN/DATA_MAX)
+
+    Returns:
+        DataFrame com as dimensões, Total (linhas) e, por medida, a soma e a contagem de não-nulos
+    """
+    medidas = [col for col in MEDIDAS_CUBO if col in df.columns]
+    valores = df[medidas]
+    if limites_data:
+        valores = valores.assign(DATA_MIN=df['DATA_CMPT'], DATA_MAX=df['DATA_CMPT'])
+
+    if not dimensoes:
+        return pd.DataFrame([{
+            'Total': len(df),
+            **{col: df[col].sum() for col in medidas},
+            **{f"{col}_N": df[col].count() for col in medidas},
+        }])
+
+    if not limites_data and 'MES' not in dimensoes and por_codigo(df, dimensoes, dropna):
+        pesos = {'Total': None}
+        preenchidos = {col: df[col].notna().to_numpy() for col in medidas}
+        pesos.update({col: np.where(preenchidos[col], df[col].to_numpy(), 0) for col in medidas})
+        pesos.update({f"{col}_N": preenchidos[col] for col in medidas})
+        return somar_por_codigo(df[dimensoes[0]], pesos)
+
+    chaves = [
+        df['DATA_CMPT'].dt.to_period('M').dt.to_timestamp().rename('MES') if dim == 'MES' else df[dim]
+        for dim in dimensoes
+    ]
+    grupos = valores.groupby(chaves, observed=True, dropna=dropna)
+    somas = grupos[medidas].sum()
+    # Somas inteiras sempre em int64: com muitas chaves o groupby pode devolver o tipo de origem (ex.: int8)
+    somas = somas.astype({col: np.int64 for col in medidas if somas[col].dtype.kind in 'biu'})
+    partes = [
+        grupos.size().rename('Total'),
+        somas,
+        grupos[medidas].count().add_suffix('_N'),
+    ]
+    if limites_data:
+        partes += [grupos['DATA_MIN'].min(), grupos['DATA_MAX'].max()]
+    return pd.concat(partes, axis=1).reset_index()
+
+def construir_cubo(df):
+    """
+    Pré-agrega a base em um rollup por conjunto de agrupamento de ROLLUPS_CUBO
+
+    Cada rollup tem uma célula por combinação observada das suas dimensões;
+    linhas com dimensão ausente também formam células, para que os totais
+    sejam os mesmos dos microdados.
+
+    Returns:
+        dict nome → DataFrame do rollup
+    """
+    limites = 'DATA_CMPT' in df.columns
+    cubo = {}
+    for nome, dimensoes in ROLLUPS_CUBO.items():
+        presentes = [dim for dim in dimensoes if dim in df.columns or (dim == 'MES' and limites)]
+        if presentes:
+            cubo[nome] = agregar_microdados(df, presentes, dropna=False, limites_data=limites)
+    return cubo
+
+@st.cache_resource(max_entries=4)
+def carregar_cubo(periodo=None, versao=None):
+    """Cubo de agregados da base devolvida por carregar_dados() com os mesmos argumentos (compartilhado, somente leitura)"""
+    df = carregar_dados(periodo, versao)
+    if df is None:
+        return None
+    cubo = construir_cubo(df)
+    for nome, rollup in cubo.items():
+        logger.info("Cubo de agregados: rollup %s com %d células para %d linhas (%.1f%%, %.1f MB)",
+                    nome, len(rollup), len(df), 100 * len(rollup) / max(len(df), 1),
+                    rollup.memory_usage(deep=True).sum() / 2 ** 20)
+    return cubo
+
+def filtrar_rollup(rollup, filtros, indice=None):
+    """
+    Aplica os filtros globais às células de um rollup
+
+    Retorna None quando o período corta alguma célula ao meio (ex.: começa no
+    meio de um mês que tem internações antes e depois da data).
+    """
+    dentro = None
+    if 'data_inicio' in filtros and 'data_fim' in filtros and 'DATA_MIN' in rollup.columns:
+        inicio = pd.Timestamp(filtros['data_inicio'])
+        fim = pd.Timestamp(filtros['data_fim']) + pd.Timedelta(days=1)
+        dentro = ((rollup['DATA_MIN'] >= inicio) & (rollup['DATA_MAX'] < fim)).to_numpy()
+        fora = ((rollup['DATA_MAX'] < inicio) | (rollup['DATA_MIN'] >= fim)).to_numpy()
+        if not (dentro | fora).all():
+            return None
+
+    # As demais colunas de filtro são dimensões do rollup: mesmo índice dos microdados
+    if indice is None:
+        indice = construir_indice_filtros(rollup)
+    posicoes = posicoes_filtradas(indice, {k: v for k, v in filtros.items() if k not in ('data_inicio', 'data_fim')})
+
+    if dentro is not None:
+        posicoes = np.flatnonzero(dentro) if posicoes is None else posicoes[dentro[posicoes]]
+    return rollup if posicoes is None else rollup.take(posicoes)
+
+def filtrar_cubo(cubo, filtros, indices=None):
+    """
+    Aplica os filtros globais aos rollups do cubo
+
+    Ficam só os rollups que contêm as colunas de todos os filtros ativos e
+    cujas células o período não corta; as consultas que nenhum deles responde
+    agregam os microdados filtrados.
+
+    Args:
+        indices: Índices de filtros de cada rollup (carregar_indice_filtros com cubo=True)
+
+    Returns:
+        dict nome → rollup filtrado (None se não houver cubo)
+    """
+    if cubo is None:
+        return None
+
+    ativos = {chave for chave, valor in filtros.items() if chave not in ('data_inicio', 'data_fim') and valor}
+    filtrado = {}
+    for nome, rollup in cubo.items():
+        if not ativos <= {chave for chave, _ in colunas_dos_filtros(rollup.columns)}:
+            continue
+        parte = filtrar_rollup(rollup, filtros, indices[nome] if indices is not None else None)
+        if parte is not None:
+            filtrado[nome] = parte
+    return filtrado
+
+def consultar(df, cubo, dimensoes=(), dropna=True):
+    """
+    Total de internações, somas e contagens das medidas agrupados por `dimensoes`
+
+    Responde pelo menor rollup do cubo (já filtrado) que contém as dimensões
+    pedidas; sem nenhum, agrega os microdados df. O formato do resultado é o
+    mesmo nos dois casos (ver agregar_microdados). Com uma visão filtrada de
+    main(), o resultado fica no cache de agregados (memorizar).
+    """
+    dimensoes = list(dimensoes)
+    return memorizar(df, ('consultar', tuple(dimensoes), dropna), lambda: _consultar(df, cubo, dimensoes, dropna))
+
+def _consultar(df, cubo, dimensoes, dropna):
+    motor = getattr(df, 'motor', None)
+    if motor is not None:
+        resultado = motor.agregar(dimensoes, dropna)
+        if resultado is not None:
+            return resultado
+
+    candidatos = [rollup for rollup in (cubo or {}).values() if all(dim in rollup.columns for dim in dimensoes)]
+    if not candidatos:
+        return agregar_microdados(df, dimensoes, dropna=dropna)
+
+    rollup = min(candidatos, key=len)
+    medidas = colunas_medidas(rollup)
+    if not dimensoes:
+        return pd.DataFrame({col: [rollup[col].sum()] for col in medidas})
+    if por_codigo(rollup, dimensoes, dropna):
+        return somar_por_codigo(rollup[dimensoes[0]], {col: rollup[col] for col in medidas})
+    return rollup.groupby(dimensoes, observed=True, dropna=dropna)[medidas].sum().reset_index()
+
+def reagrupar(agregado, dimensoes, medidas=('Total',), dropna=True):
+    """
+    Soma as medidas de um resultado de consultar() por cada item de `dimensoes`
+
+    Cada item (uma coluna ou uma tupla de colunas) passa por um único groupby
+    com todas as medidas pedidas pelo painel, sem voltar ao cubo nem aos
+    microdados.
+
+    Returns:
+        Dicionário item → DataFrame com as colunas do item e as medidas
+    """
+    return {
+        dim: agregado.groupby(list(dim) if isinstance(dim, tuple) else dim, observed=True, dropna=dropna)[
+            list(medidas)].sum().reset_index()
+        for dim in dimensoes
+    }
+
+def media(agregado, medida):
+    """Média da medida a partir da soma e da contagem de não-nulos"""
+    return agregado[medida] / agregado[f"{medida}_N"]
+
+def mais_frequente(agregado, dimensao, medida='Total'):
+    """
+    Valor da dimensão com a maior medida, ou None
+
+    Empates ficam com o menor valor, como Series.mode (que devolve os empatados
+    em ordem): pelo rótulo, ou pela ordem das categorias quando ela é definida
+    (ex.: faixas etárias). Lê o máximo direto das contagens já agregadas, sem
+    recorrer a .mode() sobre os microdados.
+    """
+    valores = agregado[medida].to_numpy(dtype=float, na_value=np.nan)
+    if len(valores) == 0 or np.isnan(valores).all():
+        return None
+    maior = np.nanmax(valores)
+    if not maior > 0:
+        return None
+    empatados = agregado[dimensao].iloc[np.flatnonzero(valores == maior)]
+    if empatados.dtype.name == 'category' and not empatados.cat.ordered:
+        # Categorias na ordem de aparição na base: o desempate é pelo rótulo
+        empatados = empatados.astype(empatados.cat.categories.dtype)
+    return empatados.sort_values().iloc[0]
+
+def ordenar_por_total(agregado, coluna='Total', k=None):
+    """
+    Ordem decrescente estável dos grupos com `coluna` > 0 (empates na ordem das categorias, como value_counts)
+
+    Com k, devolve só os k primeiros, por seleção parcial (maiores) em vez de ordenar tudo.
+    """
+    positivos = agregado[agregado[coluna] > 0]
+    if k is not None:
+        return maiores(positivos, coluna, k)
+    return positivos.sort_values(coluna, ascending=False, kind='stable')
+
+def posicoes_maiores(valores, k):
+    """
+    Posições dos k maiores valores, em ordem decrescente, por seleção parcial (np.partition)
+
+    Empates ficam com a menor posição e NaN só completa o resultado quando faltam
+    valores, como nlargest(keep='first'). Só os k vencedores (e os empatados no
+    corte) são ordenados.
+    """
+    valores = np.asarray(valores, dtype=float)
+    nulos = np.isnan(valores)
+    candidatos = np.flatnonzero(~nulos)
+    if k < len(candidatos):
+        corte = np.partition(valores[candidatos], len(candidatos) - k)[len(candidatos) - k]
+        acima = candidatos[valores[candidatos] > corte]
+        empates = candidatos[valores[candidatos] == corte][:k - len(acima)]
+        candidatos = np.concatenate([acima, empates])
+    ordem = candidatos[np.lexsort((candidatos, -valores[candidatos]))]
+    if len(ordem) < k:
+        ordem = np.concatenate([ordem, np.flatnonzero(nulos)[:k - len(ordem)]])
+    return ordem
+
+def maiores(agregado, coluna, k):
+    """Os k grupos com maior `coluna` (mesmo resultado de nlargest(k, coluna))"""
+    return agregado.iloc[posicoes_maiores(agregado[coluna].to_numpy(dtype=float, na_value=np.nan), k)]
+
+# ============================================================================
+# BACKEND DE CONSULTA ARROW (OPCIONAL)
+# ============================================================================
+
+def arquivos_snapshot(periodo=None):
+    """Snapshots processados de carregar_dados() (um por mês no dataset particionado), ou None se algum não existir"""
+    if periodo is not None:
+        return None
+    colunas = colunas_necessarias()
+    arquivos = [caminho_snapshot(caminho, colunas, nome) for caminho, nome in fontes_da_base()]
+    return arquivos if all(arquivo.exists() for arquivo in arquivos) else None
+
+@st.cache_resource(max_entries=8)
+def carregar_base_consultas(backend, periodo=None, versao=None):
+    """
+    Fonte do backend de consultas: os snapshots como uma pyarrow.Table em memória, compartilhada entre as sessões
+
+    Retorna None (e os painéis seguem com o pandas) se não houver snapshot:
+    com LEITURA_POR_PERIODO ou quando a gravação do snapshot falhou.
+    """
+    arquivos = arquivos_snapshot(periodo)
+    if arquivos is None:
+        logger.warning("Sem snapshot para o backend %s: usando pandas", backend)
+        return None
+    return ds.dataset([str(arquivo) for arquivo in arquivos], format='ipc',
+                      filesystem=pafs.LocalFileSystem(use_mmap=True)).to_table()
+
+def valores_do_filtro(valores):
+    """Itens de um multiselect como tipos Python (np.int32 → int), para as expressões do Arrow"""
+    return [valor.item() if isinstance(valor, np.generic) else valor for valor in valores]
+
+def limites_periodo(filtros):
+    """Período da sidebar como [início, fim + 1 dia), ou None se não houver filtro de data"""
+    if 'data_inicio' not in filtros or 'data_fim' not in filtros:
+        return None
+    return (pd.Timestamp(filtros['data_inicio']).to_pydatetime(),
+            (pd.Timestamp(filtros['data_fim']) + pd.Timedelta(days=1)).to_pydatetime())
+
+def dimensoes_disponiveis(dimensoes, colunas):
+    """Se todas as dimensões existem na fonte (MES vem de DATA_CMPT)"""
+    return all(dim in colunas or (dim == 'MES' and 'DATA_CMPT' in colunas) for dim in dimensoes)
+
+def no_formato_da_base(resultado, dimensoes, referencia):
+    """
+    Ajusta o agregado de um backend ao formato de agregar_microdados
+
+    Dimensões com os tipos da base (category com as mesmas categorias, MES no
+    início do mês) e grupos na ordem das categorias, ausentes no fim.
+    """
+    for dim in dimensoes:
+        if dim == 'MES':
+            resultado['MES'] = pd.to_datetime(resultado['MES']).dt.to_period('M').dt.to_timestamp()
+            continue
+        tipo = referencia[dim].dtype
+        if tipo.name == 'category':
+            resultado[dim] = pd.Categorical(resultado[dim], dtype=tipo)
+        elif resultado[dim].notna().all():
+            resultado[dim] = resultado[dim].astype(tipo)
+    if dimensoes:
+        resultado = resultado.sort_values(dimensoes, na_position='last', kind='stable', ignore_index=True)
+    return resultado
+
+def pertence_arrow(coluna, valores):
+    """
+    Máscara de `coluna` ∈ `valores` (pyarrow.compute)
+
+    Em colunas dictionary o teste é feito uma vez por valor do dicionário de
+    cada bloco e espalhado pelos índices, sem decodificar os textos das linhas.
+    """
+    if pa.types.is_dictionary(coluna.type):
+        conjunto = pa.array(valores, type=coluna.type.value_type)
+        return pa.chunked_array([
+            pc.fill_null(pc.take(pc.is_in(bloco.dictionary, value_set=conjunto), bloco.indices), False)
+            for bloco in coluna.chunks
+        ], type=pa.bool_())
+    return pc.is_in(coluna, value_set=pa.array(valores, type=coluna.type))
+
+def mascara_arrow(tabela, filtros):
+    """Máscara das linhas da tabela Arrow que atendem aos filtros globais da sidebar, ou None se nenhum estiver ativo"""
+    mascaras = []
+    periodo = limites_periodo(filtros)
+    if periodo is not None and 'DATA_CMPT' in tabela.column_names:
+        datas = tabela['DATA_CMPT']
+        mascaras += [pc.greater_equal(datas, pa.scalar(periodo[0], datas.type)),
+                     pc.less(datas, pa.scalar(periodo[1], datas.type))]
+    for chave, col in colunas_dos_filtros(tabela.column_names):
+        if filtros.get(chave):
+            mascaras.append(pertence_arrow(tabela[col], valores_do_filtro(filtros[chave])))
+    if not mascaras:
+        return None
+    mascara = mascaras[0]
+    for outra in mascaras[1:]:
+        mascara = pc.and_(mascara, outra)
+    return mascara
+
+class ConsultaArrow:
+    """
+    Agregações de consultar() com os kernels do Arrow sobre a tabela em memória
+
+    Os filtros globais são uma máscara de pyarrow.compute (colunas dictionary
+    testadas pelo dicionário) e as agregações saem de Table.group_by().aggregate(),
+    em várias threads; a tabela é compartilhada entre as sessões e nunca
+    alterada. O resultado só vira pandas no fim, no formato de agregar_microdados.
+    """
+
+    def __init__(self, base, referencia, filtros):
+        self.base = base
+        self.referencia = referencia
+        self.colunas = base.column_names
+        self.mascara = mascara_arrow(base, filtros)
+
+    def agregar(self, dimensoes, dropna=True):
+        """Resultado no formato de agregar_microdados, ou None se a consulta não puder ser feita no Arrow"""
+        if not dimensoes_disponiveis(dimensoes, self.colunas):
+            return None
+        medidas = [col for col in MEDIDAS_CUBO if col in self.colunas]
+        fontes = ['DATA_CMPT' if dim == 'MES' else dim for dim in dimensoes]
+        try:
+            tabela = self.base.select(list(dict.fromkeys(fontes + medidas)))
+            if self.mascara is not None:
+                tabela = tabela.filter(self.mascara)
+            if 'MES' in dimensoes:
+                tabela = tabela.append_column('MES', pc.floor_temporal(tabela['DATA_CMPT'], unit='month'))
+            if dropna and dimensoes:
+                validas = pc.is_valid(tabela[dimensoes[0]])
+                for dim in dimensoes[1:]:
+                    validas = pc.and_(validas, pc.is_valid(tabela[dim]))
+                tabela = tabela.filter(validas)
+
+            somas = pc.ScalarAggregateOptions(min_count=0)
+            agregado = tabela.group_by(dimensoes).aggregate(
+                [([], 'count_all')] + [(col, 'sum', somas) for col in medidas] + [(col, 'count') for col in medidas])
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+            logger.warning("Consulta Arrow falhou, usando pandas: %s", e)
+            return None
+
+        nomes = {'count_all': 'Total', **{f"{col}_sum": col for col in medidas},
+                 **{f"{col}_count": f"{col}_N" for col in medidas}}
+        resultado = agregado.rename_columns([nomes.get(nome, nome) for nome in agregado.column_names]).to_pandas()
+        resultado = resultado[dimensoes + colunas_medidas(resultado)]
+        return no_formato_da_base(resultado, dimensoes, self.referencia)
+
+# Motor de cada BACKEND_CONSULTAS opcional ("pandas" usa o cubo e os microdados)
+MOTORES_CONSULTA = {'arrow': ConsultaArrow}
+
+# ============================================================================
+# MATRIZ DE FLUXOS (REGULAÇÃO)
+# ============================================================================
+
+# Dimensões da tabela de fluxos residência → atendimento (por estabelecimento)
+DIMENSOES_FLUXO = ('MUNIC_RES', 'NOME_MUNIC_RES', 'MUNIC_MOV', 'NOME_MUNIC_MOV', 'CNES', 'NOME_FANTASIA')
+
+class MatrizFluxos:
+    """
+    Matriz esparsa origem × destino de internações, em coordenadas (linha, coluna, valor)
+
+    Cada entrada vem de uma linha da tabela de fluxos e é marcada como externa
+    quando o município de residência difere do de atendimento; na matriz
+    município × município, as internas são a diagonal. Os indicadores de
+    regulação saem das somas por linha e por coluna (np.bincount sobre os
+    códigos), sem voltar aos microdados. Origem ou destino ausente (código -1)
+    fica fora das somas daquele eixo, como no groupby.
+    """
+
+    def __init__(self, origens, destinos, valores, externas=None):
+        self.i, self.linhas = pd.factorize(origens, sort=True)
+        self.j, self.colunas = pd.factorize(destinos, sort=True)
+        self.valores = np.asarray(valores)
+        if externas is None:
+            externas = np.asarray(origens) != np.asarray(destinos)
+        self.externas = np.asarray(externas, dtype=bool)
+
+    @property
+    def nbytes(self):
+        return self.i.nbytes + self.j.nbytes + self.valores.nbytes + self.externas.nbytes
+
+    def _somar(self, codigos, rotulos, selecao=None):
+        validas = codigos >= 0
+        if selecao is not None:
+            validas &= selecao
+        somas = np.bincount(codigos[validas], weights=self.valores[validas], minlength=len(rotulos))
+        return pd.Series(somas.astype(self.valores.dtype), index=rotulos)
+
+    def total(self, externas=False):
+        """Soma de todas as entradas (só as externas, se externas=True)"""
+        return self.valores[self.externas].sum() if externas else self.valores.sum()
+
+    def soma_linhas(self, externas=False):
+        """Total por origem (só as entradas externas, se externas=True)"""
+        return self._somar(self.i, self.linhas, self.externas if externas else None)
+
+    def soma_colunas(self, externas=False):
+        """Total por destino (só as entradas externas, se externas=True)"""
+        return self._somar(self.j, self.colunas, self.externas if externas else None)
+
+    def diagonal(self):
+        """Total interno (mesmo município) por origem"""
+        return self._somar(self.i, self.linhas, ~self.externas)
+
+def matriz_fluxos(df, cubo, origem, destino):
+    """
+    Matriz `origem` × `destino` (colunas de DIMENSOES_FLUXO) da base filtrada
+
+    Montada a partir da tabela de fluxos de consultar(), reagrupada por par
+    origem × destino (reagrupar), e memorizada por combinação de filtros; as
+    entradas externas são sempre as de MUNIC_RES ≠ MUNIC_MOV, qualquer que
+    seja o par de colunas.
+    """
+    def montar():
+        fluxos = consultar_painel(df, cubo, 'fluxos')
+        fluxos = fluxos.assign(EXTERNA=(fluxos['MUNIC_RES'] != fluxos['MUNIC_MOV']).to_numpy())
+        # Uma entrada por par origem × destino (e externa/interna), e não por linha da tabela de fluxos
+        pares = reagrupar(fluxos, [(origem, destino, 'EXTERNA')], dropna=False)[(origem, destino, 'EXTERNA')]
+        return MatrizFluxos(pares[origem], pares[destino], pares['Total'], externas=pares['EXTERNA'].to_numpy())
+    return memorizar(df, ('matriz_fluxos', origem, destino), montar)
+
+# ============================================================================
+# CONSULTAS DOS PAINÉIS
+# ============================================================================
+
+def primeira_coluna(colunas, *candidatas):
+    """Primeira das `candidatas` presente em `colunas`, ou None"""
+    return next((col for col in candidatas if col in colunas), None)
+
+def par_cid_procedimento(colunas):
+    """Colunas (CID, procedimento) do heatmap: nomes quando existem os dois, senão os códigos (ou None)"""
+    if 'NOME_CID_PRINC' in colunas and 'NOME_PROC_REA' in colunas:
+        return ('NOME_CID_PRINC', 'NOME_PROC_REA')
+    col_cid = primeira_coluna(colunas, 'NOME_CID_PRINC', 'CID_PRINC')
+    col_proc = primeira_coluna(colunas, 'PROC_REA', 'PROCEDIMENTO')
+    return (col_cid, col_proc) if col_cid and col_proc else None
+
+# Consultas a consultar() feitas pelos painéis de dados: nome → (dimensões para as colunas da base, dropna).
+# Os painéis agregam só por aqui (consultar_painel), e o pré-cálculo calcula exatamente estas consultas
+# para as fatias mais usadas (consultas_dos_paineis): uma consulta nova entra nos dois ao ser incluída aqui.
+CONSULTAS_PAINEIS = {
+    'geral': (lambda colunas: (), True),
+    'mensal': (lambda colunas: ('MES',) if 'DATA_CMPT' in colunas else None, True),
+    'municipio_residencia': (lambda colunas: ('NOME_MUNIC_RES',), True),
+    'cid': (lambda colunas: (primeira_coluna(colunas, 'NOME_CID_PRINC', 'CID_PRINC'),), True),
+    'faixa_etaria': (lambda colunas: ('FAIXA_ETARIA',), True),
+    'faixa_etaria_sexo': (lambda colunas: ('FAIXA_ETARIA', 'SEXO'), True),
+    'sexo': (lambda colunas: ('SEXO',), True),
+    'raca_cor': (lambda colunas: ('RACA_COR',), True),
+    'fluxos': (lambda colunas: tuple(col for col in DIMENSOES_FLUXO if col in colunas), False),
+    'estabelecimento': (lambda colunas: ('CNES',), True),
+    'procedimento': (lambda colunas: (primeira_coluna(colunas, 'NOME_PROC_REA', 'PROC_REA', 'PROCEDIMENTO'),), True),
+    'cid_procedimento': (par_cid_procedimento, True),
+    'cid_do_heatmap': (lambda colunas: (par_cid_procedimento(colunas) or (None,))[:1], True),
+    'procedimento_do_heatmap': (lambda colunas: (par_cid_procedimento(colunas) or (None, None))[1:], True),
+}
+
+def dimensoes_painel(nome, colunas):
+    """Dimensões da consulta `nome` de CONSULTAS_PAINEIS sobre uma base com `colunas`, ou None se faltar coluna"""
+    dimensoes = CONSULTAS_PAINEIS[nome][0](colunas)
+    disponiveis = set(colunas) | ({'MES'} if 'DATA_CMPT' in colunas else set())
+    if dimensoes is None or not set(dimensoes) <= disponiveis:
+        return None
+    return dimensoes
+
+def consultar_painel(df, cubo, nome):
+    """consultar() para a consulta `nome` de CONSULTAS_PAINEIS (None se a base não tem as colunas)"""
+    dimensoes = dimensoes_painel(nome, df.columns)
+    if dimensoes is None:
+        return None
+    return consultar(df, cubo, dimensoes, CONSULTAS_PAINEIS[nome][1])
+
+# ============================================================================
+# CACHE DE AGREGADOS
+# ============================================================================
+
+def chave_filtros(filtros, *contexto):
+    """
+    Hash canônico dos filtros: a mesma seleção dá sempre a mesma chave,
+    independentemente da ordem das chaves e dos itens escolhidos nos multiselects
+
+    Args:
+        contexto: Demais valores que identificam a base (ex.: período lido e versão da fonte)
+    """
+    normalizados = {
+        chave: sorted(map(str, valor)) if isinstance(valor, (list, tuple, set)) else str(valor)
+        for chave, valor in filtros.items()
+    }
+    texto = json.dumps([normalizados, [str(valor) for valor in contexto]], sort_keys=True)
+    return hashlib.sha1(texto.encode()).hexdigest()
+
+class CacheAgregados:
+    """
+    Cache LRU dos resultados agregados pelos painéis, limitado pelo total de bytes
+
+    Compartilhado entre sessões (cache_resource): guarda apenas resultados já
+    agregados, nunca figuras. DataFrames são devolvidos como cópias rasas
+    (copy-on-write), de modo que um painel não altera o resultado guardado para
+    os demais; outras estruturas (ex.: MatrizFluxos) são tratadas como somente
+    leitura e precisam informar o tamanho em `nbytes`.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self.bytes = 0
+        self.acertos = 0
+        self.faltas = 0
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave, calcular):
+        """Resultado guardado sob `chave`, ou calcular() (guardado se couber no limite)"""
+        with self._trava:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+                return self._entregar(self._itens[chave][0])
+            self.faltas += 1
+
+        resultado = calcular()
+        self.guardar(chave, resultado)
+        return self._entregar(resultado)
+
+    def guardar(self, chave, resultado):
+        """Guarda `resultado` sob `chave` se couber no limite (descartando os menos usados)"""
+        if isinstance(resultado, pd.DataFrame):
+            tamanho = int(resultado.memory_usage(deep=True).sum())
+        else:
+            tamanho = int(resultado.nbytes)
+        if tamanho > self.limite_bytes:
+            return
+
+        with self._trava:
+            if chave not in self._itens:
+                self._itens[chave] = (resultado, tamanho)
+                self.bytes += tamanho
+                while self.bytes > self.limite_bytes:
+                    _, (_, removido) = self._itens.popitem(last=False)
+                    self.bytes -= removido
+
+    def retirar(self, filtros):
+        """Remove e devolve os pares (consulta, resultado) guardados para a chave de filtros `filtros`"""
+        with self._trava:
+            chaves = [chave for chave in self._itens if chave[0] == filtros]
+            retirados = []
+            for chave in chaves:
+                resultado, tamanho = self._itens.pop(chave)
+                self.bytes -= tamanho
+                retirados.append((chave[1], resultado))
+        return retirados
+
+    @staticmethod
+    def _entregar(resultado):
+        return resultado.copy(deep=False) if isinstance(resultado, pd.DataFrame) else resultado
+
+    def estatisticas(self):
+        """Acertos, faltas, itens e megabytes ocupados"""
+        return {'acertos': self.acertos, 'faltas': self.faltas,
+                'itens': len(self._itens), 'mb': self.bytes / 2 ** 20}
+
+@st.cache_resource
+def cache_agregados():
+    """Instância única do cache de agregados no processo"""
+    return CacheAgregados(LIMITE_CACHE_AGREGADOS_MB * 2 ** 20)
+
+def memorizar(df, consulta, calcular):
+    """
+    calcular() guardado no cache de agregados sob a combinação de filtros de df
+
+    Só visões filtradas com chave (montadas em main()) usam o cache; para
+    qualquer outro df o resultado é calculado na hora.
+
+    Args:
+        consulta: Identificação hashable do cálculo dentro da mesma combinação de filtros
+    """
+    chave = getattr(df, 'chave', None)
+    if chave is None:
+        return calcular()
+    return cache_agregados().obter((chave, consulta), calcular)
+
 # ============================================================================
 # FUNÇÕES AUXILIARES
 # ============================================================================
 
+def contar_valores(serie):
+    """value_counts sem as categorias sem ocorrência (colunas category guardam todas as categorias)"""
+    contagem = serie.value_counts()
+    return contagem[contagem > 0]
+
+# Troca de separadores en-US → pt-BR em uma única passada (1,234.5 → 1.234,5)
+SEPARADORES_PT_BR = str.maketrans({',': '.', '.': ','})
+
 def formatar_numero(valor):
     """Formata número com separador de milhares"""
     return f"{valor:,.0f}".replace(",", ".")
 
 def formatar_moeda(valor):
     """Formata valor monetário em R$"""
-    return f"R$ {valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    return f"R$ {valor:,.2f}".translate(SEPARADORES_PT_BR)
 
 def formatar_percentual(valor):
     """Formata percentual com 1 casa decimal"""
     return f"{valor:.1f}%"
 
+def formatar_colunas(tabela, formatos):
+    """
+    Cópia da tabela para exibição, com as colunas de `formatos` ({coluna: formatar_*}) convertidas em texto
+
+    Chame só sobre as linhas que vão para a tela: a tabela original continua
+    numérica, para ordenação e downloads.
+    """
+    tabela = tabela.copy()
+    for coluna, formatar in formatos.items():
+        if coluna in tabela.columns:
+            tabela[coluna] = tabela[coluna].map(formatar)
+    return tabela
+
 def calcular_delta_percentual(atual, anterior):
     """Calcula variação percentual"""
     if anterior == 0:
@@ -440,8 +1573,72 @@ def calcular_delta_percentual(atual, anterior):
 # FILTROS GLOBAIS NA SIDEBAR
 # ============================================================================
 
-def criar_filtros_sidebar(df):
-    """Cria todos os filtros globais na sidebar"""
+def valores_presentes(serie):
+    """Valores distintos não nulos da coluna, ordenados (em category, pelos códigos presentes, sem comparar textos)"""
+    if serie.dtype.name == 'category':
+        codigos = serie.cat.codes.to_numpy()
+        return sorted(serie.cat.categories[np.flatnonzero(np.bincount(codigos[codigos >= 0],
+                                                                      minlength=len(serie.cat.categories)))])
+    return sorted(serie.dropna().unique().tolist())
+
+def rotulos_por_codigo(df, codigo, rotulo):
+    """Dicionário código → rótulo (primeiro rótulo encontrado para cada código)"""
+    pares = df[[codigo, rotulo]].dropna().drop_duplicates(codigo)
+    return dict(zip(pares[codigo].tolist(), pares[rotulo].astype(str).tolist()))
+
+def construir_dimensoes(df):
+    """
+    Tabelas de dimensão da base: opções ordenadas dos seletores e rótulos por código
+
+    Montadas uma vez por carga (carregar_dimensoes), de modo que a sidebar e o
+    seletor de estabelecimentos não percorrem a base a cada rerun e o
+    format_func dos seletores é uma consulta O(1) a um dicionário.
+
+    Returns:
+        dict com 'periodo' (primeira e última DATA_CMPT) e, por coluna presente,
+        'opcoes' (valores ordenados) e, quando houver, 'rotulos' (código → nome)
+    """
+    dimensoes = {}
+    if 'DATA_CMPT' in df.columns:
+        dimensoes['periodo'] = (df['DATA_CMPT'].min(), df['DATA_CMPT'].max())
+
+    for nome, codigo in (('NOME_MUNIC_RES', 'MUNIC_RES'), ('NOME_MUNIC_MOV', 'MUNIC_MOV'),
+                         ('NOME_CID_PRINC', None), ('CID_PRINC', None), ('NOME_PROC_REA', 'PROC_REA')):
+        if nome in df.columns:
+            dimensoes[nome] = {'opcoes': valores_presentes(df[nome])}
+            if codigo in df.columns:
+                dimensoes[nome]['rotulos'] = rotulos_por_codigo(df, codigo, nome)
+
+    if 'CNES' in df.columns:
+        dimensoes['CNES'] = {'opcoes': valores_presentes(df['CNES'])}
+        if 'NOME_FANTASIA' in df.columns:
+            nomes = rotulos_por_codigo(df, 'CNES', 'NOME_FANTASIA')
+            dimensoes['CNES']['nomes'] = nomes
+            dimensoes['CNES']['rotulos'] = {cnes: f"{cnes} - {nome}" for cnes, nome in nomes.items()}
+            if 'MUNIC_MOV' in df.columns:
+                municipios = rotulos_por_codigo(df, 'CNES', 'MUNIC_MOV')
+                dimensoes['CNES']['rotulos_municipio'] = {
+                    cnes: f"{cnes} - {nome} ({municipios[cnes]})" for cnes, nome in nomes.items() if cnes in municipios
+                }
+    return dimensoes
+
+@st.cache_resource(max_entries=4)
+def carregar_dimensoes(periodo=None, versao=None):
+    """Tabelas de dimensão (construir_dimensoes) da base de carregar_dados() com os mesmos argumentos"""
+    df = carregar_dados(periodo, versao)
+    return None if df is None else construir_dimensoes(df)
+
+@usa_colunas('DATA_CMPT', 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV', 'CNES', 'NOME_FANTASIA',
+             'SEXO', 'FAIXA_ETARIA', 'RACA_COR', 'NOME_CID_PRINC', 'CID_PRINC')
+def criar_filtros_sidebar(df, dimensoes=None):
+    """
+    Cria todos os filtros globais na sidebar
+
+    Args:
+        dimensoes: Tabelas de dimensão de df (carregar_dimensoes); se None, são montadas na hora
+    """
+    if dimensoes is None:
+        dimensoes = construir_dimensoes(df)
 
     st.sidebar.markdown("<h1 style='color: white !important;'>🏥 Dashboard SIH/DATASUS</h1>", unsafe_allow_html=True)
     st.sidebar.markdown("---")
@@ -453,8 +1650,14 @@ def criar_filtros_sidebar(df):
     # Filtro de Período
     if 'DATA_CMPT' in df.columns:
         st.sidebar.subheader("📅 Período")
-        data_min = df['DATA_CMPT'].min().date()
-        data_max = df['DATA_CMPT'].max().date()
+        if LEITURA_POR_PERIODO:
+            # A base carregada já vem recortada pelo período escolhido:
+            # os limites precisam vir da janela configurada, não dos dados
+            data_min = pd.Timestamp(DATA_INICIO_JANELA).date()
+            data_max = pd.Timestamp(DATA_FIM_JANELA).date()
+        else:
+            data_min = dimensoes['periodo'][0].date()
+            data_max = dimensoes['periodo'][1].date()
 
         col1, col2 = st.sidebar.columns(2)
         with col1:
@@ -463,7 +1666,8 @@ def criar_filtros_sidebar(df):
                 value=data_min,  # Usar data_min em vez de calcular 365 dias atrás
                 min_value=data_min,
                 max_value=data_max,
-                help="Dados filtrados para janeiro-julho/2025"
+                help="Dados filtrados para janeiro-julho/2025",
+                key="filtro_data_inicio"
             )
         with col2:
             filtros['data_fim'] = st.date_input(
@@ -471,14 +1675,15 @@ def criar_filtros_sidebar(df):
                 value=data_max,
                 min_value=data_min,
                 max_value=data_max,
-                help="Dados filtrados para janeiro-julho/2025"
+                help="Dados filtrados para janeiro-julho/2025",
+                key="filtro_data_fim"
             )
     
     # Filtros de Município (separados por residência e atendimento)
     st.sidebar.subheader("📍 Municípios")
 
     if 'NOME_MUNIC_RES' in df.columns:
-        municipios_res = sorted(df['NOME_MUNIC_RES'].dropna().unique())
+        municipios_res = dimensoes['NOME_MUNIC_RES']['opcoes']
         filtros['municipio_residencia'] = st.sidebar.multiselect(
             "Município de Residência",
             options=municipios_res,
@@ -487,7 +1692,7 @@ def criar_filtros_sidebar(df):
         )
 
     if 'NOME_MUNIC_MOV' in df.columns:
-        municipios_atend = sorted(df['NOME_MUNIC_MOV'].dropna().unique())
+        municipios_atend = dimensoes['NOME_MUNIC_MOV']['opcoes']
         filtros['municipio_atendimento'] = st.sidebar.multiselect(
             "Município de Atendimento",
             options=municipios_atend,
@@ -499,19 +1704,16 @@ def criar_filtros_sidebar(df):
     if 'CNES' in df.columns:
         st.sidebar.subheader("🏥 Estabelecimento")
         if 'NOME_FANTASIA' in df.columns:
-            cnes_options = df[['CNES', 'NOME_FANTASIA']].drop_duplicates().copy()
-            # Converter para string para evitar problemas com categorical
-            cnes_options['NOME_FANTASIA'] = cnes_options['NOME_FANTASIA'].astype(str)
-            cnes_options['display'] = cnes_options['CNES'].astype(str) + ' - ' + cnes_options['NOME_FANTASIA'].fillna('')
+            rotulos_cnes = dimensoes['CNES']['rotulos']
             filtros['cnes'] = st.sidebar.multiselect(
                 "Estabelecimento(s)",
-                options=cnes_options['CNES'].tolist(),
-                format_func=lambda x: cnes_options[cnes_options['CNES'] == x]['display'].iloc[0] if len(cnes_options[cnes_options['CNES'] == x]) > 0 else str(x)
+                options=dimensoes['CNES']['opcoes'],
+                format_func=lambda x: rotulos_cnes.get(x, str(x))
             )
         else:
             filtros['cnes'] = st.sidebar.multiselect(
                 "CNES",
-                options=sorted(df['CNES'].dropna().unique())
+                options=dimensoes['CNES']['opcoes']
             )
     
     # Filtros Demográficos
@@ -520,21 +1722,21 @@ def criar_filtros_sidebar(df):
     if 'SEXO' in df.columns:
         filtros['sexo'] = st.sidebar.multiselect(
             "Sexo",
-            options=['Masculino', 'Feminino', 'Ignorado'],
+            options=CATEGORIAS_SEXO,
             default=None
         )
     
     if 'FAIXA_ETARIA' in df.columns:
         filtros['faixa_etaria'] = st.sidebar.multiselect(
             "Faixa Etária",
-            options=['<1', '1-4', '5-9', '10-14', '15-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'],
+            options=FAIXAS_ETARIAS,
             default=None
         )
     
     if 'RACA_COR' in df.columns:
         filtros['raca_cor'] = st.sidebar.multiselect(
             "Raça/Cor",
-            options=['Branca', 'Preta', 'Parda', 'Amarela', 'Indígena', 'Ignorada'],
+            options=CATEGORIAS_RACA_COR,
             default=None
         )
     
@@ -542,7 +1744,7 @@ def criar_filtros_sidebar(df):
     if 'NOME_CID_PRINC' in df.columns or 'CID_PRINC' in df.columns:
         st.sidebar.subheader("🔬 Diagnóstico")
         col_cid = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in df.columns else 'CID_PRINC'
-        cids = sorted(df[col_cid].dropna().unique())
+        cids = dimensoes[col_cid]['opcoes']
         filtros['cid'] = st.sidebar.multiselect(
             "CID Principal",
             options=cids
@@ -560,55 +1762,266 @@ def criar_filtros_sidebar(df):
     st.sidebar.subheader("ℹ️ Informações")
     st.sidebar.info(f"""
     **Total de registros:** {formatar_numero(len(df))}  
-    **Período:** {df['DATA_CMPT'].min().strftime('%m/%Y') if 'DATA_CMPT' in df.columns else 'N/A'} - {df['DATA_CMPT'].max().strftime('%m/%Y') if 'DATA_CMPT' in df.columns else 'N/A'}  
+    **Período:** {dimensoes['periodo'][0].strftime('%m/%Y') if 'periodo' in dimensoes else 'N/A'} - {dimensoes['periodo'][1].strftime('%m/%Y') if 'periodo' in dimensoes else 'N/A'}  
     **Fonte:** SIH/DATASUS
     """)
     
     return filtros
 
-def aplicar_filtros(df, filtros):
-    """Aplica os filtros selecionados ao dataframe"""
-    
-    df_filtrado = df.copy()
-    
-    # Filtro de período
-    if 'data_inicio' in filtros and 'data_fim' in filtros and 'DATA_CMPT' in df.columns:
-        df_filtrado = df_filtrado[
-            (df_filtrado['DATA_CMPT'].dt.date >= filtros['data_inicio']) &
-            (df_filtrado['DATA_CMPT'].dt.date <= filtros['data_fim'])
-        ]
-    
-    # Filtro de município de residência
-    if filtros.get('municipio_residencia') and 'NOME_MUNIC_RES' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['NOME_MUNIC_RES'].isin(filtros['municipio_residencia'])]
+def colunas_dos_filtros(colunas):
+    """Pares (chave do filtro, coluna) dos filtros de valor da sidebar presentes em `colunas`"""
+    col_cid = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in colunas else 'CID_PRINC'
+    pares = [
+        ('municipio_residencia', 'NOME_MUNIC_RES'),
+        ('municipio_atendimento', 'NOME_MUNIC_MOV'),
+        ('cnes', 'CNES'),
+        ('sexo', 'SEXO'),
+        ('faixa_etaria', 'FAIXA_ETARIA'),
+        ('raca_cor', 'RACA_COR'),
+        ('cid', col_cid),
+    ]
+    return [(chave, col) for chave, col in pares if col in colunas]
+
+def construir_indice_filtros(df):
+    """
+    Índice invertido das colunas de filtro: valor → linhas, sem cópia da base
 
-    # Filtro de município de atendimento
-    if filtros.get('municipio_atendimento') and 'NOME_MUNIC_MOV' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['NOME_MUNIC_MOV'].isin(filtros['municipio_atendimento'])]
-    
-    # Filtro de CNES
-    if filtros.get('cnes') and 'CNES' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['CNES'].isin(filtros['cnes'])]
-    
-    # Filtro de sexo
-    if filtros.get('sexo') and 'SEXO' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['SEXO'].isin(filtros['sexo'])]
-    
-    # Filtro de faixa etária
-    if filtros.get('faixa_etaria') and 'FAIXA_ETARIA' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['FAIXA_ETARIA'].isin(filtros['faixa_etaria'])]
-    
-    # Filtro de raça/cor
-    if filtros.get('raca_cor') and 'RACA_COR' in df.columns:
-        df_filtrado = df_filtrado[df_filtrado['RACA_COR'].isin(filtros['raca_cor'])]
-    
-    # Filtro de CID
-    if filtros.get('cid'):
-        col_cid = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in df.columns else 'CID_PRINC'
-        if col_cid in df.columns:
-            df_filtrado = df_filtrado[df_filtrado[col_cid].isin(filtros['cid'])]
-    
-    return df_filtrado
+    Por coluna guarda o código de cada linha (códigos de category, ou
+    pd.factorize nas demais; -1 = ausente) e as posições das linhas ordenadas
+    por código, com o início de cada código (as linhas com o código k são
+    ordem[inicios[k]:inicios[k + 1]]). Para DATA_CMPT guarda as datas e a
+    ordem cronológica das linhas, de modo que um período é uma fatia contígua.
+    """
+    indice = {'linhas': len(df), 'colunas': {}}
+
+    for _, col in colunas_dos_filtros(df.columns):
+        serie = df[col]
+        if serie.dtype.name == 'category':
+            codigos, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+        else:
+            codigos, valores = pd.factorize(serie)
+            codigos = codigos.astype(np.min_scalar_type(-max(len(valores), 1)))
+        ordem = np.argsort(codigos, kind='stable').astype(np.int32)
+        # Ausentes (-1) ficam no início da ordem e não pertencem a nenhum valor
+        inicios = np.searchsorted(codigos[ordem], np.arange(len(valores) + 1))
+        indice['colunas'][col] = {'valores': valores, 'codigos': codigos, 'ordem': ordem, 'inicios': inicios}
+
+    if 'DATA_CMPT' in df.columns:
+        datas = df['DATA_CMPT'].to_numpy(dtype='datetime64[ns]')
+        ordem = np.argsort(datas, kind='stable').astype(np.int32)
+        indice['datas'] = {'datas': datas, 'ordem': ordem, 'ordenadas': datas[ordem]}
+
+    # Estruturas compartilhadas entre sessões (cache_resource): somente leitura
+    for estrutura in [*indice['colunas'].values(), indice.get('datas', {})]:
+        for chave, valor in estrutura.items():
+            if isinstance(valor, np.ndarray):
+                valor.setflags(write=False)
+    return indice
+
+def restricoes_filtros(indice, filtros):
+    """
+    Converte os filtros ativos em restrições (tamanho, linhas, teste)
+
+    tamanho: número de linhas que satisfazem a restrição (sem percorrer a base);
+    linhas(): posições dessas linhas; teste(posicoes): máscara das posições que
+    satisfazem a restrição, por consulta direta aos códigos/datas.
+    """
+    restricoes = []
+
+    if 'data_inicio' in filtros and 'data_fim' in filtros and 'datas' in indice:
+        d = indice['datas']
+        inicio = np.datetime64(pd.Timestamp(filtros['data_inicio']), 'ns')
+        fim = np.datetime64(pd.Timestamp(filtros['data_fim']) + pd.Timedelta(days=1), 'ns')
+        a, b = np.searchsorted(d['ordenadas'], [inicio, fim])
+        restricoes.append((
+            b - a,
+            lambda d=d, a=a, b=b: d['ordem'][a:b],
+            lambda pos, d=d, inicio=inicio, fim=fim: (d['datas'][pos] >= inicio) & (d['datas'][pos] < fim),
+        ))
+
+    for chave, col in colunas_dos_filtros(indice['colunas']):
+        if not filtros.get(chave):
+            continue
+        c = indice['colunas'][col]
+        selecionados = c['valores'].get_indexer(list(filtros[chave]))
+        selecionados = np.unique(selecionados[selecionados >= 0])
+        # Tabela de consulta por código; a posição extra no final atende o código -1 (ausente)
+        permitido = np.zeros(len(c['valores']) + 1, dtype=bool)
+        permitido[selecionados] = True
+        restricoes.append((
+            int((c['inicios'][selecionados + 1] - c['inicios'][selecionados]).sum()),
+            lambda c=c, sel=selecionados: np.concatenate(
+                [c['ordem'][c['inicios'][k]:c['inicios'][k + 1]] for k in sel] or [np.empty(0, np.int32)]),
+            lambda pos, c=c, permitido=permitido: permitido[c['codigos'][pos]],
+        ))
+
+    return restricoes
+
+def posicoes_filtradas(indice, filtros):
+    """
+    Posições (ordem crescente) das linhas que atendem aos filtros, ou None se nenhum filtro restringe a base
+
+    Parte da restrição mais seletiva, lida direto do índice, e testa as demais
+    apenas nessas linhas: o custo acompanha o tamanho do resultado, não o da
+    base nem o número de filtros ativos.
+    """
+    restricoes = [r for r in restricoes_filtros(indice, filtros) if r[0] < indice['linhas']]
+    if not restricoes:
+        return None
+
+    restricoes.sort(key=lambda r: r[0])
+    posicoes = np.sort(restricoes[0][1]()).astype(np.intp)
+    for _, _, teste in restricoes[1:]:
+        if len(posicoes) == 0:
+            break
+        posicoes = posicoes[teste(posicoes)]
+    return posicoes
+
+@st.cache_resource(max_entries=4)
+def carregar_indice_filtros(periodo=None, versao=None, cubo=False):
+    """Índice de filtros da base (ou, com cubo=True, um por rollup do cubo) de carregar_dados()/carregar_cubo()"""
+    if cubo:
+        rollups = carregar_cubo(periodo, versao)
+        return None if rollups is None else {nome: construir_indice_filtros(r) for nome, r in rollups.items()}
+    base = carregar_dados(periodo, versao)
+    return None if base is None else construir_indice_filtros(base)
+
+def aplicar_filtros(df, filtros, indice=None):
+    """
+    Aplica os filtros selecionados ao dataframe
+
+    Args:
+        indice: Índice de df (construir_indice_filtros); se None, é construído na hora
+
+    Returns:
+        df sem cópia quando nenhum filtro restringe a base; senão apenas as linhas selecionadas
+    """
+    posicoes = posicoes_filtradas(indice if indice is not None else construir_indice_filtros(df), filtros)
+    return df if posicoes is None else df.take(posicoes)
+
+class VisaoFiltrada:
+    """
+    Base filtrada sem cópia: guarda só as posições das linhas selecionadas
+
+    Cada coluna é copiada da base na primeira vez que um painel a pede e fica
+    guardada para os demais, de modo que o rerun só materializa as colunas
+    realmente usadas (com o cubo, quase nenhuma). Oferece a parte da API de
+    DataFrame usada pelos painéis: columns, index, len(), visao['COL'],
+    visao[['A', 'B']] (DataFrame) e visao[máscara booleana] (nova visão).
+
+    `chave` (chave_filtros) identifica a combinação de filtros no cache de
+    agregados e `motor` (MOTORES_CONSULTA), quando existe, responde
+    às agregações; sub-visões criadas por máscara não têm nenhum dos dois.
+    """
+
+    def __init__(self, base, posicoes=None, chave=None, motor=None):
+        self.base = base
+        self.posicoes = posicoes
+        self.chave = chave
+        self.motor = motor
+        self.columns = base.columns
+        self.index = base.index if posicoes is None else base.index.take(posicoes)
+        self._colunas = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def coluna(self, nome):
+        """Coluna `nome` nas linhas selecionadas (sem cópia quando nenhum filtro restringe a base)"""
+        if nome not in self._colunas:
+            serie = self.base[nome]
+            self._colunas[nome] = serie if self.posicoes is None else serie.take(self.posicoes)
+        return self._colunas[nome]
+
+    def __getitem__(self, chave):
+        if isinstance(chave, str):
+            return self.coluna(chave)
+        if isinstance(chave, (pd.Series, np.ndarray)) and chave.dtype == bool:
+            mascara = np.asarray(chave)
+            posicoes = np.flatnonzero(mascara) if self.posicoes is None else self.posicoes[mascara]
+            return VisaoFiltrada(self.base, posicoes)
+        colunas = list(chave)
+        if not colunas:
+            return pd.DataFrame(index=self.index)
+        return pd.DataFrame({col: self.coluna(col) for col in colunas})
+
+    def materializadas(self):
+        """Colunas já copiadas da base"""
+        return list(self._colunas)
+
+# ============================================================================
+# TABELAS PAGINADAS
+# ============================================================================
+
+def pagina_ordenada(tabela, coluna=None, decrescente=True, pagina=1, linhas=LINHAS_POR_PAGINA):
+    """Linhas de uma página da tabela ordenada pelos valores brutos da coluna (nulos no fim, empates na ordem original)"""
+    if coluna is not None:
+        tabela = tabela.sort_values(coluna, ascending=not decrescente, kind='stable', na_position='last')
+    inicio = (pagina - 1) * linhas
+    return tabela.iloc[inicio:inicio + linhas]
+
+def tabela_paginada(tabela, chave, formatos=None, ordenar_por=None, decrescente=True,
+                    linhas=LINHAS_POR_PAGINA, altura=None):
+    """
+    Exibe a tabela em páginas, com ordenação e paginação feitas no servidor
+
+    Apenas a página visível é formatada e enviada ao navegador; o total de
+    linhas aparece abaixo da tabela.
+
+    Args:
+        tabela: DataFrame com os valores brutos (numéricos) do agregado
+        chave: Prefixo único dos widgets da tabela
+        formatos: {coluna: formatar_*} aplicado só às linhas da página (ex.: formatar_moeda)
+        ordenar_por: Coluna da ordenação inicial (None mantém a ordem da tabela)
+        decrescente: Sentido da ordenação inicial
+        linhas: Linhas por página
+        altura: Altura do st.dataframe (None = automática)
+    """
+    total = len(tabela)
+    paginas = max(1, -(-total // linhas))
+    chave_pagina = f"{chave}_pagina"
+
+    def voltar_ao_inicio():
+        st.session_state[chave_pagina] = 1
+
+    # A página vive só no session_state (o widget não recebe value=, que conflitaria com voltar_ao_inicio);
+    # filtros novos podem encolher a tabela: a página guardada volta para dentro do intervalo
+    st.session_state.setdefault(chave_pagina, 1)
+    if st.session_state[chave_pagina] > paginas:
+        st.session_state[chave_pagina] = paginas
+
+    opcoes = [None] + list(tabela.columns)
+    col1, col2, col3 = st.columns([3, 2, 2])
+    with col1:
+        coluna = st.selectbox(
+            "Ordenar por",
+            opcoes,
+            index=opcoes.index(ordenar_por),
+            format_func=lambda opcao: "Ordem padrão" if opcao is None else str(opcao),
+            key=f"{chave}_ordem",
+            on_change=voltar_ao_inicio
+        )
+    with col2:
+        sentido = st.radio(
+            "Sentido",
+            ["Decrescente", "Crescente"],
+            index=0 if decrescente else 1,
+            horizontal=True,
+            key=f"{chave}_sentido",
+            on_change=voltar_ao_inicio,
+            disabled=coluna is None
+        )
+    with col3:
+        pagina = st.number_input("Página", min_value=1, max_value=paginas, step=1, key=chave_pagina)
+
+    recorte = formatar_colunas(pagina_ordenada(tabela, coluna, sentido == "Decrescente", int(pagina), linhas),
+                               formatos or {})
+
+    if altura is None:
+        st.dataframe(recorte, use_container_width=True)
+    else:
+        st.dataframe(recorte, height=altura, use_container_width=True)
+    st.caption(f"{formatar_numero(total)} linhas · página {int(pagina)} de {paginas}")
 
 # ============================================================================
 # PAINEL 0: INICIAL (BEM-VINDO E INSTRUÇÕES)
@@ -751,17 +2164,17 @@ def painel_inicial():
 # PAINEL 1: GERAL (GESTÃO E FINANÇAS)
 # ============================================================================
 
-def painel_geral(df):
-    """Painel de visão geral - gestão e finanças"""
+@usa_colunas('DATA_CMPT', 'NOME_MUNIC_RES', 'DIAS_PERM', 'DIAS_UTI', 'MORTE', 'VAL_TOT')
+def painel_geral(df, cubo=None):
+    """Painel de visão geral - gestão e finanças (agregados via consultar: cubo quando disponível)"""
     
     st.title("📊 Painel Geral - Gestão e Finanças")
     st.markdown("---")
     
     # KPIs principais
-
+    geral = consultar_painel(df, cubo, 'geral').iloc[0]
     
-    
-    total_internacoes = len(df)
+    total_internacoes = geral['Total']
     st.metric(
         label="🏥 Total de Internações",
         value=formatar_numero(total_internacoes)
@@ -769,7 +2182,7 @@ def painel_geral(df):
     
     
     if 'DIAS_PERM' in df.columns:
-        media_permanencia = df['DIAS_PERM'].mean()
+        media_permanencia = geral['DIAS_PERM'] / geral['DIAS_PERM_N']
         st.metric(
             label="⏱️ Média de Permanência",
             value=f"{media_permanencia:.1f} dias"
@@ -777,7 +2190,7 @@ def painel_geral(df):
     
     
     if 'MORTE' in df.columns:
-        taxa_mortalidade = (df['MORTE'].sum() / len(df)) * 100
+        taxa_mortalidade = (geral['MORTE'] / total_internacoes) * 100
         st.metric(
             label="💔 Taxa de Mortalidade",
             value=formatar_percentual(taxa_mortalidade)
@@ -785,8 +2198,8 @@ def painel_geral(df):
     
     
     if 'DIAS_UTI' in df.columns and 'DIAS_PERM' in df.columns:
-        dias_uti = df['DIAS_UTI'].sum()
-        dias_total = df['DIAS_PERM'].sum()
+        dias_uti = geral['DIAS_UTI']
+        dias_total = geral['DIAS_PERM']
         taxa_uti = (dias_uti / dias_total * 100) if dias_total > 0 else 0
 
         # Adicionar aviso se não houver UTI
@@ -800,7 +2213,7 @@ def painel_geral(df):
     
     
     if 'VAL_TOT' in df.columns:
-        custo_medio = df['VAL_TOT'].mean()
+        custo_medio = geral['VAL_TOT'] / geral['VAL_TOT_N']
         st.metric(
             label="💰 Custo Médio por AIH",
             value=formatar_moeda(custo_medio)
@@ -813,8 +2226,7 @@ def painel_geral(df):
         st.subheader("📈 Evolução Mensal de Internações")
         st.markdown("*Gráfico de barras mostrando a evolução do volume de internações ao longo dos meses*")
 
-        df_temporal = df.groupby(df['DATA_CMPT'].dt.to_period('M')).size().reset_index(name='Total')
-        df_temporal['DATA_CMPT'] = df_temporal['DATA_CMPT'].dt.to_timestamp()
+        df_temporal = consultar_painel(df, cubo, 'mensal')[['MES', 'Total']].rename(columns={'MES': 'DATA_CMPT'})
 
         fig_temporal = px.bar(
             df_temporal,
@@ -833,6 +2245,9 @@ def painel_geral(df):
     
     st.markdown("---")
     
+    # Agregado por município de residência: treemap, gastos e tabela resumo
+    por_municipio = consultar_painel(df, cubo, 'municipio_residencia')
+
     # Visualizações lado a lado
     col1, col2 = st.columns(2)
     
@@ -841,8 +2256,7 @@ def painel_geral(df):
         st.markdown("*Treemap mostrando a distribuição de internações por município de residência*")
 
         if 'NOME_MUNIC_RES' in df.columns:
-            df_municipio = df.groupby('NOME_MUNIC_RES').size().reset_index(name='Total')
-            df_municipio = df_municipio.nlargest(15, 'Total')
+            df_municipio = maiores(por_municipio, 'Total', 15)[['NOME_MUNIC_RES', 'Total']]
 
             fig_mapa = px.treemap(
                 df_municipio,
@@ -863,8 +2277,7 @@ def painel_geral(df):
         st.markdown("*Gráfico de colunas mostrando os municípios com maiores gastos em internações*")
 
         if 'NOME_MUNIC_RES' in df.columns and 'VAL_TOT' in df.columns:
-            df_gastos = df.groupby('NOME_MUNIC_RES')['VAL_TOT'].sum().reset_index()
-            df_gastos = df_gastos.nlargest(15, 'VAL_TOT')
+            df_gastos = maiores(por_municipio, 'VAL_TOT', 15)[['NOME_MUNIC_RES', 'VAL_TOT']]
             df_gastos['VAL_TOT_MI'] = df_gastos['VAL_TOT'] / 1_000_000
 
             fig_gastos = px.bar(
@@ -890,30 +2303,30 @@ def painel_geral(df):
 
     if 'NOME_MUNIC_RES' in df.columns:
         # Agregar dados por município
-        resumo = df.groupby('NOME_MUNIC_RES').agg({
-            'NOME_MUNIC_RES': 'count',
-            'DIAS_PERM': 'mean' if 'DIAS_PERM' in df.columns else 'count',
-            'MORTE': 'sum' if 'MORTE' in df.columns else 'count',
-            'VAL_TOT': ['sum', 'mean'] if 'VAL_TOT' in df.columns else 'count'
-        }).reset_index()
-        
-        # Renomear colunas
-        resumo.columns = ['Município', 'Total_Internações', 'Média_Permanência', 'Total_Óbitos', 'Custo_Total', 'Custo_Médio']
+        resumo = pd.DataFrame({
+            'Município': por_municipio['NOME_MUNIC_RES'],
+            'Total_Internações': por_municipio['Total'],
+            'Média_Permanência': media(por_municipio, 'DIAS_PERM'),
+            'Total_Óbitos': por_municipio['MORTE'],
+            'Custo_Total': por_municipio['VAL_TOT'],
+            'Custo_Médio': media(por_municipio, 'VAL_TOT'),
+        })
         
         # Calcular taxa de mortalidade
         if 'Total_Óbitos' in resumo.columns:
             resumo['Mortalidade_%'] = (resumo['Total_Óbitos'] / resumo['Total_Internações'] * 100).round(1)
         
-        # Formatar valores
+        # Formatar valores (moedas só nas linhas da página exibida)
         resumo_display = resumo.copy()
         if 'Média_Permanência' in resumo_display.columns:
             resumo_display['Média_Permanência'] = resumo_display['Média_Permanência'].round(1)
-        if 'Custo_Total' in resumo_display.columns:
-            resumo_display['Custo_Total'] = resumo_display['Custo_Total'].apply(lambda x: formatar_moeda(x))
-        if 'Custo_Médio' in resumo_display.columns:
-            resumo_display['Custo_Médio'] = resumo_display['Custo_Médio'].apply(lambda x: formatar_moeda(x))
-        
-        st.dataframe(resumo_display, height=400, use_container_width=True)
+
+        tabela_paginada(
+            resumo_display,
+            'resumo_municipios',
+            formatos={'Custo_Total': formatar_moeda, 'Custo_Médio': formatar_moeda},
+            altura=400
+        )
         
         # Botão de download
         csv = resumo.to_csv(index=False).encode('utf-8')
@@ -928,57 +2341,47 @@ def painel_geral(df):
 # PAINEL 2: EPIDEMIOLÓGICO
 # ============================================================================
 
-def painel_epidemiologico(df):
-    """Painel de análise epidemiológica"""
+@usa_colunas('NOME_CID_PRINC', 'CID_PRINC', 'CID_SECUN', 'MORTE', 'FAIXA_ETARIA', 'SEXO',
+             'NOME_MUNIC_RES', 'RACA_COR')
+def painel_epidemiologico(df, cubo=None):
+    """Painel de análise epidemiológica (agregados via consultar: cubo quando disponível)"""
     
     st.title("🔬 Painel Epidemiológico")
     st.markdown("---")
     
     # Determinar coluna de CID
-    col_cid = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in df.columns else 'CID_PRINC' if 'CID_PRINC' in df.columns else None
+    col_cid, = dimensoes_painel('cid', df.columns) or (None,)
+
+    # Agregado por CID: cards, top 10 e mortalidade por CID
+    por_cid = consultar_painel(df, cubo, 'cid')
+    geral = consultar_painel(df, cubo, 'geral').iloc[0]
+    total_internacoes = geral['Total']
     
     # Cards epidemiológicos
     
     
 
     if 'NOME_CID_PRINC' in df.columns:
-        cid_prevalente = df['NOME_CID_PRINC'].mode()[0] if len(df['NOME_CID_PRINC'].mode()) > 0 else 'N/A'
+        cid_prevalente = mais_frequente(por_cid, col_cid)
         st.metric(
             label="🦠 Doença Mais Prevalente",
-            value=str(cid_prevalente)
+            value=str(cid_prevalente if cid_prevalente is not None else 'N/A')
         )
     elif col_cid and col_cid in df.columns:
-        cid_prevalente = df[col_cid].mode()[0] if len(df[col_cid].mode()) > 0 else 'N/A'
+        cid_prevalente = mais_frequente(por_cid, col_cid)
         st.metric(
             label="🦠 CID Mais Prevalente",
-            value=str(cid_prevalente)
+            value=str(cid_prevalente if cid_prevalente is not None else 'N/A')
         )
 
     
     # Usar CID principal dos casos que resultaram em morte
-    if 'NOME_CID_PRINC' in df.columns and 'MORTE' in df.columns:
-        df_obitos = df[df['MORTE'] == 1]
-        if len(df_obitos) > 0:
-            cid_morte = df_obitos['NOME_CID_PRINC'].mode()
-            cid_morte_valor = cid_morte[0] if len(cid_morte) > 0 else 'N/A'
-            st.metric(
-                label="☠️ CID Mais Freq. em Óbitos",
-                value=str(cid_morte_valor),
-                help="Diagnóstico principal mais frequente nas internações que resultaram em óbito"
-            )
-        else:
+    if col_cid and 'MORTE' in df.columns:
+        if geral['MORTE'] > 0:
+            cid_morte_valor = mais_frequente(por_cid, col_cid, 'MORTE')
             st.metric(
                 label="☠️ CID Mais Freq. em Óbitos",
-                value="Sem óbitos"
-            )
-    elif col_cid and col_cid in df.columns and 'MORTE' in df.columns:
-        df_obitos = df[df['MORTE'] == 1]
-        if len(df_obitos) > 0:
-            cid_morte = df_obitos[col_cid].mode()
-            cid_morte_valor = cid_morte[0] if len(cid_morte) > 0 else 'N/A'
-            st.metric(
-                label="☠️ CID Mais Freq. em Óbitos",
-                value=str(cid_morte_valor),
+                value=str(cid_morte_valor if cid_morte_valor is not None else 'N/A'),
                 help="Diagnóstico principal mais frequente nas internações que resultaram em óbito"
             )
         else:
@@ -995,7 +2398,9 @@ def painel_epidemiologico(df):
     
     
     if 'FAIXA_ETARIA' in df.columns:
-        faixa_modal = df['FAIXA_ETARIA'].mode()[0] if len(df['FAIXA_ETARIA'].mode()) > 0 else 'N/A'
+        por_faixa = consultar_painel(df, cubo, 'faixa_etaria')
+        faixa_modal = mais_frequente(por_faixa, 'FAIXA_ETARIA')
+        faixa_modal = faixa_modal if faixa_modal is not None else 'N/A'
         st.metric(
             label="👤 Faixa Etária Modal",
             value=str(faixa_modal)
@@ -1022,9 +2427,9 @@ def painel_epidemiologico(df):
     st.markdown("*Top 10 doenças com maior número de internações*")
 
     if 'NOME_CID_PRINC' in df.columns:
-        top_cids = df['NOME_CID_PRINC'].value_counts().head(10).reset_index()
+        top_cids = ordenar_por_total(por_cid, k=10)[[col_cid, 'Total']]
         top_cids.columns = ['Doença', 'Total']
-        top_cids['Percentual'] = (top_cids['Total'] / len(df) * 100).round(1)
+        top_cids['Percentual'] = (top_cids['Total'] / total_internacoes * 100).round(1)
 
         fig_cids = px.bar(
             top_cids,
@@ -1041,9 +2446,9 @@ def painel_epidemiologico(df):
         fig_cids.update_layout(height=400, showlegend=False)
         st.plotly_chart(fig_cids, use_container_width=True)
     elif col_cid and col_cid in df.columns:
-        top_cids = df[col_cid].value_counts().head(10).reset_index()
+        top_cids = ordenar_por_total(por_cid, k=10)[[col_cid, 'Total']]
         top_cids.columns = ['CID', 'Total']
-        top_cids['Percentual'] = (top_cids['Total'] / len(df) * 100).round(1)
+        top_cids['Percentual'] = (top_cids['Total'] / total_internacoes * 100).round(1)
 
         fig_cids = px.bar(
             top_cids,
@@ -1071,7 +2476,7 @@ def painel_epidemiologico(df):
         st.subheader("👥 Distribuição Etária por Sexo")
         
         if 'FAIXA_ETARIA' in df.columns and 'SEXO' in df.columns:
-            df_piramide = df.groupby(['FAIXA_ETARIA', 'SEXO']).size().reset_index(name='Total')
+            df_piramide = consultar_painel(df, cubo, 'faixa_etaria_sexo')[['FAIXA_ETARIA', 'SEXO', 'Total']]
             df_piramide_masc = df_piramide[df_piramide['SEXO'] == 'Masculino'].copy()
             df_piramide_masc['Total'] = -df_piramide_masc['Total']
             df_piramide_fem = df_piramide[df_piramide['SEXO'] == 'Feminino']
@@ -1110,7 +2515,7 @@ def painel_epidemiologico(df):
         st.subheader("⚧ Internações por Sexo")
         
         if 'SEXO' in df.columns:
-            df_sexo = df['SEXO'].value_counts().reset_index()
+            df_sexo = ordenar_por_total(consultar_painel(df, cubo, 'sexo'))[['SEXO', 'Total']]
             df_sexo.columns = ['Sexo', 'Total']
             
             colors_sexo = {'Masculino': '#1f77b4', 'Feminino': '#ff69b4', 'Ignorado': '#95a5a6'}
@@ -1139,13 +2544,11 @@ def painel_epidemiologico(df):
 
         with tab1:
             if 'NOME_CID_PRINC' in df.columns:
-                df_mort_cid = df.groupby('NOME_CID_PRINC').agg({
-                    'MORTE': ['sum', 'count']
-                }).reset_index()
+                df_mort_cid = por_cid[[col_cid, 'MORTE', 'Total']].copy()
                 df_mort_cid.columns = ['Doença', 'Óbitos', 'Total']
                 df_mort_cid['Taxa_Mortalidade'] = (df_mort_cid['Óbitos'] / df_mort_cid['Total'] * 100)
                 df_mort_cid = df_mort_cid[df_mort_cid['Total'] >= 10]  # Filtrar doenças com poucos casos
-                df_mort_cid = df_mort_cid.nlargest(10, 'Taxa_Mortalidade')
+                df_mort_cid = maiores(df_mort_cid, 'Taxa_Mortalidade', 10)
 
                 fig_mort_cid = px.bar(
                     df_mort_cid,
@@ -1160,13 +2563,11 @@ def painel_epidemiologico(df):
                 fig_mort_cid.update_layout(height=400, showlegend=False)
                 st.plotly_chart(fig_mort_cid, use_container_width=True)
             elif col_cid and col_cid in df.columns:
-                df_mort_cid = df.groupby(col_cid).agg({
-                    'MORTE': ['sum', 'count']
-                }).reset_index()
+                df_mort_cid = por_cid[[col_cid, 'MORTE', 'Total']].copy()
                 df_mort_cid.columns = ['CID', 'Óbitos', 'Total']
                 df_mort_cid['Taxa_Mortalidade'] = (df_mort_cid['Óbitos'] / df_mort_cid['Total'] * 100)
                 df_mort_cid = df_mort_cid[df_mort_cid['Total'] >= 10]  # Filtrar CIDs com poucos casos
-                df_mort_cid = df_mort_cid.nlargest(10, 'Taxa_Mortalidade')
+                df_mort_cid = maiores(df_mort_cid, 'Taxa_Mortalidade', 10)
                 
                 fig_mort_cid = px.bar(
                     df_mort_cid,
@@ -1183,9 +2584,7 @@ def painel_epidemiologico(df):
         
         with tab2:
             if 'FAIXA_ETARIA' in df.columns:
-                df_mort_idade = df.groupby('FAIXA_ETARIA').agg({
-                    'MORTE': ['sum', 'count']
-                }).reset_index()
+                df_mort_idade = por_faixa[['FAIXA_ETARIA', 'MORTE', 'Total']].copy()
                 df_mort_idade.columns = ['Faixa_Etária', 'Óbitos', 'Total']
                 df_mort_idade['Taxa_Mortalidade'] = (df_mort_idade['Óbitos'] / df_mort_idade['Total'] * 100)
                 
@@ -1203,20 +2602,15 @@ def painel_epidemiologico(df):
         
         with tab3:
             if 'NOME_MUNIC_RES' in df.columns:
-                df_mort_mun = df.groupby('NOME_MUNIC_RES').agg({
-                    'MORTE': ['sum', 'count']
-                }).reset_index()
+                df_mort_mun = consultar_painel(df, cubo, 'municipio_residencia')[['NOME_MUNIC_RES', 'MORTE', 'Total']]
                 df_mort_mun.columns = ['Município', 'Óbitos', 'Total_Internações']
                 df_mort_mun['Taxa_Mortalidade_%'] = (df_mort_mun['Óbitos'] / df_mort_mun['Total_Internações'] * 100).round(1)
-                df_mort_mun = df_mort_mun.sort_values('Taxa_Mortalidade_%', ascending=False)
 
-                st.dataframe(df_mort_mun, height=400, use_container_width=True)
+                tabela_paginada(df_mort_mun, 'mortalidade_municipios', ordenar_por='Taxa_Mortalidade_%', altura=400)
 
         with tab4:
             if 'RACA_COR' in df.columns:
-                df_mort_raca = df.groupby('RACA_COR').agg({
-                    'MORTE': ['sum', 'count']
-                }).reset_index()
+                df_mort_raca = consultar_painel(df, cubo, 'raca_cor')[['RACA_COR', 'MORTE', 'Total']]
                 df_mort_raca.columns = ['Raça_Cor', 'Óbitos', 'Total']
                 df_mort_raca['Taxa_Mortalidade'] = (df_mort_raca['Óbitos'] / df_mort_raca['Total'] * 100)
 
@@ -1238,16 +2632,24 @@ def painel_epidemiologico(df):
 # PAINEL 3: REGULAÇÃO E TERRITÓRIO
 # ============================================================================
 
-def painel_regulacao(df):
-    """Painel de análise de fluxo e regulação"""
+@usa_colunas('MUNIC_RES', 'MUNIC_MOV', 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV', 'CNES', 'NOME_FANTASIA')
+def painel_regulacao(df, cubo=None):
+    """Painel de análise de fluxo e regulação (agregados via consultar: cubo quando disponível)"""
     
     st.title("🗺️ Painel de Regulação e Território")
     st.markdown("---")
+
+    # Fluxos residência → atendimento: todos os indicadores saem das somas por linha
+    # e por coluna das matrizes de fluxo (município × município, nomes e município × CNES),
+    # montadas uma vez por combinação de filtros a partir da tabela agregada de fluxos
+    fluxos = consultar_painel(df, cubo, 'fluxos')
+    if 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
+        municipios = matriz_fluxos(df, cubo, 'MUNIC_RES', 'MUNIC_MOV')
     
     # Cards de regulação - Um embaixo do outro
     if 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        evasao = (df['MUNIC_RES'] != df['MUNIC_MOV']).sum()
-        perc_evasao = (evasao / len(df) * 100)
+        evasao = municipios.total(externas=True)
+        perc_evasao = (evasao / municipios.total() * 100)
         st.metric(
             label="🚑 Evasão Total",
             value=formatar_percentual(perc_evasao),
@@ -1255,9 +2657,8 @@ def painel_regulacao(df):
         )
 
     if 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        evasao_por_mun = df[df['MUNIC_RES'] != df['MUNIC_MOV']].groupby('MUNIC_RES').size()
-        total_por_mun = df.groupby('MUNIC_RES').size()
-        perc_evasao_mun = (evasao_por_mun / total_por_mun * 100)
+        demanda = municipios.soma_linhas()
+        perc_evasao_mun = ((demanda - municipios.diagonal()) / demanda * 100)
         municipios_alta_evasao = (perc_evasao_mun > 50).sum()
         st.metric(
             label="⚠️ Municípios >50% Evasão",
@@ -1266,9 +2667,10 @@ def painel_regulacao(df):
         )
 
     if 'NOME_MUNIC_MOV' in df.columns and 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        df_externos = df[df['MUNIC_RES'] != df['MUNIC_MOV']]
-        if len(df_externos) > 0:
-            principal_receptor = df_externos['NOME_MUNIC_MOV'].mode()[0] if len(df_externos) > 0 else 'N/A'
+        if evasao > 0:
+            recebidos = matriz_fluxos(df, cubo, 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV').soma_colunas(externas=True)
+            principal_receptor = mais_frequente(recebidos.rename('Total').rename_axis('NOME_MUNIC_MOV').reset_index(),
+                                                'NOME_MUNIC_MOV')
             st.metric(
                 label="🏥 Principal Município Receptor",
                 value=str(principal_receptor),
@@ -1282,8 +2684,9 @@ def painel_regulacao(df):
     st.markdown("*Volume absoluto de pacientes que buscam atendimento fora do município*")
 
     if 'NOME_MUNIC_RES' in df.columns and 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        df_evasao = df[df['MUNIC_RES'] != df['MUNIC_MOV']].groupby('NOME_MUNIC_RES').size().reset_index(name='Evadidos')
-        df_evasao = df_evasao.nlargest(15, 'Evadidos')
+        evadidos = matriz_fluxos(df, cubo, 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV').soma_linhas(externas=True)
+        df_evasao = ordenar_por_total(evadidos.rename_axis('NOME_MUNIC_RES').reset_index(name='Evadidos'),
+                                      'Evadidos', k=15)
 
         fig_evasao = px.bar(
             df_evasao,
@@ -1306,8 +2709,9 @@ def painel_regulacao(df):
     st.markdown("*Volume absoluto de pacientes vindos de outros municípios*")
 
     if 'NOME_MUNIC_MOV' in df.columns and 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        df_atrator = df[df['MUNIC_RES'] != df['MUNIC_MOV']].groupby('NOME_MUNIC_MOV').size().reset_index(name='Pacientes_Externos')
-        df_atrator = df_atrator.nlargest(15, 'Pacientes_Externos')
+        recebidos = matriz_fluxos(df, cubo, 'NOME_MUNIC_RES', 'NOME_MUNIC_MOV').soma_colunas(externas=True)
+        df_atrator = ordenar_por_total(recebidos.rename_axis('NOME_MUNIC_MOV').reset_index(name='Pacientes_Externos'),
+                                       'Pacientes_Externos', k=15)
 
         fig_atrator = px.bar(
             df_atrator,
@@ -1330,8 +2734,8 @@ def painel_regulacao(df):
     st.subheader("📊 Análise de Oferta e Demanda por Município")
     
     if 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        df_demanda = df.groupby('MUNIC_RES').size().reset_index(name='Demanda')
-        df_oferta = df.groupby('MUNIC_MOV').size().reset_index(name='Oferta')
+        df_demanda = municipios.soma_linhas().rename_axis('MUNIC_RES').reset_index(name='Demanda')
+        df_oferta = municipios.soma_colunas().rename_axis('MUNIC_MOV').reset_index(name='Oferta')
         
         df_bubble = df_demanda.merge(df_oferta, left_on='MUNIC_RES', right_on='MUNIC_MOV', how='outer').fillna(0)
         df_bubble['Município'] = df_bubble['MUNIC_RES'].fillna(df_bubble['MUNIC_MOV'])
@@ -1367,34 +2771,78 @@ def painel_regulacao(df):
     
     # Tabela de estabelecimentos receptores
     st.subheader("🏥 Estabelecimentos que Mais Recebem Pacientes Externos")
-    st.markdown("*Top 20 estabelecimentos com maior percentual de pacientes externos*")
+    st.markdown("*Todos os estabelecimentos, do maior para o menor percentual de pacientes externos*")
 
     if 'CNES' in df.columns and 'MUNIC_RES' in df.columns and 'MUNIC_MOV' in df.columns:
-        df_externos = df[df['MUNIC_RES'] != df['MUNIC_MOV']]
-
-        df_estab = df.groupby('CNES').size().reset_index(name='Total_Internações')
-        df_estab_ext = df_externos.groupby('CNES').size().reset_index(name='Pacientes_Externos')
-
-        df_estab = df_estab.merge(df_estab_ext, on='CNES', how='left').fillna(0)
+        estabelecimentos = matriz_fluxos(df, cubo, 'MUNIC_RES', 'CNES')
+        df_estab = pd.DataFrame({
+            'CNES': estabelecimentos.colunas,
+            'Total_Internações': estabelecimentos.soma_colunas().to_numpy(),
+            'Pacientes_Externos': estabelecimentos.soma_colunas(externas=True).to_numpy(),
+        })
         df_estab['Perc_Externos'] = (df_estab['Pacientes_Externos'] / df_estab['Total_Internações'] * 100).round(1)
 
         if 'NOME_FANTASIA' in df.columns and 'NOME_MUNIC_MOV' in df.columns:
-            df_nome = df[['CNES', 'NOME_FANTASIA', 'NOME_MUNIC_MOV']].drop_duplicates('CNES')
+            df_nome = fluxos[['CNES', 'NOME_FANTASIA', 'NOME_MUNIC_MOV']].drop_duplicates('CNES')
             df_estab = df_estab.merge(df_nome, on='CNES', how='left')
         elif 'NOME_FANTASIA' in df.columns:
-            df_nome = df[['CNES', 'NOME_FANTASIA', 'MUNIC_MOV']].drop_duplicates('CNES')
+            df_nome = fluxos[['CNES', 'NOME_FANTASIA', 'MUNIC_MOV']].drop_duplicates('CNES')
             df_estab = df_estab.merge(df_nome, on='CNES', how='left')
 
-        df_estab = df_estab.sort_values('Perc_Externos', ascending=False).head(20)
-
-        st.dataframe(df_estab, height=400, use_container_width=True)
+        tabela_paginada(df_estab, 'estabelecimentos_receptores', ordenar_por='Perc_Externos', altura=400)
 
 # ============================================================================
 # PAINEL 4: POR ESTABELECIMENTO
 # ============================================================================
 
-def painel_estabelecimento(df):
-    """Painel de análise por estabelecimento (CNES)"""
+# Critério do ranking → coluna de perfis_estabelecimentos()
+CRITERIOS_RANKING = {
+    'Volume de Internações': 'Volume',
+    'Custo Total': 'Custo_Total',
+    'Média de Permanência': 'Media_Permanencia',
+    'Taxa de Mortalidade': 'Taxa_Mortalidade',
+}
+
+def perfis_estabelecimentos(por_cnes, nomes=None):
+    """
+    Perfil de todos os estabelecimentos de uma vez, indexado por CNES
+
+    Volume, custo total e médio, permanência média, óbitos e taxa de
+    mortalidade, além do rótulo dos gráficos (nome, ou o próprio CNES).
+    Trocar o estabelecimento selecionado vira uma consulta ao índice.
+
+    Args:
+        por_cnes: Resultado de consultar() por CNES
+        nomes: Dicionário CNES → nome do estabelecimento (tabelas de dimensão)
+    """
+    perfis = pd.DataFrame({'Volume': por_cnes['Total'].to_numpy()}, index=pd.Index(por_cnes['CNES'], name='CNES'))
+    if 'VAL_TOT' in por_cnes.columns:
+        perfis['Custo_Total'] = por_cnes['VAL_TOT'].to_numpy()
+        perfis['Custo_Medio'] = media(por_cnes, 'VAL_TOT').to_numpy()
+    if 'DIAS_PERM' in por_cnes.columns:
+        perfis['Media_Permanencia'] = media(por_cnes, 'DIAS_PERM').to_numpy()
+    if 'MORTE' in por_cnes.columns:
+        perfis['Total_Obitos'] = por_cnes['MORTE'].to_numpy()
+        perfis['Taxa_Mortalidade'] = perfis['Total_Obitos'] / perfis['Volume'] * 100
+
+    rotulos = perfis.index.astype(str)
+    if nomes is not None:
+        perfis['NOME_FANTASIA'] = perfis.index.map(nomes)
+        rotulos = perfis['NOME_FANTASIA'].astype(object).fillna(pd.Series(rotulos, index=perfis.index))
+    perfis['Label'] = rotulos
+    return perfis
+
+@usa_colunas('CNES', 'NOME_FANTASIA', 'MUNIC_MOV', 'DIAS_PERM', 'MORTE', 'VAL_TOT')
+def painel_estabelecimento(df, cubo=None, dimensoes=None):
+    """
+    Painel de análise por estabelecimento (CNES); perfil e ranking saem de uma única agregação por CNES
+
+    Args:
+        dimensoes: Tabelas de dimensão da base (carregar_dimensoes), para os nomes
+            dos estabelecimentos; se None, são montadas a partir de df
+    """
+    if dimensoes is None:
+        dimensoes = construir_dimensoes(df)
     
     st.title("🏥 Painel por Estabelecimento (CNES)")
     st.markdown("---")
@@ -1403,29 +2851,31 @@ def painel_estabelecimento(df):
         st.warning("Coluna CNES não disponível nos dados")
         return
     
+    # Perfis de todos os estabelecimentos presentes na base filtrada (em ordem de código),
+    # calculados uma vez por combinação de filtros: trocar o estabelecimento ou o
+    # critério do ranking não refaz nenhuma agregação
+    nomes = dimensoes['CNES'].get('nomes') if 'NOME_FANTASIA' in df.columns else None
+    perfis = memorizar(df, ('perfis_estabelecimentos',),
+                       lambda: perfis_estabelecimentos(consultar_painel(df, cubo, 'estabelecimento'), nomes))
+
     # Seletor de estabelecimento
     st.subheader("🔍 Selecione um Estabelecimento para Análise Detalhada")
     
-    if 'NOME_FANTASIA' in df.columns:
-        df_cnes = df[['CNES', 'NOME_FANTASIA', 'MUNIC_MOV']].drop_duplicates('CNES').dropna().copy()
-        # Converter para string para evitar erro com categorical
-        df_cnes['NOME_FANTASIA'] = df_cnes['NOME_FANTASIA'].astype(str)
-        df_cnes['MUNIC_MOV'] = df_cnes['MUNIC_MOV'].astype(str)
-        df_cnes['display'] = df_cnes['CNES'].astype(str) + ' - ' + df_cnes['NOME_FANTASIA'] + ' (' + df_cnes['MUNIC_MOV'] + ')'
-        
+    if 'NOME_FANTASIA' in df.columns and 'MUNIC_MOV' in df.columns:
+        rotulos_cnes = dimensoes['CNES']['rotulos_municipio']
         cnes_selecionado = st.selectbox(
             "Estabelecimento",
-            options=df_cnes['CNES'].tolist(),
-            format_func=lambda x: df_cnes[df_cnes['CNES'] == x]['display'].iloc[0] if len(df_cnes[df_cnes['CNES'] == x]) > 0 else str(x)
+            options=[cnes for cnes in perfis.index.tolist() if cnes in rotulos_cnes],
+            format_func=lambda x: rotulos_cnes.get(x, str(x))
         )
     else:
         cnes_selecionado = st.selectbox(
             "CNES",
-            options=sorted(df['CNES'].dropna().unique())
+            options=perfis.index.tolist()
         )
     
     if cnes_selecionado:
-        df_cnes_sel = df[df['CNES'] == cnes_selecionado]
+        perfil = perfis.loc[cnes_selecionado]
         
         st.markdown("---")
         
@@ -1433,7 +2883,7 @@ def painel_estabelecimento(df):
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            total_int = len(df_cnes_sel)
+            total_int = perfil['Volume']
             st.metric(
                 label="📊 Total de Internações",
                 value=formatar_numero(total_int)
@@ -1441,7 +2891,7 @@ def painel_estabelecimento(df):
         
         with col2:
             if 'DIAS_PERM' in df.columns:
-                media_perm = df_cnes_sel['DIAS_PERM'].mean()
+                media_perm = perfil['Media_Permanencia']
                 st.metric(
                     label="⏱️ Média de Permanência",
                     value=f"{media_perm:.1f} dias"
@@ -1449,7 +2899,7 @@ def painel_estabelecimento(df):
         
         with col3:
             if 'MORTE' in df.columns:
-                taxa_mort = (df_cnes_sel['MORTE'].sum() / len(df_cnes_sel) * 100)
+                taxa_mort = perfil['Taxa_Mortalidade']
                 st.metric(
                     label="💔 Taxa de Mortalidade",
                     value=formatar_percentual(taxa_mort)
@@ -1457,7 +2907,7 @@ def painel_estabelecimento(df):
         
         with col4:
             if 'VAL_TOT' in df.columns:
-                custo_medio = df_cnes_sel['VAL_TOT'].mean()
+                custo_medio = perfil['Custo_Medio']
                 st.metric(
                     label="💰 Custo Médio",
                     value=formatar_moeda(custo_medio)
@@ -1470,51 +2920,13 @@ def painel_estabelecimento(df):
     
     criterio = st.selectbox(
         "Critério de Ranking",
-        options=['Volume de Internações', 'Custo Total', 'Média de Permanência', 'Taxa de Mortalidade']
+        options=list(CRITERIOS_RANKING)
     )
     
-    agg_dict = {}
-    if 'VAL_TOT' in df.columns:
-        agg_dict['VAL_TOT'] = 'sum'
-    if 'DIAS_PERM' in df.columns:
-        agg_dict['DIAS_PERM'] = 'mean'
-    if 'MORTE' in df.columns:
-        agg_dict['MORTE'] = 'sum'
-
-    df_ranking = df.groupby('CNES', as_index=False).agg(agg_dict)
-    df_ranking.insert(1, 'Volume', df.groupby('CNES').size().values)
-
-    # Renomear colunas
-    rename_map = {'CNES': 'CNES'}
-    if 'VAL_TOT' in agg_dict:
-        rename_map['VAL_TOT'] = 'Custo_Total'
-    if 'DIAS_PERM' in agg_dict:
-        rename_map['DIAS_PERM'] = 'Media_Permanencia'
-    if 'MORTE' in agg_dict:
-        rename_map['MORTE'] = 'Total_Obitos'
-    df_ranking = df_ranking.rename(columns=rename_map)
-    df_ranking['Taxa_Mortalidade'] = (df_ranking['Total_Obitos'] / df_ranking['Volume'] * 100)
-    
-    if 'NOME_FANTASIA' in df.columns:
-        df_nome = df[['CNES', 'NOME_FANTASIA']].drop_duplicates('CNES')
-        df_ranking = df_ranking.merge(df_nome, on='CNES', how='left')
-        df_ranking['Label'] = df_ranking['NOME_FANTASIA'].fillna(df_ranking['CNES'].astype(str))
-    else:
-        df_ranking['Label'] = df_ranking['CNES'].astype(str)
-    
-    # Ordenar conforme critério
-    if criterio == 'Volume de Internações':
-        df_ranking = df_ranking.nlargest(20, 'Volume')
-        coluna_plot = 'Volume'
-    elif criterio == 'Custo Total':
-        df_ranking = df_ranking.nlargest(20, 'Custo_Total')
-        coluna_plot = 'Custo_Total'
-    elif criterio == 'Média de Permanência':
-        df_ranking = df_ranking.nlargest(20, 'Media_Permanencia')
-        coluna_plot = 'Media_Permanencia'
-    else:
-        df_ranking = df_ranking.nlargest(20, 'Taxa_Mortalidade')
-        coluna_plot = 'Taxa_Mortalidade'
+    # Top 20 conforme critério (também guardado por combinação de filtros)
+    coluna_plot = CRITERIOS_RANKING[criterio]
+    df_ranking = memorizar(df, ('ranking_estabelecimentos', coluna_plot),
+                           lambda: maiores(perfis, coluna_plot, 20).reset_index())
     
     fig_ranking = px.bar(
         df_ranking,
@@ -1533,42 +2945,41 @@ def painel_estabelecimento(df):
 # PAINEL 5: PROCEDIMENTOS
 # ============================================================================
 
-def painel_procedimentos(df):
-    """Painel de análise de procedimentos"""
+@usa_colunas('NOME_PROC_REA', 'PROC_REA', 'PROCEDIMENTO', 'VAL_TOT', 'NOME_CID_PRINC', 'CID_PRINC')
+def painel_procedimentos(df, cubo=None):
+    """Painel de análise de procedimentos (agregados via consultar: cubo quando disponível)"""
     
     st.title("⚕️ Painel de Procedimentos")
     st.markdown("---")
     
-    # Determinar colunas de procedimento
-    col_proc_nome = 'NOME_PROC_REA' if 'NOME_PROC_REA' in df.columns else None
-    col_proc_real = 'PROC_REA' if 'PROC_REA' in df.columns else 'PROCEDIMENTO' if 'PROCEDIMENTO' in df.columns else None
-    col_proc_soli = 'PROC_SOLI' if 'PROC_SOLI' in df.columns else None
+    # Determinar coluna de procedimento (nome, senão código)
+    col_to_use, = dimensoes_painel('procedimento', df.columns) or (None,)
 
-    if not col_proc_real and not col_proc_nome:
+    if not col_to_use:
         st.warning("Coluna de procedimento não encontrada nos dados")
         return
 
 
-    col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-    total_proc_distintos = df[col_to_use].nunique()
+    # Agregado por procedimento: cards, treemaps e custos
+    por_proc = consultar_painel(df, cubo, 'procedimento')
+
+    total_proc_distintos = len(por_proc)
     st.metric(
         label="🔢 Procedimentos Distintos",
         value=formatar_numero(total_proc_distintos)
     )
 
     
-    col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-    proc_mais_comum = df[col_to_use].mode()[0] if len(df[col_to_use].mode()) > 0 else 'N/A'
+    proc_mais_comum = mais_frequente(por_proc, col_to_use)
     st.metric(
         label="⚕️ Procedimento Mais Realizado",
-        value=str(proc_mais_comum)
+        value=str(proc_mais_comum if proc_mais_comum is not None else 'N/A')
     )
 
     
     if 'VAL_TOT' in df.columns:
-        col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-        df_proc_valor = df.groupby(col_to_use)['VAL_TOT'].mean()
-        proc_mais_caro = df_proc_valor.idxmax() if len(df_proc_valor) > 0 else 'N/A'
+        proc_mais_caro = mais_frequente(por_proc.assign(VAL_MEDIO=media(por_proc, 'VAL_TOT')), col_to_use, 'VAL_MEDIO')
+        proc_mais_caro = proc_mais_caro if proc_mais_caro is not None else 'N/A'
         st.metric(
             label="💎 Procedimento Mais Caro",
             value=str(proc_mais_caro)
@@ -1576,7 +2987,7 @@ def painel_procedimentos(df):
     
     
     if 'VAL_TOT' in df.columns:
-        gasto_total = df['VAL_TOT'].sum()
+        gasto_total = consultar_painel(df, cubo, 'geral')['VAL_TOT'].iloc[0]
         st.metric(
             label="💰 Gasto Total",
             value=formatar_moeda(gasto_total)
@@ -1588,8 +2999,7 @@ def painel_procedimentos(df):
     st.subheader("📊 Procedimentos Mais Frequentes")
     st.markdown("*Treemap mostrando os 15 procedimentos mais realizados*")
 
-    col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-    top_proc = df[col_to_use].value_counts().head(15).reset_index()
+    top_proc = ordenar_por_total(por_proc, k=15)[[col_to_use, 'Total']]
     top_proc.columns = ['Procedimento', 'Quantidade']
 
     fig_proc = px.treemap(
@@ -1614,10 +3024,9 @@ def painel_procedimentos(df):
             st.subheader("💸 Top 15 Procedimentos por Gasto Total")
             st.markdown("*Treemap mostrando os procedimentos com maior gasto total*")
 
-            col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-            df_gasto = df.groupby(col_to_use)['VAL_TOT'].sum().reset_index()
+            df_gasto = por_proc[[col_to_use, 'VAL_TOT']].copy()
             df_gasto.columns = ['Procedimento', 'Gasto_Total']
-            df_gasto = df_gasto.nlargest(15, 'Gasto_Total')
+            df_gasto = maiores(df_gasto, 'Gasto_Total', 15)
             df_gasto['Gasto_MI'] = df_gasto['Gasto_Total'] / 1_000_000
 
             fig_gasto = px.treemap(
@@ -1636,13 +3045,13 @@ def painel_procedimentos(df):
             st.subheader("💎 Procedimentos Mais Caros (Custo Médio)")
             st.markdown("*Treemap dos procedimentos com maior custo médio (mín. 50 casos)*")
 
-            col_to_use = col_proc_nome if col_proc_nome else col_proc_real
-            df_custo_medio = df.groupby(col_to_use, as_index=False).agg({
-                'VAL_TOT': ['mean', 'count']
+            df_custo_medio = pd.DataFrame({
+                'Procedimento': por_proc[col_to_use],
+                'Custo_Medio': media(por_proc, 'VAL_TOT'),
+                'Quantidade': por_proc['VAL_TOT_N'],
             })
-            df_custo_medio.columns = ['Procedimento', 'Custo_Medio', 'Quantidade']
             df_custo_medio = df_custo_medio[df_custo_medio['Quantidade'] >= 50]  # Filtrar outliers
-            df_custo_medio = df_custo_medio.nlargest(15, 'Custo_Medio')
+            df_custo_medio = maiores(df_custo_medio, 'Custo_Medio', 15)
 
             fig_custo_medio = px.treemap(
                 df_custo_medio,
@@ -1662,29 +3071,22 @@ def painel_procedimentos(df):
     st.subheader("🔥 Correlação entre Diagnósticos e Procedimentos")
     st.markdown("*Heatmap mostrando a frequência de combinações entre diagnósticos e procedimentos*")
 
-    col_cid_nome = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in df.columns else None
-    col_cid = 'NOME_CID_PRINC' if 'NOME_CID_PRINC' in df.columns else 'CID_PRINC' if 'CID_PRINC' in df.columns else None
-
-    if col_cid_nome and col_proc_nome:
-        # Top 15 CIDs e procedimentos
-        top_cids_heat = df[col_cid_nome].value_counts().head(15).index.tolist()
-        top_proc_heat = df[col_proc_nome].value_counts().head(15).index.tolist()
+    # Nomes de CID e procedimento quando existem os dois, senão os códigos
+    par_heatmap = dimensoes_painel('cid_procedimento', df.columns)
 
-        # Criar matriz de correlação
-        df_heat = df[(df[col_cid_nome].isin(top_cids_heat)) & (df[col_proc_nome].isin(top_proc_heat))]
-        matriz_corr = pd.crosstab(df_heat[col_cid_nome], df_heat[col_proc_nome])
-    elif col_cid and col_proc_real:
+    if par_heatmap:
+        col_heat_cid, col_heat_proc = par_heatmap
         # Top 15 CIDs e procedimentos
-        top_cids_heat = df[col_cid].value_counts().head(15).index.tolist()
-        top_proc_heat = df[col_proc_real].value_counts().head(15).index.tolist()
+        top_cids_heat = ordenar_por_total(consultar_painel(df, cubo, 'cid_do_heatmap'), k=15)[col_heat_cid].tolist()
+        top_proc_heat = ordenar_por_total(consultar_painel(df, cubo, 'procedimento_do_heatmap'),
+                                          k=15)[col_heat_proc].tolist()
 
         # Criar matriz de correlação
-        df_heat = df[(df[col_cid].isin(top_cids_heat)) & (df[col_proc_real].isin(top_proc_heat))]
-        matriz_corr = pd.crosstab(df_heat[col_cid], df_heat[col_proc_real])
-    else:
-        col_cid = None
+        cruzado = consultar_painel(df, cubo, 'cid_procedimento')
+        df_heat = cruzado[(cruzado[col_heat_cid].isin(top_cids_heat)) & (cruzado[col_heat_proc].isin(top_proc_heat))]
+        matriz_corr = df_heat.groupby([col_heat_cid, col_heat_proc], observed=True)['Total'].sum().unstack(fill_value=0)
 
-    if col_cid or col_cid_nome:
+    if par_heatmap:
         
         fig_heatmap = px.imshow(
             matriz_corr,
@@ -1702,8 +3104,14 @@ def painel_procedimentos(df):
 # PAINEL 6: POPULACIONAL E EQUIDADE
 # ============================================================================
 
-def painel_populacional(df):
-    """Painel de análise populacional e equidade"""
+@usa_colunas('RACA_COR', 'DIAS_PERM', 'MORTE', 'VAL_TOT')
+def painel_populacional(df, cubo=None):
+    """
+    Painel de análise populacional e equidade
+
+    Agregados via consultar (cubo quando disponível); o boxplot de permanência
+    precisa da distribuição e usa os microdados.
+    """
     
     st.title("👥 Painel Populacional e Equidade")
     st.markdown("---")
@@ -1712,10 +3120,15 @@ def painel_populacional(df):
         st.warning("Coluna RACA_COR não disponível nos dados")
         return
     
+    por_raca = consultar_painel(df, cubo, 'raca_cor')
+    geral = consultar_painel(df, cubo, 'geral').iloc[0]
+    total_internacoes = geral['Total']
     
-    
-    raca_modal = df['RACA_COR'].mode()[0] if len(df['RACA_COR'].mode()) > 0 else 'N/A'
-    perc_modal = (df['RACA_COR'] == raca_modal).sum() / len(df) * 100
+    raca_modal = mais_frequente(por_raca, 'RACA_COR')
+    if raca_modal is None:
+        raca_modal, perc_modal = 'N/A', 0.0
+    else:
+        perc_modal = por_raca.loc[por_raca['RACA_COR'] == raca_modal, 'Total'].sum() / total_internacoes * 100
     st.metric(
         label="👤 Raça/Cor Modal",
         value=f"{raca_modal} ({perc_modal:.1f}%)"
@@ -1726,7 +3139,7 @@ def painel_populacional(df):
     # Distribuição por raça/cor
     st.subheader("📊 Internações por Raça/Cor")
     
-    df_raca = df['RACA_COR'].value_counts().reset_index()
+    df_raca = ordenar_por_total(por_raca)[['RACA_COR', 'Total']]
     df_raca.columns = ['Raça_Cor', 'Total']
     df_raca['Percentual'] = (df_raca['Total'] / df_raca['Total'].sum() * 100).round(1)
     
@@ -1753,7 +3166,7 @@ def painel_populacional(df):
         
         if 'DIAS_PERM' in df.columns:
             fig_perm = px.box(
-                df,
+                df[['RACA_COR', 'DIAS_PERM']],
                 x='RACA_COR',
                 y='DIAS_PERM',
                 title='',
@@ -1767,14 +3180,12 @@ def painel_populacional(df):
         st.subheader("💔 Taxa de Mortalidade por Raça/Cor")
         
         if 'MORTE' in df.columns:
-            df_mort_raca = df.groupby('RACA_COR').agg({
-                'MORTE': ['sum', 'count']
-            }).reset_index()
+            df_mort_raca = por_raca[['RACA_COR', 'MORTE', 'Total']].copy()
             df_mort_raca.columns = ['Raça_Cor', 'Óbitos', 'Total']
             df_mort_raca['Taxa_Mortalidade'] = (df_mort_raca['Óbitos'] / df_mort_raca['Total'] * 100)
             
             # Média geral
-            taxa_media = (df['MORTE'].sum() / len(df) * 100)
+            taxa_media = (geral['MORTE'] / total_internacoes * 100)
             
             fig_mort_raca = px.bar(
                 df_mort_raca,
@@ -1803,44 +3214,30 @@ def painel_populacional(df):
     # Tabela consolidada
     st.subheader("📋 Indicadores por Raça/Cor - Visão Consolidada")
     
-    agg_dict = {}
+    df_consolidado = pd.DataFrame({'Raça_Cor': por_raca['RACA_COR'], 'Total_Internações': por_raca['Total']})
     if 'DIAS_PERM' in df.columns:
-        agg_dict['DIAS_PERM'] = 'mean'
+        df_consolidado['Média_Permanência'] = media(por_raca, 'DIAS_PERM')
     if 'MORTE' in df.columns:
-        agg_dict['MORTE'] = 'sum'
+        df_consolidado['Total_Óbitos'] = por_raca['MORTE']
     if 'VAL_TOT' in df.columns:
-        agg_dict['VAL_TOT'] = 'mean'
-
-    df_consolidado = df.groupby('RACA_COR', as_index=False).agg(agg_dict)
-    df_consolidado.insert(1, 'Total_Internações', df.groupby('RACA_COR').size().values)
-
-    # Renomear colunas
-    rename_map = {'RACA_COR': 'Raça_Cor'}
-    if 'DIAS_PERM' in agg_dict:
-        rename_map['DIAS_PERM'] = 'Média_Permanência'
-    if 'MORTE' in agg_dict:
-        rename_map['MORTE'] = 'Total_Óbitos'
-    if 'VAL_TOT' in agg_dict:
-        rename_map['VAL_TOT'] = 'Custo_Médio'
-    df_consolidado = df_consolidado.rename(columns=rename_map)
+        df_consolidado['Custo_Médio'] = media(por_raca, 'VAL_TOT')
     df_consolidado['%_Total'] = (df_consolidado['Total_Internações'] / df_consolidado['Total_Internações'].sum() * 100).round(1)
     
     if 'Total_Óbitos' in df_consolidado.columns:
         df_consolidado['Taxa_Mortalidade_%'] = (df_consolidado['Total_Óbitos'] / df_consolidado['Total_Internações'] * 100).round(1)
     
-    # Formatar valores
+    # Formatar valores (moedas só nas linhas da página exibida)
     df_consolidado['Média_Permanência'] = df_consolidado['Média_Permanência'].round(1)
-    if 'Custo_Médio' in df_consolidado.columns:
-        df_consolidado['Custo_Médio'] = df_consolidado['Custo_Médio'].apply(lambda x: formatar_moeda(x))
-    
-    st.dataframe(df_consolidado, use_container_width=True)
+
+    tabela_paginada(df_consolidado, 'consolidado_raca_cor', formatos={'Custo_Médio': formatar_moeda})
 
 # ============================================================================
 # PAINEL 7: TEMPORAL / TENDÊNCIA
 # ============================================================================
 
-def painel_temporal(df):
-    """Painel de análise temporal e tendências"""
+@usa_colunas('DATA_CMPT', 'MORTE', 'VAL_TOT', 'DIAS_PERM')
+def painel_temporal(df, cubo=None):
+    """Painel de análise temporal e tendências (uma única agregação mensal via consultar)"""
     
     st.title("📈 Painel Temporal / Tendência")
     st.markdown("---")
@@ -1850,28 +3247,14 @@ def painel_temporal(df):
         return
     
     # Agregar dados mensais
-    agg_dict = {}
+    mensal = consultar_painel(df, cubo, 'mensal')
+    df_mensal = pd.DataFrame({'Data': mensal['MES'], 'Total_Internações': mensal['Total']})
     if 'MORTE' in df.columns:
-        agg_dict['MORTE'] = 'sum'
+        df_mensal['Total_Óbitos'] = mensal['MORTE']
     if 'VAL_TOT' in df.columns:
-        agg_dict['VAL_TOT'] = 'sum'
+        df_mensal['Custo_Total'] = mensal['VAL_TOT']
     if 'DIAS_PERM' in df.columns:
-        agg_dict['DIAS_PERM'] = 'mean'
-
-    df_mensal = df.groupby(df['DATA_CMPT'].dt.to_period('M')).agg(agg_dict).reset_index()
-    df_mensal.insert(1, 'Total_Internações', df.groupby(df['DATA_CMPT'].dt.to_period('M')).size().values)
-
-    df_mensal['DATA_CMPT'] = df_mensal['DATA_CMPT'].dt.to_timestamp()
-
-    # Renomear colunas
-    rename_map = {'DATA_CMPT': 'Data'}
-    if 'MORTE' in agg_dict:
-        rename_map['MORTE'] = 'Total_Óbitos'
-    if 'VAL_TOT' in agg_dict:
-        rename_map['VAL_TOT'] = 'Custo_Total'
-    if 'DIAS_PERM' in agg_dict:
-        rename_map['DIAS_PERM'] = 'Média_Permanência'
-    df_mensal = df_mensal.rename(columns=rename_map)
+        df_mensal['Média_Permanência'] = media(mensal, 'DIAS_PERM')
     
     if 'Total_Óbitos' in df_mensal.columns:
         df_mensal['Taxa_Mortalidade'] = (df_mensal['Total_Óbitos'] / df_mensal['Total_Internações'] * 100)
@@ -1966,13 +3349,9 @@ def painel_temporal(df):
     with col2:
         st.subheader("📦 Distribuição de Internações por Mês")
         
-        df_box = df.copy()
-        df_box['Mês'] = df_box['DATA_CMPT'].dt.strftime('%b')
-        df_box['Mês'] = pd.Categorical(df_box['Mês'], categories=meses_ordem, ordered=True)
-        
-        # Agregar por mês/ano primeiro para evitar overplotting
-        df_box_agg = df_box.groupby([df_box['DATA_CMPT'].dt.to_period('M'), 'Mês']).size().reset_index(name='Total')
-        df_box_agg['Mês'] = df_box_agg['Mês'].astype(str)
+        # Um ponto por mês/ano (a mesma agregação mensal) para evitar overplotting
+        df_box_agg = pd.DataFrame({'Mês': df_mensal['Data'].dt.strftime('%b'), 'Total': df_mensal['Total_Internações']})
+        df_box_agg = df_box_agg[df_box_agg['Mês'].isin(meses_ordem)]
         
         fig_box = px.box(
             df_box_agg,
@@ -2007,11 +3386,9 @@ def painel_temporal(df):
     # Tabela de estatísticas mensais
     st.subheader("📊 Estatísticas Mensais")
     
-    df_mensal_display = df_mensal.copy()
+    df_mensal_display = formatar_colunas(df_mensal, {'Custo_Total': formatar_moeda})
     df_mensal_display['Data'] = df_mensal_display['Data'].dt.strftime('%m/%Y')
     
-    if 'Custo_Total' in df_mensal_display.columns:
-        df_mensal_display['Custo_Total'] = df_mensal_display['Custo_Total'].apply(lambda x: formatar_moeda(x))
     if 'Média_Permanência' in df_mensal_display.columns:
         df_mensal_display['Média_Permanência'] = df_mensal_display['Média_Permanência'].round(1)
     if 'Taxa_Mortalidade' in df_mensal_display.columns:
@@ -2133,25 +3510,321 @@ def painel_metodologia():
     
     **Última atualização**: """ + datetime.now().strftime("%d/%m/%Y"))
 
+# ============================================================================
+# PRÉ-CÁLCULO DAS FATIAS MAIS USADAS (SEGUNDO PLANO)
+# ============================================================================
+
+# Nome pelo qual os processos do pool importam este arquivo
+MODULO_DASHBOARD = Path(__file__).stem
+
+class ReferenciaModulo:
+    """
+    Este módulo (nome=None) ou uma função dele, serializados pelo nome de MODULO_DASHBOARD
+
+    Sob `streamlit run` o arquivo é executado como __main__, e o pickle de uma
+    função apontaria para o __main__ do processo filho; com esta referência o
+    filho importa dashboard_sus_v2 e busca a função nele.
+    """
+
+    def __init__(self, nome=None):
+        self.nome = nome
+
+    def __call__(self, *args, **kwargs):
+        return globals()[self.nome](*args, **kwargs)
+
+    def __reduce__(self):
+        if self.nome is None:
+            return importlib.import_module, (MODULO_DASHBOARD,)
+        return getattr, (ReferenciaModulo(), self.nome)
+
+def iniciar_processo_precalculo():
+    """Inicializador dos processos do pool: prioridade baixa e sem os avisos do Streamlit fora de `streamlit run`"""
+    if hasattr(os, 'nice'):
+        os.nice(PRIORIDADE_PRECALCULO)
+    logging.disable(logging.WARNING)
+
+def consultas_dos_paineis(colunas):
+    """Consultas (dimensões, dropna) de CONSULTAS_PAINEIS disponíveis sobre uma base com `colunas`, sem repetição"""
+    return list(dict.fromkeys(
+        (dimensoes, dropna) for nome, (_, dropna) in CONSULTAS_PAINEIS.items()
+        if (dimensoes := dimensoes_painel(nome, colunas)) is not None))
+
+def precalcular_fatia(snapshot, posicoes, cubo, consultas):
+    """
+    Calcula as consultas dos painéis sobre uma fatia da base e devolve os resultados
+
+    Roda em um processo do pool: a base é mapeada do snapshot que o dashboard
+    já gravou (ler_snapshot), e as linhas da fatia e o cubo já filtrado chegam
+    do processo principal, de modo que o processo não lê a fonte nem monta
+    cubo, índice ou dimensões, e não executa nenhum painel. As estruturas
+    derivadas (ex.: MatrizFluxos, perfis dos estabelecimentos) são refeitas no
+    dashboard a partir destes resultados.
+
+    Args:
+        snapshot: Snapshot da base completa (snapshot_da_base)
+        posicoes: Linhas da fatia (posicoes_filtradas no índice da base)
+        cubo: Rollups do cubo já filtrados para a fatia (filtrar_cubo)
+        consultas: Pares (dimensões, dropna) de consultas_dos_paineis()
+
+    Returns:
+        Pares (consulta, resultado) com a identificação usada por consultar() no cache de agregados
+    """
+    visao = VisaoFiltrada(ler_snapshot(snapshot), posicoes)
+    return [(('consultar', dimensoes, dropna), _consultar(visao, cubo, list(dimensoes), dropna))
+            for dimensoes, dropna in consultas]
+
+def fatias_populares(df, dimensoes, n=FATIAS_PRECALCULO):
+    """
+    Filtros de um único valor mais prováveis na sidebar: os n valores com mais internações de cada FILTROS_PRECALCULO
+
+    Os demais filtros ficam como a sidebar os inicia (período completo, seleções
+    vazias), para que a chave_filtros() da fatia seja a mesma de uma sessão.
+
+    Returns:
+        Lista de dicts com 'filtro', 'valor', 'linhas' e 'filtros'
+    """
+    padrao = {chave: [] for chave, _ in colunas_dos_filtros(df.columns)}
+    if 'periodo' in dimensoes:
+        padrao['data_inicio'] = dimensoes['periodo'][0].date()
+        padrao['data_fim'] = dimensoes['periodo'][1].date()
+
+    fatias = []
+    for chave, coluna in colunas_dos_filtros(df.columns):
+        if chave not in FILTROS_PRECALCULO:
+            continue
+        contagem = df[coluna].value_counts().head(n)
+        for valor, linhas in zip(contagem.index.tolist(), contagem.tolist()):
+            fatias.append({'filtro': chave, 'valor': valor, 'linhas': linhas, 'filtros': {**padrao, chave: [valor]}})
+    return fatias
+
+class PreCalculo:
+    """
+    Pré-cálculo dos agregados dos painéis para as fatias mais usadas, em um pool de processos
+
+    Os processos (spawn, prioridade reduzida por iniciar_processo_precalculo)
+    calculam as fatias de fatias_populares() e os resultados entram no cache de
+    agregados do dashboard sob a mesma chave que uma sessão com aquele filtro
+    usaria. O pool recebe no máximo PROCESSOS_PRECALCULO fatias por vez (a
+    próxima sai quando uma termina), de modo que cancelar ou encerrar o
+    interpretador só espera as que estão em andamento; ao final o pool é
+    encerrado, liberando a memória dos processos. Uma nova versão da base
+    cancela o pré-cálculo anterior.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.chave = None
+        self.total_linhas = 0
+        self.cancelado = False
+        self._fatias = []
+        self._pendentes = deque()
+        self._argumentos = None
+        self._prontas = []
+        self._falhas = 0
+        self._geracao = 0
+        self._pool = None
+        self._trava = threading.Lock()
+
+    def iniciar(self, df, dimensoes, periodo=None, versao=None):
+        """Inicia o pré-cálculo da base, se ainda não foi iniciado para esta (periodo, versao)"""
+        with self._trava:
+            if self.chave == (periodo, versao):
+                return
+        self.cancelar()
+
+        # Os processos mapeiam o snapshot já gravado; sem ele (ex.: diretório sem escrita) não há pré-cálculo
+        snapshot = snapshot_da_base(colunas_necessarias())
+        if not snapshot.exists():
+            logger.info("Pré-cálculo não iniciado: snapshot da base ausente (%s)", snapshot)
+            return
+
+        fatias = fatias_populares(df, dimensoes)
+        for fatia in fatias:
+            fatia['chave'] = chave_filtros(fatia['filtros'], periodo, versao)
+        # Índice e cubo do dashboard: cada fatia chega ao pool já recortada
+        indice = carregar_indice_filtros(periodo, versao)
+        cubo, indices_cubo = carregar_cubo(periodo, versao), carregar_indice_filtros(periodo, versao, cubo=True)
+        consultas = consultas_dos_paineis(df.columns)
+        with self._trava:
+            self.chave = (periodo, versao)
+            self.total_linhas = len(df)
+            self.cancelado = False
+            self._fatias, self._prontas, self._falhas = fatias, [], 0
+            if not fatias:
+                return
+            self._geracao += 1
+            self._pendentes = deque(fatias)
+            self._argumentos = lambda fatia: (snapshot, posicoes_filtradas(indice, fatia['filtros']),
+                                              filtrar_cubo(cubo, fatia['filtros'], indices_cubo), consultas)
+            self._pool = ProcessPoolExecutor(PROCESSOS_PRECALCULO, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=ReferenciaModulo('iniciar_processo_precalculo'))
+            geracao = self._geracao
+        logger.info("Pré-cálculo iniciado: %d fatias em %d processos", len(fatias), PROCESSOS_PRECALCULO)
+        for _ in range(PROCESSOS_PRECALCULO):
+            self._enviar(geracao)
+
+    def _enviar(self, geracao):
+        """Envia ao pool a próxima fatia pendente, se o pré-cálculo desta geração continua"""
+        with self._trava:
+            if geracao != self._geracao or self._pool is None or not self._pendentes:
+                return
+            fatia = self._pendentes.popleft()
+            try:
+                futuro = self._pool.submit(ReferenciaModulo('precalcular_fatia'), *self._argumentos(fatia))
+            except RuntimeError:
+                # Pool encerrado ou interpretador saindo: as fatias restantes ficam como canceladas
+                pool, self._pool = self._pool, None
+                self._pendentes.clear()
+                self.cancelado = True
+            else:
+                pool = None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            logger.info("Pré-cálculo cancelado: %s", self.resumo())
+            return
+        futuro.add_done_callback(lambda futuro: self._concluir(geracao, fatia, futuro))
+
+    def _concluir(self, geracao, fatia, futuro):
+        if futuro.cancelled():
+            return
+        erro = futuro.exception()
+        with self._trava:
+            if geracao != self._geracao:
+                return
+            if erro is None:
+                for consulta, resultado in futuro.result():
+                    self.cache.guardar((fatia['chave'], consulta), resultado)
+                self._prontas.append(fatia)
+            else:
+                self._falhas += 1
+                if self._falhas == 1:
+                    logger.warning("Pré-cálculo: falha na fatia %s = %r: %s", fatia['filtro'], fatia['valor'], erro)
+            terminou = len(self._prontas) + self._falhas == len(self._fatias)
+            if terminou and self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+        if terminou:
+            logger.info("Pré-cálculo concluído: %s", self.resumo())
+        else:
+            self._enviar(geracao)
+
+    def em_andamento(self):
+        """Se ainda há fatias sendo calculadas"""
+        with self._trava:
+            return self._pool is not None
+
+    def cancelar(self):
+        """Cancela as fatias ainda não calculadas e encerra o pool (sem esperar as que estão em andamento)"""
+        with self._trava:
+            pool, self._pool = self._pool, None
+            self._pendentes.clear()
+            self._geracao += 1
+            self.cancelado = pool is not None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            logger.info("Pré-cálculo cancelado: %s", self.resumo())
+
+    def cobertura(self):
+        """
+        Quanto já foi pré-calculado, por filtro
+
+        Returns:
+            dict filtro → {'prontas', 'total', 'linhas_%'}, onde linhas_% é a
+            parcela das internações da base nos valores já pré-calculados
+        """
+        with self._trava:
+            fatias, prontas, total_linhas = list(self._fatias), list(self._prontas), self.total_linhas
+        cobertura = {}
+        for fatia in fatias:
+            item = cobertura.setdefault(fatia['filtro'], {'prontas': 0, 'total': 0, 'linhas_%': 0.0})
+            item['total'] += 1
+        for fatia in prontas:
+            item = cobertura[fatia['filtro']]
+            item['prontas'] += 1
+            item['linhas_%'] += 100 * fatia['linhas'] / max(total_linhas, 1)
+        return cobertura
+
+    def resumo(self):
+        """Cobertura em uma linha de texto (log e sidebar)"""
+        cobertura = self.cobertura()
+        with self._trava:
+            cancelado, falhas = self.cancelado, self._falhas
+        prontas = sum(item['prontas'] for item in cobertura.values())
+        total = sum(item['total'] for item in cobertura.values())
+        situacao = " (cancelado)" if cancelado else ""
+        falhas = f", {falhas} com falha" if falhas else ""
+        partes = [f"{filtro} {item['prontas']}/{item['total']} ({item['linhas_%']:.0f}% das internações)"
+                  for filtro, item in cobertura.items()]
+        return f"{prontas}/{total} fatias{situacao}{falhas}: " + "; ".join(partes)
+
+@st.cache_resource
+def precalculo():
+    """Instância única do pré-cálculo no processo, ligada ao cache de agregados (cancelada ao encerrar o processo)"""
+    instancia = PreCalculo(cache_agregados())
+    atexit.register(instancia.cancelar)
+    return instancia
+
 # ============================================================================
 # FUNÇÃO PRINCIPAL
 # ============================================================================
 
+def montar_visao(df, filtros, periodo=None, versao=None):
+    """
+    Base filtrada (VisaoFiltrada) e cubo filtrado entregues aos painéis para os filtros da sidebar
+
+    Com um backend opcional, as agregações saem dos snapshots (MOTORES_CONSULTA)
+    e o cubo não é montado (None).
+    """
+    motor = None
+    if BACKEND_CONSULTAS in MOTORES_CONSULTA:
+        base_consultas = carregar_base_consultas(BACKEND_CONSULTAS, periodo, versao)
+        if base_consultas is not None:
+            motor = MOTORES_CONSULTA[BACKEND_CONSULTAS](base_consultas, df, filtros)
+
+    # Filtros pelo índice invertido: a visão guarda as posições e cada painel
+    # materializa só as colunas que usa (do cubo filtrado ficam só os rollups que os filtros e o período permitem)
+    df_filtrado = VisaoFiltrada(df, posicoes_filtradas(carregar_indice_filtros(periodo, versao), filtros),
+                                chave=chave_filtros(filtros, periodo, versao), motor=motor)
+    cubo_filtrado = None if motor is not None else filtrar_cubo(
+        carregar_cubo(periodo, versao), filtros, carregar_indice_filtros(periodo, versao, cubo=True))
+    return df_filtrado, cubo_filtrado
+
+def paineis_com_dados(df_filtrado, cubo_filtrado, dimensoes):
+    """Painéis sobre os dados filtrados, como pares (rótulo, função sem argumentos)"""
+    return [
+        ("📊 Geral", lambda: painel_geral(df_filtrado, cubo_filtrado)),
+        ("🔬 Epidemiológico", lambda: painel_epidemiologico(df_filtrado, cubo_filtrado)),
+        ("🗺️ Regulação", lambda: painel_regulacao(df_filtrado, cubo_filtrado)),
+        ("🏥 Estabelecimentos", lambda: painel_estabelecimento(df_filtrado, cubo_filtrado, dimensoes)),
+        ("⚕️ Procedimentos", lambda: painel_procedimentos(df_filtrado, cubo_filtrado)),
+        ("👥 Equidade", lambda: painel_populacional(df_filtrado, cubo_filtrado)),
+    ]
+
 def main():
     """Função principal do dashboard"""
+    configurar_pagina()
     
-    # Carregar dados
-    df = carregar_dados()
+    # Carregar dados (com LEITURA_POR_PERIODO, apenas o período escolhido na sidebar)
+    periodo = None
+    if LEITURA_POR_PERIODO and 'filtro_data_inicio' in st.session_state and 'filtro_data_fim' in st.session_state:
+        periodo = (st.session_state['filtro_data_inicio'], st.session_state['filtro_data_fim'])
+    versao = versao_fonte(CAMINHO_ARQUIVO)
+    df = carregar_dados(periodo, versao)
     
     if df is None:
         st.error("Não foi possível carregar os dados. Verifique o caminho do arquivo.")
         st.stop()
     
     # Criar filtros na sidebar
-    filtros = criar_filtros_sidebar(df)
-    
-    # Aplicar filtros
-    df_filtrado = aplicar_filtros(df, filtros)
+    dimensoes = carregar_dimensoes(periodo, versao)
+    filtros = criar_filtros_sidebar(df, dimensoes)
+
+    # Pré-cálculo das fatias mais usadas em segundo plano (uma vez por versão da base;
+    # com LEITURA_POR_PERIODO a base muda com o período e não é pré-calculada)
+    if FATIAS_PRECALCULO and PROCESSOS_PRECALCULO and periodo is None:
+        precalculo().iniciar(df, dimensoes, periodo, versao)
+
+    df_filtrado, cubo_filtrado = montar_visao(df, filtros, periodo, versao)
     
     # Aviso sobre os dados
     total_registros = formatar_numero(len(df_filtrado))
@@ -2168,42 +3841,37 @@ def main():
     </div>
     """, unsafe_allow_html=True)
 
-    # Navegação por tabs
-    tab0, tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs([
-        "🏠 Início",
-        "📊 Geral",
-        "🔬 Epidemiológico",
-        "🗺️ Regulação",
-        "🏥 Estabelecimentos",
-        "⚕️ Procedimentos",
-        "👥 Equidade",
-        "📚 Metodologia"
-    ])
-
-    with tab0:
-        painel_inicial()
-
-    with tab1:
-        painel_geral(df_filtrado)
-
-    with tab2:
-        painel_epidemiologico(df_filtrado)
-
-    with tab3:
-        painel_regulacao(df_filtrado)
-
-    with tab4:
-        painel_estabelecimento(df_filtrado)
-
-    with tab5:
-        painel_procedimentos(df_filtrado)
-
-    with tab6:
-        painel_populacional(df_filtrado)
+    # Navegação: cada painel é uma função sem argumentos sobre os dados já filtrados
+    paineis = [
+        ("🏠 Início", painel_inicial),
+        *paineis_com_dados(df_filtrado, cubo_filtrado, dimensoes),
+        ("📚 Metodologia", painel_metodologia),
+    ]
+
+    if NAVEGACAO_SOB_DEMANDA:
+        # Só o painel escolhido é executado no rerun; os demais, quando forem abertos
+        escolhido = st.radio("Painel", [rotulo for rotulo, _ in paineis], horizontal=True,
+                             key='painel_ativo', label_visibility='collapsed')
+        dict(paineis)[escolhido]()
+    else:
+        for aba, (_, exibir) in zip(st.tabs([rotulo for rotulo, _ in paineis]), paineis):
+            with aba:
+                exibir()
+
+    estatisticas = cache_agregados().estatisticas()
+    logger.info("Cache de agregados: %(acertos)d acertos, %(faltas)d faltas, %(itens)d itens (%(mb).1f MB)",
+                estatisticas)
+    megabytes = f"{estatisticas['mb']:.1f}".replace('.', ',')
+    st.sidebar.caption(
+        f"🗄️ Cache de agregados: {formatar_numero(estatisticas['acertos'])} acertos, "
+        f"{formatar_numero(estatisticas['faltas'])} faltas, {estatisticas['itens']} itens ({megabytes} MB)")
+
+    if FATIAS_PRECALCULO and PROCESSOS_PRECALCULO and periodo is None and precalculo().cobertura():
+        st.sidebar.caption(f"⚡ Pré-cálculo dos filtros mais usados: {precalculo().resumo()}")
+        if precalculo().em_andamento() and st.sidebar.button("⏹️ Cancelar pré-cálculo", key='cancelar_precalculo'):
+            precalculo().cancelar()
+            st.rerun()
 
-    with tab7:
-        painel_metodologia()
-    
     # Footer
     st.sidebar.markdown("---")
     st.sidebar.markdown("""
@@ -0,0 +1,129 @@
+"""
+Registro de esquema das colunas do SIH/RD (AIH Reduzida) exportadas do DATASUS
+
+Define explicitamente o tipo Arrow de destino de cada coluna conhecida, para que
+todo arquivo mensal convertido ou carregado saia com os mesmos tipos, sem
+inferência baseada no conteúdo. Usado por converter_para_parquet.py e pelo
+dashboard (carregar_dados).
+
+    - Códigos (município IBGE, CNES, procedimento SIGTAP, raça/cor): inteiros
+    - Número da AIH: texto (identificador)
+    - Textos repetitivos (nomes, CID, sexo, desfecho): dicionário (category no pandas)
+    - Datas: timestamp, com formato explícito quando vierem como texto
+    - Valores monetários: float64
+"""
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+DICIONARIO = pa.dictionary(pa.int32(), pa.string())
+DATA = pa.timestamp('ms')
+
+ESQUEMA_SIH = {
+    'N_AIH': pa.string(),  # número da AIH: identificador, não quantidade
+    'UF_Residencia': DICIONARIO,
+    'Municipio_Residencia': pa.int32(),
+    'Nome_Municipio_Residencia': DICIONARIO,
+    'Municipio_Atendimento': pa.int32(),
+    'Nome_Municipio_Atendimento': DICIONARIO,
+    'Codigo_CNES': pa.int32(),
+    'Nome_Estabelecimento': DICIONARIO,
+    'Dias_Permanencia': pa.int16(),
+    'Dias_UTI_Mes': pa.int16(),
+    'Diagnostico_Principal': DICIONARIO,
+    'Nome_Doenca': DICIONARIO,
+    'Procedimento_Solicitado': pa.int32(),
+    'Nome_Procedimento_Solicitado': DICIONARIO,
+    'Procedimento_Realizado': pa.int32(),
+    'Nome_Procedimento_Realizado': DICIONARIO,
+    'Valor_Total': pa.float64(),
+    'Data_Internacao': DATA,
+    'Data_Saida': DATA,
+    'Data_Nascimento': DATA,
+    'Sexo': DICIONARIO,
+    'Idade': pa.int16(),
+    'Raca_Cor': pa.int8(),
+    'Nome_Raca_Cor': DICIONARIO,
+    'Morte': DICIONARIO,
+    'CID_Notificacao': DICIONARIO,
+}
+
+# Formato das colunas de data quando chegam como texto (células de data do
+# Excel já chegam como datetime e não passam por aqui)
+FORMATOS_DATA = {
+    'Data_Internacao': '%Y-%m-%d',
+    'Data_Saida': '%Y-%m-%d',
+    'Data_Nascimento': '%Y-%m-%d',
+}
+
+def tipo_padrao(tipo):
+    """Tipo de destino de colunas fora do registro: decidido pelo tipo de origem, nunca pelos valores"""
+    if pa.types.is_integer(tipo):
+        return pa.int64()
+    if pa.types.is_floating(tipo):
+        return pa.float64()
+    if pa.types.is_boolean(tipo) or pa.types.is_temporal(tipo):
+        return tipo
+    return pa.string()
+
+def esquema_alvo(esquema_origem):
+    """Esquema Arrow de destino para as colunas presentes em esquema_origem"""
+    return pa.schema([
+        pa.field(campo.name, ESQUEMA_SIH.get(campo.name) or tipo_padrao(campo.type))
+        for campo in esquema_origem
+    ])
+
+def tabela_de_pandas(df):
+    """
+    Converte o DataFrame bruto para Arrow
+
+    Colunas object (ex.: códigos lidos do Excel misturando número e texto) são
+    convertidas para texto; o tipo final vem do cast em aplicar_esquema().
+    """
+    colunas_object = [col for col in df.columns if df[col].dtype == object]
+    if colunas_object:
+        df = df.astype({col: 'string' for col in colunas_object})
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+def aplicar_esquema(tabela, esquema=None):
+    """
+    Converte a tabela para o esquema do registro em um único cast vetorizado
+
+    Args:
+        tabela: Tabela Arrow com as colunas brutas
+        esquema: Esquema de destino já fixado (ex.: pelo primeiro bloco de uma
+            conversão em streaming). Se None, usa esquema_alvo(tabela.schema).
+
+    Raises:
+        pyarrow.ArrowInvalid: se algum valor não puder ser convertido para o
+            tipo do registro (ex.: texto em uma coluna de código)
+    """
+    for indice, campo in enumerate(tabela.schema):
+        coluna = original = tabela.column(indice)
+
+        alvo = esquema.field(campo.name).type if esquema is not None else ESQUEMA_SIH.get(campo.name)
+
+        # Dicionário de origem com destino não-dicionário: decodifica antes do cast
+        if pa.types.is_dictionary(campo.type) and alvo is not None and not pa.types.is_dictionary(alvo):
+            coluna = pc.cast(coluna, campo.type.value_type)
+        # Destino dicionário a partir de número/nulo (ex.: coluna vazia lida como float): passa por texto
+        elif alvo is not None and pa.types.is_dictionary(alvo) and not (
+                pa.types.is_dictionary(campo.type) or pa.types.is_string(campo.type)):
+            coluna = pc.cast(coluna, pa.string())
+
+        # Datas em texto: formato explícito do registro
+        if campo.name in FORMATOS_DATA and (pa.types.is_string(coluna.type) or pa.types.is_large_string(coluna.type)):
+            coluna = pc.strptime(coluna, format=FORMATOS_DATA[campo.name], unit='ms', error_is_null=True)
+
+        if coluna is not original:
+            tabela = tabela.set_column(indice, campo.name, coluna)
+
+    if esquema is None:
+        esquema = esquema_alvo(tabela.schema)
+    # Metadados pandas da origem descreveriam os tipos antigos
+    return tabela.replace_schema_metadata(None).select(esquema.names).cast(esquema)
+
+def resumo_esquema(esquema):
+    """Conta quantas colunas do esquema vieram do registro e quantas ficaram com o tipo padrão"""
+    registradas = sum(1 for nome in esquema.names if nome in ESQUEMA_SIH)
+    return registradas, len(esquema) - registradas
@@ -0,0 +1,85 @@
+"""
+Bases sintéticas no formato do SIH/RD exportado do DATASUS, para os testes
+
+base_bruta() gera as colunas de origem (nomes de esquema_sih.ESQUEMA_SIH) com
+poucos valores por dimensão, de modo que filtros e agrupamentos tenham grupos
+repetidos, ausentes e categorias diferentes entre meses.
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dashboard_sus_v2 as dash
+
+logging.getLogger("dashboard_sih").setLevel(logging.WARNING)
+
+def base_bruta(linhas=2000, semente=0, inicio="2025-01-01", fim="2025-07-31", doencas=None, prefixo_aih=0):
+    """
+    Base bruta sintética com internações entre `inicio` e `fim`
+
+    Args:
+        doencas: Códigos CID possíveis (padrão: A00..A14); mudar entre meses
+            produz categorias diferentes em cada partição
+        prefixo_aih: Somado ao número da AIH, para bases distintas não repetirem identificadores
+    """
+    rng = np.random.default_rng(semente)
+    doencas = list(doencas or [f"A{i:02d}" for i in range(15)])
+    municipios = np.arange(310010, 310210, 10)
+    hospitais = np.arange(2100000, 2100012)
+    procedimentos = np.array([303010031, 303010040, 411010034, 415010012])
+
+    dias = (pd.Timestamp(fim) - pd.Timestamp(inicio)).days + 1
+    internacao = pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, dias, linhas), unit='D')
+    permanencia = rng.integers(0, 30, linhas)
+    idade = rng.integers(0, 95, linhas).astype(float)
+    idade[rng.random(linhas) < 0.02] = np.nan
+
+    # Cada hospital fica em um município: o estabelecimento determina o município de atendimento
+    sede = rng.choice(municipios, len(hospitais), replace=False)
+    res = rng.choice(municipios, linhas)
+    hospital = rng.integers(0, len(hospitais), linhas)
+    cnes = hospitais[hospital]
+    mov = sede[hospital]
+    cid = rng.choice(doencas, linhas)
+    proc = rng.choice(procedimentos, linhas)
+    raca = rng.choice([1, 2, 3, 4, 5, 9], linhas)
+    valor = rng.gamma(2.0, 600.0, linhas).round(2)
+    valor[rng.random(linhas) < 0.01] = np.nan
+
+    return pd.DataFrame({
+        'N_AIH': [str(prefixo_aih + i) for i in range(linhas)],
+        'UF_Residencia': 'MG',
+        'Municipio_Residencia': res,
+        'Nome_Municipio_Residencia': [f"MUNICIPIO {m}" for m in res],
+        'Municipio_Atendimento': mov,
+        'Nome_Municipio_Atendimento': [f"MUNICIPIO {m}" for m in mov],
+        'Codigo_CNES': cnes,
+        'Nome_Estabelecimento': [f"HOSPITAL {c % 100:02d}" for c in cnes],
+        'Dias_Permanencia': permanencia,
+        'Dias_UTI_Mes': np.where(rng.random(linhas) < 0.1, rng.integers(1, 10, linhas), 0),
+        'Diagnostico_Principal': cid,
+        'Nome_Doenca': [f"DOENCA {c}" for c in cid],
+        'Procedimento_Solicitado': proc,
+        'Nome_Procedimento_Solicitado': [f"PROCEDIMENTO {p % 100:02d}" for p in proc],
+        'Procedimento_Realizado': proc,
+        'Nome_Procedimento_Realizado': [f"PROCEDIMENTO {p % 100:02d}" for p in proc],
+        'Valor_Total': valor,
+        'Data_Internacao': internacao,
+        'Data_Saida': internacao + pd.to_timedelta(permanencia, unit='D'),
+        'Data_Nascimento': internacao - pd.to_timedelta(idade * 365.25, unit='D'),
+        'Sexo': rng.choice(['Masculino', 'Feminino'], linhas),
+        'Idade': idade,
+        'Raca_Cor': raca,
+        'Nome_Raca_Cor': pd.Series(raca).map({1: 'Branca', 2: 'Preta', 3: 'Parda', 4: 'Amarela',
+                                              5: 'Indígena', 9: 'Ignorada'}),
+        'Morte': np.where(rng.random(linhas) < 0.05, 'Sim', 'Não'),
+        'CID_Notificacao': pd.Series([None] * linhas, dtype=object),
+    })
+
+@pytest.fixture(scope="session")
+def base():
+    """Base sintética já processada como em carregar_dados()"""
+    return dash.processar_dados(base_bruta(linhas=6000, semente=1))
@@ -0,0 +1,37 @@
+"""Indicadores lidos dos agregados (mais_frequente) contra o .mode() sobre os microdados"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dashboard_sus_v2 as dash
+
+def moda(serie):
+    """.mode() como na base anterior à compactação: nomes em texto (object), faixas etárias em categoria ordenada"""
+    if serie.dtype.name == 'category' and not serie.cat.ordered:
+        serie = serie.astype(object)
+    valores = serie.mode()
+    return valores.iloc[0] if len(valores) else None
+
+def test_empate_fica_com_o_menor_rotulo():
+    # Categorias na ordem de aparição (A14 antes de A10), com o mesmo número de óbitos
+    nomes = ['DOENCA A14'] * 3 + ['DOENCA A10'] * 3 + ['DOENCA B01'] * 2
+    df = pd.DataFrame({
+        'NOME_CID_PRINC': pd.Categorical(nomes, categories=pd.unique(pd.Series(nomes))),
+        'MORTE': np.ones(8, dtype=np.int8),
+    })
+    agregado = dash.agregar_microdados(df, ['NOME_CID_PRINC'])
+    assert list(df['NOME_CID_PRINC'].cat.categories[:2]) == ['DOENCA A14', 'DOENCA A10']
+    assert dash.mais_frequente(agregado, 'NOME_CID_PRINC', 'MORTE') == 'DOENCA A10'
+    assert dash.mais_frequente(agregado, 'NOME_CID_PRINC', 'MORTE') == moda(df[df['MORTE'] == 1]['NOME_CID_PRINC'])
+
+@pytest.mark.parametrize("coluna", ['NOME_CID_PRINC', 'NOME_PROC_REA', 'FAIXA_ETARIA', 'RACA_COR', 'SEXO'])
+@pytest.mark.parametrize("medida", ['Total', 'MORTE'])
+def test_igual_ao_mode_dos_microdados(base, coluna, medida):
+    rng = np.random.default_rng(5)
+    # Subconjuntos pequenos: muitos empates no máximo
+    for tamanho in [0, 1, 5, 20, 60, 200]:
+        amostra = base.take(np.sort(rng.choice(len(base), tamanho, replace=False)))
+        agregado = dash.agregar_microdados(amostra, [coluna])
+        microdados = amostra[coluna] if medida == 'Total' else amostra[amostra['MORTE'] == 1][coluna]
+        assert dash.mais_frequente(agregado, coluna, medida) == moda(microdados), tamanho
@@ -0,0 +1,62 @@
+"""Anexação de meses ao dataset particionado (converter_para_parquet.py --anexar) e carga no dashboard"""
+
+import pandas as pd
+
+import converter_para_parquet as conversor
+import dashboard_sus_v2 as dash
+from conftest import base_bruta
+
+def gravar_excel(df, caminho):
+    df.to_excel(caminho, index=False)
+    return caminho
+
+def carregar(dataset, snapshots, monkeypatch):
+    monkeypatch.setattr(dash, 'CAMINHO_ARQUIVO', str(dataset))
+    monkeypatch.setattr(dash, 'DIRETORIO_SNAPSHOT', str(snapshots))
+    return dash.carregar_dados(None, dash.versao_fonte(dataset))
+
+def test_anexar_e_substituir_mes(tmp_path, monkeypatch):
+    dataset, snapshots = tmp_path / 'dados', tmp_path / '.snapshots'
+    janeiro = base_bruta(300, semente=1, inicio="2025-01-01", fim="2025-01-31", doencas=['A00', 'A01'])
+    fevereiro = base_bruta(200, semente=2, inicio="2025-02-01", fim="2025-02-28", doencas=['B00', 'B01'],
+                           prefixo_aih=10_000)
+    fevereiro['Nome_Procedimento_Realizado'] = None  # coluna inteiramente vazia em um dos meses
+    conversor.anexar_ao_dataset(gravar_excel(janeiro, tmp_path / 'rd_2025_01.xlsx'), dataset)
+    conversor.anexar_ao_dataset(gravar_excel(fevereiro, tmp_path / 'rd_2025_02.xlsx'), dataset)
+
+    df = carregar(dataset, snapshots, monkeypatch)
+    assert len(df) == 500
+    assert set(df['NOME_CID_PRINC'].cat.categories) == {'DOENCA A00', 'DOENCA A01', 'DOENCA B00', 'DOENCA B01'}
+    assert df['NOME_CID_PRINC'].notna().all()
+    assert df.groupby(df['DATA_CMPT'].dt.month).size().to_dict() == {1: 300, 2: 200}
+    # Mês com a coluna vazia: continua category, com as categorias do outro mês
+    procedimentos = df['NOME_PROC_REA']
+    assert procedimentos.dtype.name == 'category'
+    assert set(procedimentos.cat.categories) == set(janeiro['Nome_Procedimento_Realizado'])
+    assert procedimentos[df['DATA_CMPT'].dt.month == 2].isna().all()
+    assert procedimentos[df['DATA_CMPT'].dt.month == 1].notna().all()
+
+    # Janeiro republicado pelo mesmo arquivo de origem: substitui só o que ele havia gravado
+    republicado = base_bruta(120, semente=3, inicio="2025-01-01", fim="2025-01-31", doencas=['A01', 'C00'])
+    conversor.anexar_ao_dataset(gravar_excel(republicado, tmp_path / 'rd_2025_01.xlsx'), dataset)
+    assert [p.name for p in (dataset / 'ano=2025' / 'mes=1').iterdir()] == ['rd_2025_01-0.parquet']
+
+    df = carregar(dataset, snapshots, monkeypatch)
+    assert len(df) == 320
+    assert df.groupby(df['DATA_CMPT'].dt.month).size().to_dict() == {1: 120, 2: 200}
+    assert set(df['NOME_CID_PRINC'].cat.categories) == {'DOENCA A01', 'DOENCA C00', 'DOENCA B00', 'DOENCA B01'}
+    mes = df['DATA_CMPT'].dt.month
+    assert set(df.loc[mes == 1, 'NOME_CID_PRINC'].astype(str)) == {'DOENCA A01', 'DOENCA C00'}
+    assert set(df.loc[mes == 2, 'NOME_CID_PRINC'].astype(str)) == {'DOENCA B00', 'DOENCA B01'}
+    pd.testing.assert_series_equal(df['VAL_TOT'].iloc[:120].reset_index(drop=True),
+                                   republicado['Valor_Total'].rename('VAL_TOT'), check_dtype=False)
+
+def test_concatenar_partes_une_categorias():
+    partes = [
+        pd.DataFrame({'CID': pd.Categorical(['A', 'B']), 'VAZIA': pd.Categorical([None, None])}),
+        pd.DataFrame({'CID': pd.Categorical(['C', None, 'A']), 'VAZIA': pd.Categorical([None, None, None])}),
+    ]
+    df = dash.concatenar_partes(partes)
+    assert list(df['CID'].cat.categories) == ['A', 'B', 'C']
+    assert df['CID'].astype(object).tolist()[:3] == ['A', 'B', 'C'] and pd.isna(df['CID'].iloc[3])
+    assert df['VAZIA'].dtype.name == 'category' and df['VAZIA'].isna().all()
@@ -0,0 +1,23 @@
+"""Backend Arrow (ConsultaArrow) contra agregar_microdados sobre os microdados filtrados"""
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import dashboard_sus_v2 as dash
+from test_cubo import CONSULTAS, combinacoes
+
+@pytest.fixture(scope="module")
+def tabela(base):
+    return pa.Table.from_pandas(base, preserve_index=False)
+
+@pytest.mark.parametrize("nome_filtros", ['sem filtros', 'municípios', 'sexo e estabelecimento', 'CID',
+                                          'meses inteiros', 'meio do mês'])
+def test_mesmos_agregados_do_pandas(base, tabela, nome_filtros):
+    filtros = combinacoes(base)[nome_filtros]
+    filtrado = dash.aplicar_filtros(base, filtros)
+    motor = dash.ConsultaArrow(tabela, base, filtros)
+    for dimensoes, dropna in CONSULTAS:
+        esperado = dash.agregar_microdados(filtrado, dimensoes, dropna=dropna)
+        obtido = motor.agregar(dimensoes, dropna)
+        pd.testing.assert_frame_equal(obtido, esperado, check_dtype=False, check_exact=False)
@@ -0,0 +1,69 @@
+"""Cubo de agregados: rollups por conjunto de agrupamento e consultar() contra os microdados"""
+
+import datetime
+
+import pandas as pd
+import pytest
+
+import dashboard_sus_v2 as dash
+
+# (dimensões, dropna) das consultas dos painéis
+CONSULTAS = [
+    ([], True), (['MES'], True), (['NOME_MUNIC_RES'], True), (['NOME_CID_PRINC'], True),
+    (['FAIXA_ETARIA'], True), (['FAIXA_ETARIA', 'SEXO'], True), (['SEXO'], True), (['RACA_COR'], True),
+    (list(dash.DIMENSOES_FLUXO), False), (['CNES'], True), (['NOME_PROC_REA'], True),
+    (['NOME_CID_PRINC', 'NOME_PROC_REA'], True),
+]
+
+@pytest.fixture(scope="module")
+def cubo(base):
+    return dash.construir_cubo(base)
+
+def valores(base, coluna, n=2):
+    return list(base[coluna].dropna().unique()[:n])
+
+def combinacoes(base):
+    return {
+        'sem filtros': {},
+        'municípios': {'municipio_residencia': valores(base, 'NOME_MUNIC_RES')},
+        'sexo e estabelecimento': {'sexo': valores(base, 'SEXO', 1), 'cnes': valores(base, 'CNES', 3)},
+        'CID': {'cid': valores(base, 'NOME_CID_PRINC', 3)},
+        'meses inteiros': {'data_inicio': datetime.date(2025, 2, 1), 'data_fim': datetime.date(2025, 4, 30)},
+        'meio do mês': {'data_inicio': datetime.date(2025, 2, 10), 'data_fim': datetime.date(2025, 5, 20),
+                        'faixa_etaria': valores(base, 'FAIXA_ETARIA', 3)},
+    }
+
+def ordenado(resultado, dimensoes):
+    resultado = resultado[sorted(resultado.columns)]
+    if dimensoes:
+        resultado = resultado.astype({dim: object for dim in dimensoes})
+        resultado = resultado.sort_values(dimensoes, na_position='last', ignore_index=True)
+    return resultado
+
+def test_rollups_muito_menores_que_a_base(base, cubo):
+    assert set(cubo) == set(dash.ROLLUPS_CUBO)
+    for nome, rollup in cubo.items():
+        assert len(rollup) < len(base) / 3, nome
+        assert rollup['Total'].sum() == len(base), nome
+    assert sum(len(rollup) for rollup in cubo.values()) < len(base) / 2
+
+@pytest.mark.parametrize("nome_filtros", ['sem filtros', 'municípios', 'sexo e estabelecimento', 'CID',
+                                          'meses inteiros', 'meio do mês'])
+def test_consultar_igual_aos_microdados(base, cubo, nome_filtros):
+    filtros = combinacoes(base)[nome_filtros]
+    filtrado = dash.aplicar_filtros(base, filtros)
+    cubo_filtrado = dash.filtrar_cubo(cubo, filtros)
+    if nome_filtros == 'meio do mês':
+        assert cubo_filtrado == {}
+    for dimensoes, dropna in CONSULTAS:
+        esperado = dash.agregar_microdados(filtrado, dimensoes, dropna=dropna)
+        obtido = dash.consultar(filtrado, cubo_filtrado, dimensoes, dropna)
+        pd.testing.assert_frame_equal(ordenado(obtido, dimensoes), ordenado(esperado, dimensoes),
+                                      check_dtype=False, check_categorical=False, check_exact=False)
+
+@pytest.mark.parametrize("dimensoes,dropna", CONSULTAS)
+def test_somas_inteiras_em_int64(base, dimensoes, dropna):
+    # MORTE é int8 na base compactada: a soma por grupo não pode ficar no tipo de origem
+    assert base['MORTE'].dtype == 'int8'
+    agregado = dash.agregar_microdados(base, dimensoes, dropna=dropna)
+    assert agregado['MORTE'].dtype == 'int64'
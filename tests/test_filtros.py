@@ -0,0 +1,68 @@
+"""Filtros globais pelo índice invertido (posicoes_filtradas) contra a máscara booleana original"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dashboard_sus_v2 as dash
+
+def mascara_original(df, filtros):
+    """Máscara equivalente ao aplicar_filtros anterior ao índice (um isin por filtro ativo)"""
+    mascara = pd.Series(True, index=df.index)
+    if 'data_inicio' in filtros and 'data_fim' in filtros:
+        datas = df['DATA_CMPT'].dt.date
+        mascara &= (datas >= filtros['data_inicio']) & (datas <= filtros['data_fim'])
+    for chave, col in dash.colunas_dos_filtros(df.columns):
+        if filtros.get(chave):
+            mascara &= df[col].isin(filtros[chave])
+    return mascara.to_numpy()
+
+@pytest.fixture(scope="module")
+def pequena():
+    """Base pequena com códigos ausentes em todas as colunas de filtro, CNES numérico e uma data ausente"""
+    rng = np.random.default_rng(7)
+    n = 400
+    def categoria(valores, ausentes=0.1):
+        serie = pd.Series(rng.choice(valores, n), dtype='category')
+        return serie.mask(rng.random(n) < ausentes)
+    datas = pd.Series(pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 120, n), unit='D'))
+    datas[5] = pd.NaT
+    cnes = pd.Series(rng.choice([2100001, 2100002, 2100003], n), dtype='float64').mask(rng.random(n) < 0.1)
+    return pd.DataFrame({
+        'DATA_CMPT': datas,
+        'NOME_MUNIC_RES': categoria(['BETIM', 'CONTAGEM', 'SABARA', 'NOVA LIMA']),
+        'NOME_MUNIC_MOV': categoria(['BETIM', 'CONTAGEM', 'BELO HORIZONTE']),
+        'CNES': cnes,
+        'SEXO': categoria(['Masculino', 'Feminino']),
+        'FAIXA_ETARIA': categoria(['0-9', '10-19', '20-29', '80+']),
+        'RACA_COR': categoria(['Branca', 'Parda', 'Preta']),
+        'NOME_CID_PRINC': categoria(['DOENCA A00', 'DOENCA B00', 'DOENCA C00']),
+    })
+
+COMBINACOES = [
+    {},
+    {'municipio_residencia': ['BETIM', 'SABARA']},
+    {'municipio_residencia': ['BETIM', 'INEXISTENTE'], 'sexo': ['Feminino'], 'cnes': [2100001, 2100003]},
+    {'data_inicio': datetime.date(2025, 1, 15), 'data_fim': datetime.date(2025, 3, 10)},
+    {'data_inicio': datetime.date(2025, 2, 14), 'data_fim': datetime.date(2025, 2, 14),
+     'faixa_etaria': ['0-9', '80+']},
+    {'data_inicio': datetime.date(2025, 1, 20), 'data_fim': datetime.date(2025, 4, 5),
+     'municipio_atendimento': ['CONTAGEM', 'BELO HORIZONTE'], 'raca_cor': ['Parda', 'Preta'],
+     'cid': ['DOENCA A00', 'DOENCA C00']},
+    {'sexo': [], 'cid': ['INEXISTENTE']},
+    {'data_inicio': datetime.date(2024, 12, 1), 'data_fim': datetime.date(2025, 12, 31)},
+]
+
+@pytest.mark.parametrize("filtros", COMBINACOES)
+def test_posicoes_iguais_a_mascara(pequena, filtros):
+    esperado = np.flatnonzero(mascara_original(pequena, filtros))
+    posicoes = dash.posicoes_filtradas(dash.construir_indice_filtros(pequena), filtros)
+    obtido = np.arange(len(pequena)) if posicoes is None else posicoes
+    np.testing.assert_array_equal(obtido, esperado)
+
+def test_sem_filtro_restritivo_devolve_none(pequena):
+    indice = dash.construir_indice_filtros(pequena)
+    assert dash.posicoes_filtradas(indice, {}) is None
+    assert dash.posicoes_filtradas(indice, {'sexo': []}) is None
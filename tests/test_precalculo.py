@@ -0,0 +1,61 @@
+"""Pré-cálculo: consultas declaradas para os processos do pool e resultados de precalcular_fatia"""
+
+import logging
+from collections import deque
+
+import pandas as pd
+import pytest
+
+import dashboard_sus_v2 as dash
+
+@pytest.fixture(scope="module")
+def sem_avisos_do_streamlit():
+    """Os painéis rodam fora do `streamlit run`: silencia os avisos desse modo"""
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
+
+def test_consultas_declaradas_cobrem_os_paineis(base, sem_avisos_do_streamlit, monkeypatch):
+    """Toda consulta feita pelos painéis de dados está em consultas_dos_paineis()"""
+    cache = dash.CacheAgregados(2 ** 30)
+    monkeypatch.setattr(dash, 'cache_agregados', lambda: cache)
+    filtros = {'municipio_residencia': [base['NOME_MUNIC_RES'].dropna().iloc[0]]}
+    cubo = dash.construir_cubo(base)
+    visao = dash.VisaoFiltrada(base, dash.posicoes_filtradas(dash.construir_indice_filtros(base), filtros),
+                               chave='fatia')
+    for _, exibir in dash.paineis_com_dados(visao, dash.filtrar_cubo(cubo, filtros), dash.construir_dimensoes(base)):
+        exibir()
+
+    feitas = {consulta for (_, consulta) in cache._itens if consulta[0] == 'consultar'}
+    declaradas = {('consultar', dimensoes, dropna) for dimensoes, dropna in dash.consultas_dos_paineis(base.columns)}
+    assert feitas and feitas <= declaradas
+
+def test_precalcular_fatia_igual_a_consultar(base, tmp_path):
+    snapshot = tmp_path / 'base.arrow'
+    dash.salvar_snapshot(base, snapshot)
+    filtros = {'cid': [base['NOME_CID_PRINC'].dropna().iloc[0]]}
+    cubo = dash.filtrar_cubo(dash.construir_cubo(base), filtros)
+    posicoes = dash.posicoes_filtradas(dash.construir_indice_filtros(base), filtros)
+    consultas = dash.consultas_dos_paineis(base.columns)
+
+    resultados = dash.precalcular_fatia(snapshot, posicoes, cubo, consultas)
+    assert [consulta for consulta, _ in resultados] == [('consultar', d, n) for d, n in consultas]
+    filtrado = base.take(posicoes)
+    for (_, dimensoes, dropna), resultado in resultados:
+        pd.testing.assert_frame_equal(resultado, dash.consultar(filtrado, cubo, dimensoes, dropna))
+
+def test_pool_encerrado_cancela_as_fatias_restantes():
+    """submit() recusado (pool encerrado, interpretador saindo): o pool é encerrado e o pré-cálculo fica cancelado"""
+    class PoolEncerrado:
+        encerrado = False
+        def submit(self, *args):
+            raise RuntimeError("cannot schedule new futures after shutdown")
+        def shutdown(self, wait=True, cancel_futures=False):
+            self.encerrado = True
+
+    pool, fatias = PoolEncerrado(), [{'filtro': 'sexo', 'valor': valor, 'linhas': 1} for valor in ['F', 'M']]
+    pre = dash.PreCalculo(dash.CacheAgregados(2 ** 20))
+    pre._fatias, pre._pendentes, pre._pool, pre._argumentos = fatias, deque(fatias), pool, lambda fatia: ()
+    pre._enviar(pre._geracao)
+    assert pool.encerrado and pre.cancelado and not pre.em_andamento() and not pre._pendentes
+    assert pre.resumo().startswith("0/2 fatias (cancelado)")